@@ -1,45 +1,128 @@
-from django.contrib import admin
-from django.utils import timezone
-from .models import Book, Borrowing
+from django import forms
+from django.contrib import admin, messages
+from django.db.models import F
+from . import routing, services
+from .models import ArchivedBorrowing, Book, Borrowing, Hold, Recommendation
+
+class AvailabilityFilter(admin.SimpleListFilter):
+    title = 'availability'
+    parameter_name = 'available'
+
+    def lookups(self, request, model_admin):
+        return [('1', 'Copies on the shelf'), ('0', 'All copies out')]
+
+    def queryset(self, request, queryset):
+        if self.value() == '1':
+            return queryset.filter(available_count__gt=0)
+        if self.value() == '0':
+            return queryset.filter(available_count=0)
+        return queryset
+
+
+class BookAdminForm(forms.ModelForm):
+    class Meta:
+        model = Book
+        exclude = ('available_count',)
+
+    def clean_copies(self):
+        copies = self.cleaned_data['copies']
+        if self.instance.pk:
+            # services.set_copies checks again under the book's lock
+            on_loan = Book.objects.filter(pk=self.instance.pk).values_list(
+                F('copies') - F('available_count'), flat=True).get()
+            if copies < on_loan:
+                raise forms.ValidationError(f'{on_loan} copies are on loan; there cannot be fewer copies than that.')
+        return copies
+
 
 @admin.register(Book)
 class BookAdmin(admin.ModelAdmin):
-    list_display = ('title', 'author', 'isbn', 'category', 'is_available')
+    form = BookAdminForm
+    list_display = ('title', 'author', 'isbn', 'category', 'copies', 'available_count')
     search_fields = ('title', 'author', 'isbn')
-    list_filter = ('is_available', 'category')
+    list_filter = (AvailabilityFilter, 'category')
+    # Moves only through library.services; saving a stale form must not overwrite it
+    readonly_fields = ('available_count',)
     
     # The admin can add/edit books here as requested
+
+    def save_model(self, request, obj, form, change):
+        if not change:
+            obj.available_count = obj.copies
+            return super().save_model(request, obj, form, change)
+        # Only the edited columns are written; copies go through the service
+        fields = [name for name in form.changed_data if name != 'copies']
+        if fields:
+            obj.save(update_fields=fields + ['updated_at'])
+        if 'copies' in form.changed_data:
+            if services.set_copies(obj.pk, obj.copies) == services.TOO_FEW_COPIES:
+                self.message_user(request, 'Copies not changed: more copies are on loan now.', messages.ERROR)
+        obj.refresh_from_db(fields=['copies', 'available_count'])
+
+    @routing.replica_reads
+    def changelist_view(self, request, extra_context=None):
+        # Browsing reads from a replica; saves (and the pages after them) use the primary
+        return super().changelist_view(request, extra_context)
     
+@admin.register(Hold)
+class HoldAdmin(admin.ModelAdmin):
+    list_display = ('book', 'student', 'position', 'created_at')
+    list_select_related = ('student', 'book')
+    search_fields = ('student__username', 'book__title')
+    raw_id_fields = ('book', 'student')
+
+@admin.register(Recommendation)
+class RecommendationAdmin(admin.ModelAdmin):
+    # Rebuilt by manage.py recommend_books; edits here would be overwritten
+    list_display = ('book', 'rank', 'recommended', 'score', 'co_readers', 'computed_at')
+    list_select_related = ('book', 'recommended')
+    search_fields = ('book__title',)
+    raw_id_fields = ('book', 'recommended')
+
+@admin.register(ArchivedBorrowing)
+class ArchivedBorrowingAdmin(admin.ModelAdmin):
+    # Filled by manage.py archive_borrowings; closed rows are history, not editable
+    list_display = ('student', 'book', 'status', 'request_date', 'return_date', 'archived_at')
+    list_select_related = ('student', 'book')
+    list_filter = ('status',)
+    search_fields = ('student__username', 'book__title')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 @admin.register(Borrowing)
 class BorrowingAdmin(admin.ModelAdmin):
-    list_display = ('student', 'book', 'status', 'request_date', 'approved_date')
-    list_filter = ('status',)
+    list_display = ('student', 'book', 'status', 'request_date', 'approved_date', 'due_date', 'is_overdue')
+    # Join student and book into the changelist query instead of one query per row
+    list_select_related = ('student', 'book')
+    list_filter = ('status', 'is_overdue')
     search_fields = ('student__username', 'book__title')
+    # Status and dates change only through the actions below (library.services),
+    # which keep available_count, the waitlist and the counters in step
+    readonly_fields = ('status', 'approved_date', 'due_date', 'return_date', 'is_overdue')
+
+    def get_readonly_fields(self, request, obj=None):
+        if obj is None:
+            return self.readonly_fields
+        # Moving a request to another student or book would skip the counters too
+        return ('student', 'book') + self.readonly_fields
     
     # Add custom actions for the admin to approve/reject requests
-    actions = ['approve_requests', 'reject_requests']
+    actions = ['approve_requests', 'reject_requests', 'return_loans']
 
     def approve_requests(self, request, queryset):
         """
         Action to approve selected borrowing requests.
+
+        The earliest selected requests per book win, one per copy on the
+        shelf; when the last copy goes, the other pending requests for that
+        book move to its waitlist.
         """
-        for borrowing in queryset.filter(status='PENDING'):
-            # Set status to Approved
-            borrowing.status = 'APPROVED'
-            borrowing.approved_date = timezone.now()
-            borrowing.save()
-            
-            # Set the book to unavailable
-            borrowing.book.is_available = False
-            borrowing.book.save()
-            
-            # Reject other pending requests for this same book
-            Borrowing.objects.filter(
-                book=borrowing.book, 
-                status='PENDING'
-            ).update(status='REJECTED')
-
-        self.message_user(request, "Selected requests have been approved.")
+        outcomes = services.bulk_approve(queryset.values_list('pk', flat=True))
+        self.message_user(request, f"Selected requests processed: {services.summarize(outcomes)}")
     approve_requests.short_description = "Approve selected requests"
 
     def reject_requests(self, request, queryset):
@@ -47,11 +130,19 @@ class BorrowingAdmin(admin.ModelAdmin):
         Action to reject selected borrowing requests.
         """
         # We only reject pending requests
-        queryset.filter(status='PENDING').update(status='REJECTED')
+        services.reject(queryset.values_list('pk', flat=True))
         
         # Note: We don't make the book available here, 
         # because an approval might be what made it unavailable.
         # Availability is handled by approval and (later) returns.
 
         self.message_user(request, "Selected requests have been rejected.")
-    reject_requests.short_description = "Reject selected requests"
\ No newline at end of file
+    reject_requests.short_description = "Reject selected requests"
+
+    def return_loans(self, request, queryset):
+        """
+        Action to check in the selected loans and make their books available.
+        """
+        outcomes = [services.return_book(pk) for pk in queryset.filter(status='APPROVED').values_list('pk', flat=True)]
+        self.message_user(request, f"{outcomes.count(services.RETURNED)} loans returned.")
+    return_loans.short_description = "Mark selected loans returned"
@@ -0,0 +1,293 @@
+"""
+JSON API for kiosks and the mobile app.
+
+The list endpoints reuse the catalogue filters (``CatalogueQuery``) and the
+keyset paginator, and accept ``?fields=a,b,c`` to return (and load) only the
+listed fields. Every GET carries an ETag and Last-Modified computed from the
+``(id, updated_at)`` pairs of the rows in the response, so a client polling
+for availability gets a 304 without the payload being serialized again.
+"""
+import hashlib
+import json
+from functools import wraps
+
+from django.core.exceptions import BadRequest
+from django.http import JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.views.decorators.http import require_GET, require_POST
+
+from . import pagination, services, typeahead
+from .catalogue import CatalogueQuery
+from .models import ArchivedBorrowing, Book, Borrowing
+
+# Book and Borrowing fields and the columns each one needs loaded
+BOOK_FIELDS = {
+    'id': ('id',),
+    'title': ('title',),
+    'author': ('author',),
+    'isbn': ('isbn',),
+    'category': ('category',),
+    'publication_year': ('publication_year',),
+    'description': ('description',),
+    'copies': ('copies',),
+    'available_count': ('available_count',),
+    'is_available': ('available_count',),
+    'updated_at': ('updated_at',),
+}
+
+BORROWING_FIELDS = {
+    'id': ('id',),
+    'status': ('status',),
+    'request_date': ('request_date',),
+    'approved_date': ('approved_date',),
+    'due_date': ('due_date',),
+    'return_date': ('return_date',),
+    'is_overdue': ('is_overdue',),
+    'updated_at': ('updated_at',),
+    'book': ('book__id', 'book__title'),
+    'student': ('student__username',),
+}
+
+
+def _error(message, status):
+    return JsonResponse({'error': message}, status=status)
+
+
+def api_login_required(view):
+    """Like login_required, but answers 401 instead of redirecting to a form."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return _error('Authentication required.', 401)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def api_staff_required(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            return _error('Authentication required.', 401)
+        if not (request.user.is_active and request.user.is_staff):
+            return _error('Staff access required.', 403)
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def _parse_fields(request, allowed):
+    """The requested sparse fieldset (always including id), or every field."""
+    raw = request.GET.get('fields', '').strip()
+    if not raw:
+        return list(allowed)
+    fields = [name.strip() for name in raw.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in allowed]
+    if unknown:
+        raise BadRequest(f"Unknown fields: {', '.join(unknown)}.")
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+    return fields
+
+
+def _validators(rows, extra=''):
+    """ETag and Last-Modified timestamp for a response built from ``rows``."""
+    versions = [(row.pk, row.updated_at.isoformat()) for row in rows]
+    digest = hashlib.sha1(repr((versions, extra)).encode()).hexdigest()
+    last_modified = max((row.updated_at for row in rows), default=None)
+    return f'"{digest}"', last_modified and int(last_modified.timestamp())
+
+
+def _conditional(request, rows, build, extra=''):
+    """
+    Answer 304 when the client's ETag/Last-Modified still match ``rows``,
+    otherwise call ``build()`` for the JSON payload.
+    """
+    etag, last_modified = _validators(rows, extra)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = JsonResponse(build())
+    response.headers['ETag'] = etag
+    if last_modified:
+        response.headers['Last-Modified'] = http_date(last_modified)
+    # Cacheable per user, but always revalidated
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def _columns(fields, allowed, *extra):
+    """The columns to load for a sparse fieldset."""
+    columns = {'updated_at', *extra}
+    for name in fields:
+        columns.update(allowed[name])
+    return columns
+
+
+def _serialize_book(book, fields):
+    return {name: book.pk if name == 'id' else getattr(book, name) for name in fields}
+
+
+def _serialize_borrowing(borrowing, fields):
+    data = {}
+    for name in fields:
+        if name == 'book':
+            data['book'] = {'id': borrowing.book_id, 'title': borrowing.book.title}
+        elif name == 'student':
+            data['student'] = borrowing.student.username
+        elif name == 'id':
+            data['id'] = borrowing.pk
+        else:
+            data[name] = getattr(borrowing, name)
+    return data
+
+
+def _paginate(request, queryset, order_field):
+    return pagination.paginate(
+        queryset,
+        order_field,
+        cursor=request.GET.get('cursor'),
+        page_size=pagination.parse_page_size(request.GET.get('per_page')),
+    )
+
+
+def _borrowing_page(request, querysets, order_field, allowed=BORROWING_FIELDS):
+    """One page of borrowings merged from ``querysets`` (live and archived rows)."""
+    fields = _parse_fields(request, allowed)
+    columns = _columns(fields, allowed, order_field.lstrip('-'))
+    related = [name for name in ('book', 'student') if name in fields]
+    if related:
+        querysets = [queryset.select_related(*related) for queryset in querysets]
+    querysets = [queryset.only(*columns) for queryset in querysets]
+    page = pagination.paginate_merged(
+        querysets,
+        order_field,
+        cursor=request.GET.get('cursor'),
+        page_size=pagination.parse_page_size(request.GET.get('per_page')),
+    )
+    return _list_response(request, page, fields, _serialize_borrowing)
+
+
+def _list_response(request, page, fields, serialize):
+    return _conditional(
+        request,
+        page.object_list,
+        lambda: {
+            'results': [serialize(row, fields) for row in page],
+            'next_cursor': page.next_cursor,
+        },
+        extra=(fields, page.next_cursor),
+    )
+
+
+def _bad_request_as_json(view):
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except BadRequest as exc:
+            return _error(str(exc), 400)
+    return wrapper
+
+
+@api_login_required
+@require_GET
+@_bad_request_as_json
+def book_list(request):
+    """Catalogue search with the same filters and sorts as the HTML book list."""
+    query = CatalogueQuery(request.GET)
+    fields = _parse_fields(request, BOOK_FIELDS)
+    columns = _columns(fields, BOOK_FIELDS)
+    if query.order_field != 'search_rank':
+        # The paginator reads the sort key off the last row
+        columns.add(query.order_field.lstrip('-'))
+    page = _paginate(request, query.books.only(*columns), query.order_field)
+    return _list_response(request, page, fields, _serialize_book)
+
+
+SUGGEST_LIMIT = 8
+MAX_SUGGEST_LIMIT = 20
+
+
+@api_login_required
+@require_GET
+@_bad_request_as_json
+def book_suggestions(request):
+    """Search-box suggestions for ``?q=`` from the in-process typeahead index."""
+    try:
+        limit = min(MAX_SUGGEST_LIMIT, max(1, int(request.GET.get('limit', SUGGEST_LIMIT))))
+    except ValueError:
+        raise BadRequest('limit must be a number.')
+    query = request.GET.get('q', '')
+    response = JsonResponse({'query': query, 'suggestions': typeahead.suggest(query, limit)})
+    # Keystrokes repeat prefixes; let the browser reuse recent answers briefly
+    patch_cache_control(response, private=True, max_age=30)
+    return response
+
+
+@api_login_required
+@require_GET
+@_bad_request_as_json
+def book_detail(request, pk):
+    fields = _parse_fields(request, BOOK_FIELDS)
+    book = Book.objects.only(*_columns(fields, BOOK_FIELDS)).filter(pk=pk).first()
+    if book is None:
+        return _error('Book not found.', 404)
+    return _conditional(request, [book], lambda: _serialize_book(book, fields), extra=fields)
+
+
+@api_login_required
+@require_GET
+@_bad_request_as_json
+def my_borrowings(request):
+    """The current user's borrowings, archived ones included, newest request first."""
+    return _borrowing_page(request, [
+        Borrowing.objects.filter(student=request.user),
+        ArchivedBorrowing.objects.filter(student=request.user),
+    ], '-request_date')
+
+
+@api_staff_required
+@require_GET
+@_bad_request_as_json
+def pending_requests(request):
+    """The staff queue of pending requests, oldest first."""
+    return _borrowing_page(request, [Borrowing.objects.filter(status='PENDING')], 'request_date')
+
+
+@api_staff_required
+@require_POST
+def approve_request(request, pk):
+    outcome = services.approve(pk)
+    return JsonResponse({'id': pk, 'outcome': outcome}, status=200 if outcome == services.APPROVED else 409)
+
+
+@api_staff_required
+@require_POST
+def reject_request(request, pk):
+    outcome = services.REJECTED if services.reject([pk]) else services.NOT_PENDING
+    return JsonResponse({'id': pk, 'outcome': outcome}, status=200 if outcome == services.REJECTED else 409)
+
+
+@api_staff_required
+@require_POST
+def return_loan(request, pk):
+    outcome = services.return_book(pk)
+    return JsonResponse({'id': pk, 'outcome': outcome}, status=200 if outcome == services.RETURNED else 409)
+
+
+@api_staff_required
+@require_POST
+def bulk_approve_requests(request):
+    """Body: ``{"ids": [...]}``. Returns the outcome for every affected request."""
+    try:
+        ids = json.loads(request.body or b'{}').get('ids', [])
+        ids = [int(pk) for pk in ids]
+    except (ValueError, TypeError, AttributeError):
+        return _error('Expected a JSON body like {"ids": [1, 2, 3]}.', 400)
+    if not ids:
+        return _error('No requests were selected.', 400)
+
+    outcomes = services.bulk_approve(ids)
+    return JsonResponse({
+        'results': [{'id': pk, 'outcome': outcome} for pk, outcome in sorted(outcomes.items())],
+        'summary': services.summarize(outcomes),
+    })
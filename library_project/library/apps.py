@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class LibraryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'library'
+
+    def ready(self):
+        # Register signal handlers (search index sync)
+        from . import signals  # noqa: F401
+
+        # Time every query for the profiling middleware
+        from django.db.backends.signals import connection_created
+        from . import profiling
+        connection_created.connect(profiling.install)
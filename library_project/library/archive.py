@@ -0,0 +1,73 @@
+"""
+Archival of closed borrowings.
+
+Rejected, returned and waitlisted borrowings never change again, but left
+in the Borrowing table they make every index and scan used by the live
+request/approval paths bigger. ``archive()`` moves those that closed more
+than a given age ago (by ``updated_at``, which the close bumped) into
+ArchivedBorrowing.
+
+Rows move in batches, walking the primary key. Each batch is its own short
+transaction: copy the rows, then delete them. The write lock is only held
+for one batch at a time, so borrowing requests keep flowing while a large
+backlog is archived. A crash leaves every batch either moved or untouched.
+
+Closed rows don't count towards any LibraryStats counter, so nothing else
+needs adjusting. The code that reads history (student_profile, the
+borrowings export, the daily loan recount and the recommendations) reads
+the archive as well.
+"""
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ArchivedBorrowing, Borrowing
+
+CLOSED_STATUSES = ('REJECTED', 'RETURNED', 'WAITLISTED')
+DEFAULT_BATCH_SIZE = 1000
+# Columns copied as they are; the id is kept too
+FIELDS = ('student_id', 'book_id', 'request_date', 'status', 'approved_date', 'due_date',
+          'return_date', 'is_overdue', 'updated_at')
+
+
+def closed_before(cutoff):
+    return Borrowing.objects.filter(status__in=CLOSED_STATUSES, updated_at__lt=cutoff)
+
+
+def _move_batch(cutoff, after, batch_size, now):
+    """Move the next batch with ids above ``after``; returns ``(rows moved, last id)``."""
+    with transaction.atomic():
+        rows = list(
+            closed_before(cutoff).filter(pk__gt=after).order_by('pk').values_list('pk', *FIELDS)[:batch_size]
+        )
+        if not rows:
+            return 0, None
+        ArchivedBorrowing.objects.bulk_create(
+            ArchivedBorrowing(id=row[0], archived_at=now, **dict(zip(FIELDS, row[1:]))) for row in rows
+        )
+        pks = [row[0] for row in rows]
+        Borrowing.objects.filter(pk__in=pks, status__in=CLOSED_STATUSES).delete()
+    return len(rows), pks[-1]
+
+
+def archive(older_than_days, batch_size=DEFAULT_BATCH_SIZE, pause=0.0, now=None):
+    """
+    Move borrowings closed more than ``older_than_days`` ago into the archive,
+    ``batch_size`` at a time, sleeping ``pause`` seconds between batches.
+
+    Yields the number of rows moved by each batch.
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(days=older_than_days)
+    after = 0
+    while True:
+        moved, after = _move_batch(cutoff, after, batch_size, now)
+        if not moved:
+            return
+        yield moved
+        if moved < batch_size:
+            return
+        if pause:
+            time.sleep(pause)
@@ -0,0 +1,33 @@
+"""
+Authentication backend that serves users from the cache.
+
+Every authenticated request loads its session and then its user. The
+session comes from the ``cached_db`` engine set in settings: it is read
+from the cache and written through to the database. The user comes from
+``CachedModelBackend`` below, which reads it through ``caching.get_user``.
+A warm request therefore runs no queries before its view.
+
+The User signals drop a cached row when the user is saved or deleted, once
+the transaction commits. The next request reloads the row, so changes to
+``is_staff``, ``is_active`` or the password apply straight away. A password
+change still ends the user's other sessions: their session hash no longer
+matches. Changes made with ``queryset.update()`` skip the signals and show
+up within ``caching.USER_TIMEOUT``. With the per-process locmem cache
+(``LIBRARY_CACHE``), invalidation only reaches the process that made the
+change; use the file or Redis cache when running several.
+"""
+from django.contrib.auth.backends import ModelBackend
+
+from . import caching
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend with ``get_user`` served from the cache."""
+
+    def get_user(self, user_id):
+        user = caching.get_user(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        user = await caching.aget_user(user_id)
+        return user if user is not None and self.user_can_authenticate(user) else None
@@ -0,0 +1,402 @@
+"""
+Repeatable view benchmarks, run through Django's test client.
+
+Each scenario requests one view ``iterations`` times and records the latency
+of every request and the number of queries it ran. Requests and fixtures are
+picked with a seeded ``random.Random``, so two runs against the same seeded
+database (``manage.py seed_library``) issue the same requests. The whole run
+happens inside one transaction that is rolled back at the end, so the write
+benchmarks leave the database as they found it and a run can be repeated on
+every commit. ``compare()`` lines two reports up.
+
+``auth_queries()`` counts the queries each authenticated page runs with the
+stock database sessions and ModelBackend, then with the cached session and
+user lookups in settings, so the difference is what ``library.auth`` saves.
+
+``typeahead_footprint()`` needs no database: it builds the suggestion index
+over synthetic titles and measures its memory and lookup latency.
+
+``write_throughput()`` is the odd one out: it measures how many
+``request_book`` POSTs concurrent clients get through, so it has to commit.
+It works with throwaway students and deletes them (and their requests)
+afterwards.
+
+With ``cache='cold'`` the cache is cleared before every request, so the
+numbers measure the queries and rendering, not the page cache.
+"""
+import platform
+import random
+import statistics
+import subprocess
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import OperationalError, connection, connections, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import seeding, services, typeahead
+from .catalogue import SORT_MAP
+from .models import Book, Borrowing
+
+PERCENTILES = (50, 90, 95, 99)
+STAFF_USERNAME = 'benchmark-staff'
+WRITER_PREFIX = 'benchmark-writer-'
+# Session and auth settings before the cached lookups (see library.auth)
+UNCACHED_AUTH = {
+    'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+    'AUTHENTICATION_BACKENDS': ['django.contrib.auth.backends.ModelBackend'],
+}
+
+
+class Scenario:
+    """
+    A named view request. ``prepare(i)`` runs untimed before request ``i``
+    and returns ``(user, method, url, data)``.
+    """
+
+    def __init__(self, name, prepare):
+        self.name = name
+        self.prepare = prepare
+
+
+def _distribution(values):
+    ordered = sorted(values)
+    result = {'min': ordered[0], 'max': ordered[-1], 'mean': statistics.fmean(ordered)}
+    for p in PERCENTILES:
+        # Nearest rank, as in library.profiling
+        result[f'p{p}'] = ordered[max(0, -(-p * len(ordered) // 100) - 1)]
+    return result
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class Benchmark:
+    def __init__(self, iterations=20, warmup=2, cache_mode='cold', seed=0):
+        self.iterations = iterations
+        self.warmup = warmup
+        self.cache_mode = cache_mode
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.client = Client()
+        self._logged_in = None
+
+    def _fixtures(self):
+        self.staff, _ = User.objects.get_or_create(username=STAFF_USERNAME, defaults={'is_staff': True})
+        self.students = list(User.objects.filter(is_staff=False).order_by('pk').values_list('pk', flat=True))
+        self.reader = User.objects.filter(pk__in=self.students[:1]).first()
+        self.book_ids = list(Book.objects.order_by('pk').values_list('pk', flat=True))
+        self.available_ids = list(Book.objects.filter(available_count__gt=0).order_by('pk')
+                                  .values_list('pk', flat=True))
+        if not (self.students and self.available_ids):
+            raise ValueError('The benchmarks need students and available books; run seed_library first.')
+        top = Book.objects.exclude(category=None).values_list('category', 'author').order_by('pk').first()
+        self.category, self.author = top or ('', '')
+        self.word = (Book.objects.order_by('pk').values_list('title', flat=True).first() or 'a').split()[0]
+
+    def _login(self, user):
+        if self._logged_in != user.pk:
+            self.client.force_login(user)
+            self._logged_in = user.pk
+
+    def _student(self):
+        return User.objects.get(pk=self.rng.choice(self.students))
+
+    def scenarios(self):
+        book_list = reverse('book_list')
+        filters = {
+            'all': {}, 'category': {'category': self.category}, 'author': {'author': self.author},
+            'available': {'available': '1'}, 'search': {'q': self.word},
+        }
+        for filter_name, params in filters.items():
+            for sort in SORT_MAP:
+                yield Scenario(f'book_list[{filter_name},sort={sort}]',
+                               lambda i, params=params, sort=sort: (self.reader, 'get', book_list,
+                                                                    {**params, 'sort': sort}))
+
+        yield Scenario('book_detail', lambda i: (
+            self.reader, 'get', reverse('book_detail', args=[self.rng.choice(self.book_ids)]), {}))
+
+        def request_book(i):
+            return self._student(), 'post', reverse('request_book', args=[self.rng.choice(self.available_ids)]), {}
+        yield Scenario('request_book', request_book)
+
+        def approve_request(i):
+            # A fresh pending request per iteration, made outside the timed request
+            while True:
+                student, book_id = self._student(), self.rng.choice(self.available_ids)
+                outcome = services.request_book(student, Book(pk=book_id))
+                if outcome == services.REQUESTED:
+                    break
+                if outcome == services.QUEUED:
+                    self.available_ids.remove(book_id)
+            pending = Borrowing.objects.get(student=student, book_id=book_id, status='PENDING')
+            return self.staff, 'post', reverse('approve_request', args=[pending.pk]), {}
+        yield Scenario('approve_request', approve_request)
+
+        yield Scenario('pending_requests', lambda i: (self.staff, 'get', reverse('admin_pending_requests'), {}))
+
+    def run_scenario(self, scenario):
+        latencies, queries, statuses = [], [], {}
+        for i in range(self.warmup + self.iterations):
+            user, method, url, data = scenario.prepare(i)
+            self._login(user)
+            if self.cache_mode == 'cold':
+                cache.clear()
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                response = getattr(self.client, method)(url, data)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                elapsed = time.perf_counter() - started
+            if i < self.warmup:
+                continue
+            latencies.append(elapsed * 1000)
+            queries.append(len(ctx.captured_queries))
+            statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+        return {
+            'iterations': self.iterations,
+            'status_codes': statuses,
+            'latency_ms': _distribution(latencies),
+            'queries': _distribution(queries),
+        }
+
+    def run(self, only=None):
+        """Run every scenario whose name contains ``only``; returns the JSON-ready report."""
+        results = {}
+        # The test client talks to 'testserver'
+        hosts = override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'])
+        with hosts, transaction.atomic():
+            self._fixtures()
+            data = {
+                'books': len(self.book_ids),
+                'students': len(self.students),
+                'borrowings': Borrowing.objects.count(),
+            }
+            for scenario in self.scenarios():
+                if only and only not in scenario.name:
+                    continue
+                results[scenario.name] = self.run_scenario(scenario)
+            transaction.set_rollback(True)
+        cache.clear()
+        return {
+            'created': timezone.now().isoformat(),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'data': data,
+            'iterations': self.iterations,
+            'warmup': self.warmup,
+            'cache': self.cache_mode,
+            'seed': self.seed,
+            'scenarios': results,
+        }
+
+
+def _database_profile():
+    profile = {'vendor': connection.vendor, 'conn_max_age': connection.settings_dict['CONN_MAX_AGE']}
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for pragma in ('journal_mode', 'synchronous', 'busy_timeout'):
+                cursor.execute(f'PRAGMA {pragma}')
+                profile[pragma] = cursor.fetchone()[0]
+    else:
+        profile['pool'] = connection.settings_dict['OPTIONS'].get('pool', False)
+    return profile
+
+
+def write_throughput(clients=8, requests_per_client=50, seed=0):
+    """
+    ``clients`` threads, each logged in as its own student, POST
+    request_book as fast as they can for books that are on the shelf.
+    Every request is for a different book, so each one inserts a row.
+
+    Returns the JSON-ready report: requests per second, latency
+    distribution, status codes and errors such as "database is locked".
+    """
+    rng = random.Random(seed)
+    book_ids = list(Book.objects.filter(available_count__gt=0).values_list('pk', flat=True))
+    if not book_ids:
+        raise ValueError('The write benchmark needs available books; run seed_library first.')
+    rng.shuffle(book_ids)
+
+    User.objects.filter(username__startswith=WRITER_PREFIX).delete()
+    writers = User.objects.bulk_create(User(username=f'{WRITER_PREFIX}{i}') for i in range(clients))
+    latencies, statuses, errors = [], Counter(), Counter()
+    lock = threading.Lock()
+    started = []
+    barrier = threading.Barrier(clients, action=lambda: started.append(time.perf_counter()))
+
+    def run(i):
+        client = Client()
+        client.force_login(writers[i])
+        mine = [book_ids[(i * requests_per_client + n) % len(book_ids)] for n in range(requests_per_client)]
+        barrier.wait()
+        try:
+            for book_id in mine:
+                begun = time.perf_counter()
+                try:
+                    status = str(client.post(reverse('request_book', args=[book_id])).status_code)
+                except OperationalError as e:
+                    status = None
+                    with lock:
+                        errors[str(e)] += 1
+                elapsed = time.perf_counter() - begun
+                with lock:
+                    latencies.append(elapsed * 1000)
+                    if status:
+                        statuses[status] += 1
+        finally:
+            connections.close_all()
+
+    hosts = override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'])
+    with hosts:
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    seconds = time.perf_counter() - started[0]
+
+    # The Borrowing delete signals take the requests back off the counters
+    User.objects.filter(pk__in=[writer.pk for writer in writers]).delete()
+    cache.clear()
+    completed = sum(statuses.values())
+    return {
+        'created': timezone.now().isoformat(),
+        'commit': _git_commit(),
+        'database': _database_profile(),
+        'clients': clients,
+        'requests': len(latencies),
+        'seconds': seconds,
+        'requests_per_second': completed / seconds if seconds else 0.0,
+        'status_codes': dict(statuses),
+        'errors': dict(errors),
+        'latency_ms': _distribution(latencies),
+    }
+
+
+def auth_queries(iterations=10, seed=0):
+    """
+    Median queries per request of the authenticated pages, warm, with
+    UNCACHED_AUTH ('before') and with the settings in use ('after').
+    Like ``Benchmark.run()``, it runs in a transaction that is rolled back.
+    """
+    runner = Benchmark(seed=seed)
+    results = {}
+    hosts = override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'])
+    with hosts, transaction.atomic():
+        runner._fixtures()
+        pages = (
+            ('book_list', runner.reader, reverse('book_list')),
+            ('book_detail', runner.reader, reverse('book_detail', args=[runner.book_ids[0]])),
+            ('student_profile', runner.reader, reverse('student_profile')),
+            ('admin_dashboard', runner.staff, reverse('admin_dashboard')),
+            ('pending_requests', runner.staff, reverse('admin_pending_requests')),
+            ('active_loans', runner.staff, reverse('admin_active_loans')),
+        )
+        for mode, overrides in (('before', UNCACHED_AUTH), ('after', {})):
+            with override_settings(**overrides):
+                cache.clear()
+                # New clients: the session middleware picks its engine when it loads
+                clients = {}
+                for user in {user for _, user, _ in pages}:
+                    clients[user] = Client()
+                    clients[user].force_login(user)
+                for name, user, url in pages:
+                    client = clients[user]
+                    client.get(url)  # warm the page caches
+                    counts = []
+                    for _ in range(iterations):
+                        with CaptureQueriesContext(connection) as ctx:
+                            client.get(url)
+                        counts.append(len(ctx.captured_queries))
+                    results.setdefault(name, {})[mode] = statistics.median(counts)
+        transaction.set_rollback(True)
+    cache.clear()
+
+    for counts in results.values():
+        counts['saved'] = counts['before'] - counts['after']
+    return {
+        'created': timezone.now().isoformat(),
+        'commit': _git_commit(),
+        'session_engine': settings.SESSION_ENGINE,
+        'authentication_backends': list(settings.AUTHENTICATION_BACKENDS),
+        'iterations': iterations,
+        'pages': results,
+    }
+
+
+def typeahead_footprint(titles=100_000, queries=2000, limit=8, seed=0):
+    """
+    Build the typeahead index over ``titles`` synthetic books and report its
+    build time, memory (traced allocations, per 100k titles) and the latency
+    of ``queries`` lookups for random 1-8 character prefixes.
+    """
+    rng = random.Random(seed)
+    rows = [(pk, book.title, book.author, f'978{pk:010d}')
+            for pk, book in enumerate(seeding._books(rng, titles), 1)]
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    index = typeahead.Index.build(rows)
+    build_seconds = time.perf_counter() - started
+    memory, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    prefixes = []
+    for _ in range(queries):
+        _, title, author, isbn = rng.choice(rows)
+        source = rng.choice((title, title.split(' ', 1)[-1], author, isbn))
+        prefixes.append(source[:rng.randint(1, 8)])
+    latencies, found = [], 0
+    for prefix in prefixes:
+        begun = time.perf_counter()
+        found += len(index.suggest(prefix, limit))
+        latencies.append((time.perf_counter() - begun) * 1_000_000)
+
+    return {
+        'created': timezone.now().isoformat(),
+        'commit': _git_commit(),
+        'titles': titles,
+        'entries': {kind: len(keys) for kind, keys in index.keys.items()},
+        'build_seconds': build_seconds,
+        'memory_bytes': memory,
+        'memory_bytes_per_100k_titles': memory * 100_000 // max(1, titles),
+        'peak_build_bytes': peak,
+        'queries': queries,
+        'limit': limit,
+        'mean_suggestions': found / max(1, queries),
+        'latency_us': _distribution(latencies),
+    }
+
+
+def compare(baseline, current):
+    """``[(scenario, p50 change, p95 change, query change)]`` between two reports; changes are ratios."""
+    rows = []
+    for name, result in current['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if before is None:
+            continue
+        rows.append((
+            name,
+            result['latency_ms']['p50'] / before['latency_ms']['p50'] - 1 if before['latency_ms']['p50'] else 0.0,
+            result['latency_ms']['p95'] / before['latency_ms']['p95'] - 1 if before['latency_ms']['p95'] else 0.0,
+            result['queries']['max'] - before['queries']['max'],
+        ))
+    return rows
@@ -0,0 +1,245 @@
+"""
+Response and fragment caching for the catalogue.
+
+Four things are cached, all in the default Django cache (local memory,
+file-based or Redis depending on ``LIBRARY_CACHE`` in settings):
+
+* rendered book cards, one key per book, fetched a page at a time with
+  ``get_many``;
+* the user-independent body of ``book_list`` pages, keyed by the normalized
+  query parameters plus a catalogue generation number;
+* Book rows for ``book_detail``;
+* User rows for the authentication backend (``library.auth``), so an
+  authenticated request doesn't query ``auth_user`` before its view runs.
+  The password hash is left out; only the session hash derived from it is
+  kept.
+
+Invalidation is precise: a change to a book deletes its card and detail
+keys. Only a change to a field that list pages filter, sort or show on a
+card (``LIST_FIELDS``) also bumps the generation, which retires every cached
+list page at once; editing a description or an ISBN keeps them. It runs on
+commit, from the Book signals, from the borrowing services that move a
+book's available_count and from the bulk paths that bypass signals.
+Borrowing changes that leave the count alone (a new request, a rejection)
+keep every cached page. Entries filled from a read replica get a timeout no longer
+than the read-your-writes window (see ``library.routing``).
+"""
+import hashlib
+import threading
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.base_user import AbstractBaseUser
+from django.core.cache import cache
+from django.db import transaction
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from . import routing
+
+CARD_TEMPLATE = 'library/book_card.html'
+CARD_TIMEOUT = 60 * 60
+BOOK_TIMEOUT = 60 * 60
+# Also bounds how long changes made without signals (queryset.update()) take to show
+USER_TIMEOUT = 5 * 60
+LIST_TIMEOUT = 10 * 60
+
+GENERATION_KEY = 'library:catalogue:generation'
+
+# Query parameters that select a book_list page; anything else is ignored
+LIST_PARAMS = ('q', 'category', 'author', 'available', 'sort', 'cursor', 'per_page')
+
+# Book fields that book_list pages filter, sort or render on a card
+LIST_FIELDS = ('title', 'author', 'category', 'publication_year', 'copies', 'available_count')
+
+_metrics = defaultdict(lambda: {'hits': 0, 'misses': 0})
+_metrics_lock = threading.Lock()
+
+
+def _record(kind, hits=0, misses=0):
+    with _metrics_lock:
+        _metrics[kind]['hits'] += hits
+        _metrics[kind]['misses'] += misses
+
+
+def metrics():
+    """Hit/miss counters per cache kind for this process, with hit ratios."""
+    with _metrics_lock:
+        snapshot = {kind: dict(counts) for kind, counts in _metrics.items()}
+    for counts in snapshot.values():
+        total = counts['hits'] + counts['misses']
+        counts['ratio'] = counts['hits'] / total if total else 0.0
+    return snapshot
+
+
+def reset_metrics():
+    with _metrics_lock:
+        _metrics.clear()
+
+
+def card_key(pk):
+    return f'library:card:{pk}'
+
+
+def book_key(pk):
+    return f'library:book:{pk}'
+
+
+def generation():
+    return cache.get_or_set(GENERATION_KEY, 0, None)
+
+
+async def ageneration():
+    return await cache.aget_or_set(GENERATION_KEY, 0, None)
+
+
+def _bump_generation():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, None)
+
+
+def book_cards(books):
+    """Rendered card HTML for each book, rendering and storing only the misses."""
+    keyed = {card_key(book.pk): book for book in books}
+    cached = cache.get_many(keyed.keys())
+    rendered = {
+        key: render_to_string(CARD_TEMPLATE, {'book': book})
+        for key, book in keyed.items() if key not in cached
+    }
+    if rendered:
+        cache.set_many(rendered, routing.cache_timeout(CARD_TIMEOUT))
+    _record('card', hits=len(cached), misses=len(rendered))
+    return [mark_safe(cached.get(key) or rendered[key]) for key in keyed]
+
+
+def list_key(params, generation_number=None):
+    normalized = sorted((name, params.get(name, '').strip()) for name in LIST_PARAMS)
+    digest = hashlib.sha1(repr(normalized).encode()).hexdigest()
+    if generation_number is None:
+        generation_number = generation()
+    return f'library:list:{generation_number}:{digest}'
+
+
+def _list_hit(body):
+    _record('list', hits=int(body is not None), misses=int(body is None))
+    return mark_safe(body) if body is not None else None
+
+
+async def aget_list_body(params):
+    return _list_hit(await cache.aget(list_key(params, await ageneration())))
+
+
+def set_list_body(params, body):
+    cache.set(list_key(params), str(body), routing.cache_timeout(LIST_TIMEOUT))
+
+
+async def aget_book(pk):
+    """The Book with this pk (cached), or None if it does not exist."""
+    from .models import Book
+
+    key = book_key(pk)
+    book = await cache.aget(key)
+    if book is not None:
+        _record('book', hits=1)
+        return book
+    _record('book', misses=1)
+    book = await Book.objects.filter(pk=pk).afirst()
+    if book is not None:
+        await cache.aset(key, book, routing.cache_timeout(BOOK_TIMEOUT))
+    return book
+
+
+def user_key(pk):
+    return f'library:user:{pk}'
+
+
+def _user_entry(user):
+    fields = {field.attname: getattr(user, field.attname)
+              for field in user._meta.concrete_fields if field.attname != 'password'}
+    return {'fields': fields, 'session_auth_hash': user.get_session_auth_hash(), 'db': user._state.db}
+
+
+def _cached_user(entry):
+    # Loaded like a .defer('password') row: saving it never writes the password
+    model = get_user_model()
+    names = list(entry['fields'])
+    user = model.from_db(entry['db'], names, [entry['fields'][name] for name in names])
+    cached_hash = entry['session_auth_hash']
+
+    def session_auth_hash():
+        # The session check needs only this HMAC of the password, not the hash
+        # itself; once the password is loaded or set (set_password), use it
+        if 'password' in user.__dict__:
+            return AbstractBaseUser.get_session_auth_hash(user)
+        return cached_hash
+
+    user.get_session_auth_hash = session_auth_hash
+    return user
+
+
+def get_user(pk):
+    """The User with this pk (cached without its password), or None if it does not exist."""
+    key = user_key(pk)
+    entry = cache.get(key)
+    if entry is not None:
+        _record('user', hits=1)
+        return _cached_user(entry)
+    _record('user', misses=1)
+    user = get_user_model()._default_manager.filter(pk=pk).first()
+    if user is not None:
+        cache.set(key, _user_entry(user), routing.cache_timeout(USER_TIMEOUT))
+    return user
+
+
+async def aget_user(pk):
+    """Async get_user() for ``request.auser()``."""
+    key = user_key(pk)
+    entry = await cache.aget(key)
+    if entry is not None:
+        _record('user', hits=1)
+        return _cached_user(entry)
+    _record('user', misses=1)
+    user = await get_user_model()._default_manager.filter(pk=pk).afirst()
+    if user is not None:
+        await cache.aset(key, _user_entry(user), routing.cache_timeout(USER_TIMEOUT))
+    return user
+
+
+def users_changed(user_ids):
+    """Drop cached rows for these users now and again on commit."""
+    keys = [user_key(pk) for pk in user_ids]
+    # Again on commit: a request may have cached the old row in between
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def snapshot(book):
+    """List field values as loaded from the database (deferred fields are skipped)."""
+    return {field: book.__dict__[field] for field in LIST_FIELDS if field in book.__dict__}
+
+
+def list_fields_changed(book):
+    """Whether a saved book differs from its snapshot in a LIST_FIELDS value; refreshes the snapshot."""
+    previous = getattr(book, '_list_snapshot', {})
+    current = book._list_snapshot = snapshot(book)
+    return any(field not in previous or previous[field] != value for field, value in current.items())
+
+
+def books_changed(book_ids, lists=True):
+    """
+    Drop cached cards/rows for these books on commit. With ``lists=True``
+    (a LIST_FIELDS value changed) also retire all cached list pages.
+    """
+    keys = []
+    for pk in book_ids:
+        keys += [card_key(pk), book_key(pk)]
+
+    def invalidate():
+        if keys:
+            cache.delete_many(keys)
+        if lists:
+            _bump_generation()
+
+    transaction.on_commit(invalidate)
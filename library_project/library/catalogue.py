@@ -0,0 +1,76 @@
+"""
+Catalogue filtering and sorting shared by the HTML views and the JSON API.
+"""
+from . import facets, search
+from .models import Book
+
+# Sorting support via ?sort=relevance|title|author|year|available
+SORT_MAP = {
+    'relevance': 'search_rank',
+    'title': 'title',
+    'author': 'author',
+    'year': 'publication_year',
+    'available': '-available_count',  # most copies on the shelf first
+    '-title': '-title',
+    '-author': '-author',
+    '-year': '-publication_year',
+    '-available': 'available_count',
+}
+
+
+class CatalogueQuery:
+    """
+    The book_list filters parsed from query parameters.
+
+    ``books`` is the filtered queryset (unordered); ``order_field`` is the
+    SORT_MAP value to order and paginate it by.
+    """
+
+    def __init__(self, params):
+        self.q = params.get('q', '').strip()
+        self.category = params.get('category', '')
+        self.author = params.get('author', '')
+        self.available = params.get('available', '')  # '1' for only available
+
+        # Searches default to relevance (best full-text match first)
+        self.sort = params.get('sort', 'relevance' if self.q else 'title')
+        self.order_field = SORT_MAP.get(self.sort, 'title')
+        if self.order_field == 'search_rank' and not self.q:
+            self.order_field = 'title'
+
+        # Filters other than category/author; the facet dropdowns are counted
+        # under these plus the other facet's selection (faceted navigation)
+        base_qs = Book.objects.all()
+
+        if self.q:
+            base_qs = search.search_books(base_qs, self.q)
+
+        if self.available == '1':
+            base_qs = base_qs.filter(available_count__gt=0)
+
+        self.base = base_qs
+        books_qs = base_qs
+
+        if self.category:
+            books_qs = books_qs.filter(category=self.category)
+
+        if self.author:
+            books_qs = books_qs.filter(author=self.author)
+
+        self.books = books_qs
+
+    def category_choices(self):
+        """Category dropdown entries with per-value counts."""
+        return facets.facet_choices(
+            'category',
+            self.base.filter(author=self.author) if self.author else self.base,
+            filters={'q': self.q, 'author': self.author, 'available': self.available == '1'},
+        )
+
+    def author_choices(self):
+        """Author dropdown entries with per-value counts."""
+        return facets.facet_choices(
+            'author',
+            self.base.filter(category=self.category) if self.category else self.base,
+            filters={'q': self.q, 'category': self.category, 'available': self.available == '1'},
+        )
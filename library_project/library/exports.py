@@ -0,0 +1,179 @@
+"""
+Streamed catalogue and borrowing exports for the ``export_*`` commands and
+the staff download views.
+
+Rows are read with ``values_list(...).iterator(chunk_size=...)`` and turned
+into CSV or JSON Lines text one chunk at a time. Optionally they are gzipped
+on the fly. Nothing holds more than one chunk, so a multi-million-row export
+runs in constant memory.
+
+Catalogue CSV uses the column layout ``import_books`` reads (see
+``library.parsing``), so an export, gzipped or not, can be imported again.
+The copy counts go in two columns the importer ignores.
+
+The borrowings export covers archived borrowings too, merged with the live
+ones in request order.
+"""
+import csv
+import heapq
+import io
+import json
+import zlib
+from datetime import datetime, time, timedelta
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .catalogue import CatalogueQuery
+from .models import ArchivedBorrowing, Borrowing
+
+CHUNK_SIZE = 2000
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+FORMATS = tuple(CONTENT_TYPES)
+
+# (CSV header, JSON key, column) in import_books' column order
+CATALOGUE_COLUMNS = (
+    ('SNo', 'id', 'pk'),
+    ('Category', 'category', 'category'),
+    ('ISBN', 'isbn', 'isbn'),
+    ('Title Name', 'title', 'title'),
+    ('Author/Writer', 'author', 'author'),
+    ('Copies', 'copies', 'copies'),
+    ('Available', 'available_count', 'available_count'),
+    ('Publication Year', 'publication_year', 'publication_year'),
+    ('', None, None),
+    ('', None, None),
+    ('', None, None),
+    ('About the Book', 'description', 'description'),
+)
+
+BORROWING_COLUMNS = (
+    ('id', 'id', 'pk'),
+    ('book_id', 'book_id', 'book_id'),
+    ('title', 'title', 'book__title'),
+    ('isbn', 'isbn', 'book__isbn'),
+    ('student_id', 'student_id', 'student_id'),
+    ('username', 'username', 'student__username'),
+    ('status', 'status', 'status'),
+    ('request_date', 'request_date', 'request_date'),
+    ('approved_date', 'approved_date', 'approved_date'),
+    ('due_date', 'due_date', 'due_date'),
+    ('return_date', 'return_date', 'return_date'),
+    ('is_overdue', 'is_overdue', 'is_overdue'),
+)
+
+STATUSES = {status for status, _ in Borrowing.STATUS_CHOICES}
+
+
+class Export:
+    """
+    Header and row tuples of one export; ``rows`` is a lazy iterator.
+
+    Several querysets, each sorted on the ``merge_on`` columns, are merged
+    into one stream in that order.
+    """
+
+    def __init__(self, columns, querysets, chunk_size=CHUNK_SIZE, merge_on=()):
+        self.columns = columns
+        fields = [column for _, _, column in columns if column]
+        # Blank padding columns are filled in per row, not selected
+        self.layout = [fields.index(column) if column else None for _, _, column in columns]
+        streams = [queryset.values_list(*fields).iterator(chunk_size=chunk_size) for queryset in querysets]
+        if len(streams) == 1:
+            self.rows = streams[0]
+        else:
+            positions = [fields.index(column) for column in merge_on]
+            self.rows = heapq.merge(*streams, key=lambda row: tuple(row[i] for i in positions))
+        self.chunk_size = chunk_size
+
+    def _padded(self):
+        for row in self.rows:
+            yield tuple('' if i is None else row[i] for i in self.layout)
+
+    def csv(self):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow([header for header, _, _ in self.columns])
+        for n, row in enumerate(self._padded(), 1):
+            writer.writerow(row)
+            if n % self.chunk_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    def jsonl(self):
+        keys = [key for _, key, _ in self.columns]
+        lines = []
+        for row in self._padded():
+            lines.append(json.dumps({k: v for k, v in zip(keys, row) if k}, cls=DjangoJSONEncoder))
+            if len(lines) >= self.chunk_size:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
+
+    def stream(self, fmt, compress=False):
+        """The export as UTF-8 byte chunks in ``fmt`` ('csv' or 'jsonl'), gzipped if ``compress``."""
+        chunks = (text.encode('utf-8') for text in getattr(self, fmt)())
+        return gzipped(chunks) if compress else chunks
+
+
+def gzipped(chunks):
+    """Gzip a stream of byte chunks as it goes."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def catalogue(params, chunk_size=CHUNK_SIZE):
+    """Books matching the book_list parameters in ``params``, in its order."""
+    query = CatalogueQuery(params)
+    return Export(CATALOGUE_COLUMNS, [query.books.order_by(query.order_field, 'pk')], chunk_size)
+
+
+def _day_start(value, name):
+    try:
+        day = parse_date(value)
+    except ValueError:  # well formed but not a real date
+        day = None
+    if day is None:
+        raise ValueError(f'{name} must be a date (YYYY-MM-DD).')
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def borrowings(params, chunk_size=CHUNK_SIZE):
+    """
+    Borrowings, live and archived, oldest request first, filtered by
+    ``status``, ``since`` and ``until`` (request dates, inclusive), plus the
+    book_list parameters applied to their books.
+
+    Raises ValueError for an unknown status or a malformed date.
+    """
+    filters = {}
+    status = params.get('status', '').upper()
+    if status:
+        if status not in STATUSES:
+            raise ValueError(f'Unknown status {status!r}.')
+        filters['status'] = status
+    if params.get('since'):
+        filters['request_date__gte'] = _day_start(params['since'], 'since')
+    if params.get('until'):
+        filters['request_date__lt'] = _day_start(params['until'], 'until') + timedelta(days=1)
+    if any(params.get(name) for name in ('q', 'category', 'author', 'available')):
+        filters['book__in'] = CatalogueQuery(params).books.values('pk')
+    # Archived rows keep their ids, so (request_date, id) orders both tables alike
+    querysets = [model.objects.filter(**filters).order_by('request_date', 'pk')
+                 for model in (Borrowing, ArchivedBorrowing)]
+    return Export(BORROWING_COLUMNS, querysets, chunk_size, merge_on=('request_date', 'pk'))
+
+
+def filename(kind, fmt, compress):
+    return f"library-{kind}-{timezone.localdate():%Y%m%d}.{fmt}{'.gz' if compress else ''}"
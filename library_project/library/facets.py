@@ -0,0 +1,183 @@
+"""
+Cached facet counts for the catalogue filter dropdowns.
+
+The unfiltered counts per category/author are stored in the cache and
+patched incrementally from Book signals and bulk imports, so a normal
+book_list hit never runs ``SELECT DISTINCT`` over the whole table.
+
+Counts under active filters (faceted navigation) are a GROUP BY over the
+filtered queryset. They are cached under a generation number that every
+catalogue change bumps, which invalidates all of them in O(1).
+"""
+import hashlib
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+
+FACET_FIELDS = ('category', 'author')
+
+# Drift from concurrent writers is bounded by this timeout
+FACET_CACHE_TIMEOUT = 60 * 60
+FILTERED_CACHE_TIMEOUT = 5 * 60
+
+GENERATION_KEY = 'library:facets:generation'
+
+
+def _counts_key(field):
+    return f'library:facets:{field}'
+
+
+def _is_facet_value(value):
+    return value is not None and value != ''
+
+
+def compute_counts(queryset, field):
+    """Return ``{value: count}`` for ``field`` over ``queryset`` in one GROUP BY."""
+    rows = (
+        queryset.exclude(**{f'{field}__isnull': True})
+        .exclude(**{field: ''})
+        .order_by()
+        .values_list(field)
+        .annotate(n=Count('pk'))
+    )
+    return dict(rows)
+
+
+def facet_counts(field):
+    """Unfiltered counts for ``field``, computed once and then maintained incrementally."""
+    from .models import Book
+
+    counts = cache.get(_counts_key(field))
+    if counts is None:
+        counts = compute_counts(Book.objects.all(), field)
+        cache.set(_counts_key(field), counts, FACET_CACHE_TIMEOUT)
+    return counts
+
+
+def generation():
+    return cache.get_or_set(GENERATION_KEY, 0, None)
+
+
+def _bump_generation():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, None)
+
+
+def filtered_facet_counts(field, queryset, filters):
+    """
+    Counts for ``field`` restricted to ``queryset``.
+
+    ``filters`` is the normalized set of active filters that produced the
+    queryset; it only serves as the cache key.
+    """
+    digest = hashlib.sha1(repr(sorted(filters.items())).encode()).hexdigest()
+    key = f'library:facets:{field}:{generation()}:{digest}'
+    counts = cache.get(key)
+    if counts is None:
+        counts = compute_counts(queryset, field)
+        cache.set(key, counts, FILTERED_CACHE_TIMEOUT)
+    return counts
+
+
+def facet_choices(field, queryset=None, filters=None):
+    """
+    Sorted ``(value, label)`` pairs for a dropdown, e.g. ``('Fiction', 'Fiction (1,203)')``.
+
+    Without active filters the incrementally maintained counts are used.
+    """
+    if filters and any(filters.values()):
+        counts = filtered_facet_counts(field, queryset, filters)
+    else:
+        counts = facet_counts(field)
+    return [(value, f'{value} ({counts[value]:,})') for value in sorted(counts)]
+
+
+def apply_deltas(deltas):
+    """
+    Patch the cached counts with ``{field: Counter(value -> change)}``.
+
+    Fields whose counts are not cached yet are left alone; they are
+    computed from the table on the next read.
+    """
+    for field, delta in deltas.items():
+        counts = cache.get(_counts_key(field))
+        if counts is None:
+            continue
+        for value, change in delta.items():
+            if not _is_facet_value(value) or not change:
+                continue
+            new = counts.get(value, 0) + change
+            if new > 0:
+                counts[value] = new
+            else:
+                counts.pop(value, None)
+        cache.set(_counts_key(field), counts, FACET_CACHE_TIMEOUT)
+    _bump_generation()
+
+
+def schedule_deltas(deltas):
+    """Apply ``deltas`` once the surrounding transaction commits."""
+    if any(deltas.values()):
+        transaction.on_commit(lambda: apply_deltas(deltas))
+
+
+def snapshot(book):
+    """Facet values as loaded from the database (deferred fields are skipped)."""
+    return {field: book.__dict__.get(field) for field in FACET_FIELDS if field in book.__dict__}
+
+
+def _collect_changes(deltas, book, created):
+    previous = getattr(book, '_facet_snapshot', {})
+    for field in FACET_FIELDS:
+        new = getattr(book, field)
+        if created:
+            deltas[field][new] += 1
+        elif field in previous and previous[field] != new:
+            deltas[field][previous[field]] -= 1
+            deltas[field][new] += 1
+    book._facet_snapshot = snapshot(book)
+
+
+def book_changed(book, created):
+    deltas = defaultdict(Counter)
+    _collect_changes(deltas, book, created)
+    schedule_deltas(deltas)
+
+
+def books_changed(books):
+    """Record a batch of edited books (bulk_update bypasses signals)."""
+    deltas = defaultdict(Counter)
+    for book in books:
+        _collect_changes(deltas, book, created=False)
+    schedule_deltas(deltas)
+
+
+def book_deleted(book):
+    previous = getattr(book, '_facet_snapshot', {})
+    schedule_deltas({
+        field: Counter({previous[field]: -1}) for field in FACET_FIELDS if field in previous
+    })
+
+
+def books_added(books):
+    """Record a batch of newly inserted books (bulk_create bypasses signals)."""
+    deltas = defaultdict(Counter)
+    for book in books:
+        for field in FACET_FIELDS:
+            deltas[field][getattr(book, field)] += 1
+    schedule_deltas(deltas)
+
+
+def availability_changed():
+    """Invalidate filtered counts after a bulk ``available_count`` update."""
+    transaction.on_commit(_bump_generation)
+
+
+def reset():
+    """Forget all cached counts; they are recomputed on next read."""
+    cache.delete_many([_counts_key(field) for field in FACET_FIELDS])
+    _bump_generation()
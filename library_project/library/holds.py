@@ -0,0 +1,70 @@
+"""
+Per-book FIFO waitlists.
+
+A hold's ``position`` is a ticket number: new holders take the last one + 1
+and the lowest ticket is served first. Tickets are never renumbered, so
+serving or leaving the queue deletes one row and touches no other. A
+student's place in line is one plus the number of lower tickets for the
+book, counted from the ``(book, position)`` index without reading the table.
+
+The functions here expect to run inside the caller's transaction, after
+the book row has been written or locked, so tickets are handed out one at
+a time per book.
+"""
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Book, Hold
+
+
+def _ahead():
+    """How many holds on the outer hold's book have a lower ticket."""
+    return (
+        Hold.objects.filter(book_id=OuterRef('book_id'), position__lt=OuterRef('position'))
+        .order_by().values('book_id').annotate(ahead=Count('*')).values('ahead')
+    )
+
+
+def lock_book(book_id):
+    """Serialize queue changes for one book (a row lock on PostgreSQL)."""
+    list(Book.objects.select_for_update().filter(pk=book_id).values_list('pk'))
+
+
+def enqueue(entries):
+    """
+    Append ``[(book_id, student_id, created_at)]`` to the books' queues, in order.
+
+    One query reads every tail, whatever the number of books, then one bulk insert.
+    Returns the new Hold rows.
+    """
+    book_ids = {book_id for book_id, _, _ in entries}
+    tails = dict(
+        Hold.objects.filter(book_id__in=book_ids).order_by()
+        .values_list('book_id').annotate(last=Max('position'))
+    )
+    new_holds = []
+    for book_id, student_id, created_at in entries:
+        tails[book_id] = tails.get(book_id, 0) + 1
+        new_holds.append(Hold(book_id=book_id, student_id=student_id,
+                              position=tails[book_id], created_at=created_at))
+    return Hold.objects.bulk_create(new_holds)
+
+
+def pop_head(book_id):
+    """Remove and return the first hold for ``book_id``, or None."""
+    head = Hold.objects.filter(book_id=book_id).order_by('position').first()
+    if head is not None:
+        Hold.objects.filter(pk=head.pk).delete()
+    return head
+
+
+def leave(student, book_id):
+    """Take ``student`` off the book's queue; returns whether they were on it."""
+    lock_book(book_id)
+    deleted, _ = Hold.objects.filter(student=student, book_id=book_id).delete()
+    return bool(deleted)
+
+
+def with_places(queryset):
+    """Annotate holds with ``place``: 1 for the head of each book's queue."""
+    return queryset.annotate(place=Coalesce(Subquery(_ahead()), 0) + 1)
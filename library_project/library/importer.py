@@ -0,0 +1,120 @@
+"""
+Batched import engine used by the ``import_books`` command.
+
+Rows are parsed into plain dicts, de-duplicated inside each chunk, checked
+against the database with a single set-based lookup per chunk and written
+with ``bulk_create`` / ``bulk_update`` inside one transaction per chunk.
+"""
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import caching, facets, search, stats, typeahead
+from .models import Book
+from .parsing import RowError, parse_row  # noqa: F401 (re-exported for callers)
+
+UPDATABLE_FIELDS = ('title', 'author', 'category', 'publication_year', 'description')
+
+
+class ImportStats:
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+
+    def add(self, other):
+        self.created += other.created
+        self.updated += other.updated
+        self.skipped += other.skipped
+
+
+class BookImporter:
+    """
+    Writes chunks of parsed records.
+
+    In the default mode a record is a duplicate when a book with the same
+    (title, author) or the same ISBN already exists. With ``update=True``
+    records whose ISBN exists overwrite that book instead. Copies only seed
+    new books, all of them on the shelf; an existing book's copies change
+    through ``services.set_copies``, which accounts for its loans.
+    """
+
+    def __init__(self, update=False, warn=None):
+        self.update = update
+        self.warn = warn or (lambda message: None)
+
+    def _existing(self, records):
+        """One query for every book that collides with the chunk by title or ISBN."""
+        titles = {r['title'] for r in records}
+        isbns = {r['isbn'] for r in records if r['isbn']}
+        condition = Q(title__in=titles)
+        if isbns:
+            condition |= Q(isbn__in=isbns)
+        books = Book.objects.filter(condition)
+        if not self.update:
+            books = books.only('title', 'author', 'isbn')
+        by_key = {}
+        by_isbn = {}
+        for book in books:
+            by_key[(book.title, book.author)] = book
+            if book.isbn:
+                by_isbn[book.isbn] = book
+        return by_key, by_isbn
+
+    def import_chunk(self, records):
+        result = ImportStats()
+        if not records:
+            return result
+
+        by_key, by_isbn = self._existing(records)
+        seen_keys = set()
+        seen_isbns = set()
+        to_create = []
+        to_update = []
+        now = timezone.now()
+
+        for record in records:
+            key = (record['title'], record['author'])
+            isbn = record['isbn']
+
+            if key in seen_keys or (isbn and isbn in seen_isbns):
+                self.warn(f"Skipping duplicate: {record['title']}")
+                result.skipped += 1
+                continue
+            seen_keys.add(key)
+            if isbn:
+                seen_isbns.add(isbn)
+
+            if self.update and isbn and isbn in by_isbn:
+                book = by_isbn[isbn]
+                for field in UPDATABLE_FIELDS:
+                    setattr(book, field, record[field])
+                book.updated_at = now  # bulk_update() skips auto_now
+                to_update.append(book)
+            elif key in by_key or (isbn and isbn in by_isbn):
+                self.warn(f"Skipping duplicate: {record['title']}")
+                result.skipped += 1
+            else:
+                to_create.append(Book(**record, available_count=record['copies']))
+
+        with transaction.atomic():
+            if to_create:
+                Book.objects.bulk_create(to_create)
+                stats.adjust(books_total=len(to_create),
+                             books_available=sum(book.available_count > 0 for book in to_create))
+                search.index_books(to_create)
+                typeahead.books_changed(to_create)
+                facets.books_added(to_create)
+            if to_update:
+                Book.objects.bulk_update(to_update, UPDATABLE_FIELDS + ('updated_at',))
+                search.index_books(to_update)
+                typeahead.books_changed(to_update)
+                facets.books_changed(to_update)
+            if to_create or to_update:
+                # New books only need the list pages retired; edits also drop their cards
+                lists_changed = [caching.list_fields_changed(book) for book in to_update]
+                caching.books_changed([book.pk for book in to_update], lists=bool(to_create) or any(lists_changed))
+
+        result.created = len(to_create)
+        result.updated = len(to_update)
+        return result
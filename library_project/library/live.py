@@ -0,0 +1,114 @@
+"""
+In-process publish/subscribe for live book pages.
+
+Borrowing state transitions publish small events (availability flips and
+request approvals/rejections) on a per-book channel once their transaction
+commits. Each server-sent-events connection holds one subscription: an
+``asyncio.Queue`` on the event loop that serves it. An idle watcher is just
+a parked coroutine; nothing touches the database until an event arrives.
+
+Publishing is thread-safe, because the publishers are sync views and
+services running in worker threads. Events only reach subscribers in the
+same process. With several server processes, each process serves the
+watchers connected to it and sees only its own writes.
+
+The feed is off unless ``LIBRARY_LIVE_UPDATES`` is set, and even then only
+served to requests coming in over ASGI. A WSGI worker can't park a stream:
+each open book page would hold one of its threads for good.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import transaction
+
+# Events a slow client may fall behind by before newer ones are dropped
+QUEUE_SIZE = 100
+
+_subscribers = defaultdict(set)
+_lock = threading.Lock()
+
+
+def enabled(request):
+    """Whether book pages served for ``request`` get the live feed."""
+    return getattr(settings, 'LIBRARY_LIVE_UPDATES', False) and isinstance(request, ASGIRequest)
+
+
+def book_channel(pk):
+    return f'book:{pk}'
+
+
+class Subscription:
+    """A queue receiving every event published on ``channels`` (use as a context manager)."""
+
+    def __init__(self, channels):
+        self.channels = tuple(channels)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(QUEUE_SIZE)
+
+    def __enter__(self):
+        with _lock:
+            for channel in self.channels:
+                _subscribers[channel].add(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        with _lock:
+            for channel in self.channels:
+                _subscribers[channel].discard(self)
+                if not _subscribers[channel]:
+                    del _subscribers[channel]
+
+    def deliver(self, event):
+        # Runs on the subscriber's loop
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    async def get(self):
+        return await self.queue.get()
+
+
+def subscribe(*channels):
+    return Subscription(channels)
+
+
+def has_subscribers(channel=None):
+    """Whether anyone in this process watches ``channel`` (or any channel)."""
+    with _lock:
+        return bool(_subscribers.get(channel) if channel else _subscribers)
+
+
+def publish(channel, event):
+    """Deliver ``event`` to every current subscriber of ``channel``; returns how many."""
+    with _lock:
+        subscribers = list(_subscribers.get(channel, ()))
+    for subscription in subscribers:
+        try:
+            subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+        except RuntimeError:
+            # The subscriber's loop has shut down
+            pass
+    return len(subscribers)
+
+
+def publish_on_commit(channel, event):
+    transaction.on_commit(lambda: publish(channel, event))
+
+
+def availability_changed(book_id, is_available):
+    publish_on_commit(book_channel(book_id), {
+        'type': 'availability', 'book': book_id, 'is_available': is_available,
+    })
+
+
+def request_status_changed(book_id, borrowings, status):
+    """``borrowings`` is ``[(borrowing_id, student_id)]`` for requests on ``book_id`` now in ``status``."""
+    for borrowing_id, student_id in borrowings:
+        publish_on_commit(book_channel(book_id), {
+            'type': 'request', 'book': book_id, 'borrowing': borrowing_id,
+            'student': student_id, 'status': status,
+        })
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library import archive
+
+
+class Command(BaseCommand):
+    help = 'Moves rejected, returned and waitlisted borrowings closed long ago into the archive table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, required=True, metavar='DAYS',
+                            help='Archive borrowings closed more than DAYS days ago.')
+        parser.add_argument('--batch-size', type=int, default=archive.DEFAULT_BATCH_SIZE,
+                            help=f'Rows moved per transaction (default: {archive.DEFAULT_BATCH_SIZE}).')
+        parser.add_argument('--pause', type=float, default=0.0, metavar='SECONDS',
+                            help='Sleep between batches to leave room for other writers.')
+
+    def handle(self, *args, **options):
+        if options['older_than'] < 0:
+            raise CommandError('--older-than must not be negative.')
+
+        started = time.monotonic()
+        total = batches = 0
+        for moved in archive.archive(options['older_than'], batch_size=max(1, options['batch_size']),
+                                     pause=max(0.0, options['pause'])):
+            total += moved
+            batches += 1
+            if options['verbosity'] > 1:
+                self.stdout.write(f'Batch {batches}: {moved} rows ({total} so far)')
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {total} borrowings in {batches} batches ({elapsed:.1f}s).'
+        ))
@@ -0,0 +1,29 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Counts the queries per request of the authenticated pages with database sessions and '
+            'ModelBackend, then with the cached session and user lookups (run seed_library first)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=10, help='Requests counted per page (default: 10).')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default=None, help='Write the JSON report here instead of stdout.')
+
+    def handle(self, *args, **options):
+        try:
+            report = benchmark.auth_queries(iterations=max(1, options['iterations']), seed=options['seed'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+        for name, counts in report['pages'].items():
+            self.stderr.write(f"{name}: {counts['before']:g} -> {counts['after']:g} queries per request")
@@ -0,0 +1,34 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from library import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Measures the typeahead index: memory per 100k titles and top-k lookup latency (no database needed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--titles', type=int, default=100_000, help='Synthetic titles indexed (default: 100000).')
+        parser.add_argument('--queries', type=int, default=2000, help='Lookups timed (default: 2000).')
+        parser.add_argument('--limit', type=int, default=8, help='Suggestions per lookup (default: 8).')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', default=None, help='Write the JSON report here instead of stdout.')
+
+    def handle(self, *args, **options):
+        report = benchmark.typeahead_footprint(
+            titles=max(1, options['titles']),
+            queries=max(1, options['queries']),
+            limit=max(1, options['limit']),
+            seed=options['seed'],
+        )
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+        self.stderr.write(self.style.SUCCESS(
+            f"{report['memory_bytes_per_100k_titles'] / 2**20:.1f} MB per 100k titles, "
+            f"built in {report['build_seconds']:.2f}s; lookups p50 {report['latency_us']['p50']:.0f} us, "
+            f"p99 {report['latency_us']['p99']:.0f} us."
+        ))
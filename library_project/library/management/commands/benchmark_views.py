@@ -0,0 +1,49 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Times the library views through the test client and writes latency and query-count '
+            'distributions as JSON (run seed_library first; all writes are rolled back)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per scenario (default: 20).')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per scenario first (default: 2).')
+        parser.add_argument('--cache', choices=('cold', 'warm'), default='cold',
+                            help='Clear the cache before every request (cold, default) or keep it (warm).')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the requests made (default: 0).')
+        parser.add_argument('--only', default=None, help='Run only scenarios whose name contains this.')
+        parser.add_argument('--output', default=None, help='Write the JSON report here instead of stdout.')
+        parser.add_argument('--compare', default=None, metavar='BASELINE',
+                            help='Print the changes against an earlier JSON report.')
+
+    def handle(self, *args, **options):
+        runner = benchmark.Benchmark(
+            iterations=max(1, options['iterations']),
+            warmup=max(0, options['warmup']),
+            cache_mode=options['cache'],
+            seed=options['seed'],
+        )
+        try:
+            report = runner.run(only=options['only'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stderr.write(self.style.SUCCESS(
+                f"Wrote {len(report['scenarios'])} scenarios to {options['output']}."
+            ))
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            for name, p50, p95, queries in benchmark.compare(baseline, report):
+                line = f'{name}: p50 {p50:+.0%}, p95 {p95:+.0%}, queries {queries:+d}'
+                self.stderr.write(self.style.WARNING(line) if queries > 0 or p95 > 0.2 else line)
@@ -0,0 +1,37 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Measures request_book write throughput under concurrent clients against the configured '
+            'database (see LIBRARY_DB in settings); the rows written are deleted afterwards')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=8, help='Concurrent clients (default: 8).')
+        parser.add_argument('--requests', type=int, default=50, help='Requests per client (default: 50).')
+        parser.add_argument('--seed', type=int, default=0, help='Seed for the books requested (default: 0).')
+        parser.add_argument('--output', default=None, help='Write the JSON report here instead of stdout.')
+
+    def handle(self, *args, **options):
+        try:
+            report = benchmark.write_throughput(
+                clients=max(1, options['clients']),
+                requests_per_client=max(1, options['requests']),
+                seed=options['seed'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
+        errors = sum(report['errors'].values())
+        summary = (f"{report['requests_per_second']:.0f} requests/s with {report['clients']} clients, "
+                   f"p95 {report['latency_ms']['p95']:.1f} ms, {errors} errors "
+                   f"({report['database']['vendor']}, journal {report['database'].get('journal_mode', '-')}).")
+        self.stderr.write(self.style.WARNING(summary) if errors else self.style.SUCCESS(summary))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from library import exports
+from library.management.commands.export_catalogue import (
+    add_catalogue_arguments, add_output_arguments, write_export,
+)
+
+
+class Command(BaseCommand):
+    help = 'Streams borrowings (requests, loans and returns) as CSV or JSON Lines'
+
+    def add_arguments(self, parser):
+        add_output_arguments(parser)
+        parser.add_argument('--status', default='', help='Only borrowings in this status, e.g. APPROVED.')
+        parser.add_argument('--since', default='', help='Requested on or after this date (YYYY-MM-DD).')
+        parser.add_argument('--until', default='', help='Requested on or before this date (YYYY-MM-DD).')
+        add_catalogue_arguments(parser)
+
+    def handle(self, *args, **options):
+        params = {name: options[name] for name in ('status', 'since', 'until', 'q', 'category', 'author', 'available')}
+        try:
+            export = exports.borrowings(params, max(1, options['chunk_size']))
+        except ValueError as e:
+            raise CommandError(str(e))
+        write_export(self, export, options)
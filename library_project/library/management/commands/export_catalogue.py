@@ -0,0 +1,54 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from library import exports
+from library.catalogue import SORT_MAP
+
+
+def add_output_arguments(parser):
+    parser.add_argument('--format', choices=exports.FORMATS, default='csv', help='Output format (default: csv).')
+    parser.add_argument('--output', default='-', help='File to write (default: stdout).')
+    parser.add_argument('--gzip', action='store_true',
+                        help='Gzip the output (implied by an --output ending in .gz).')
+    parser.add_argument('--chunk-size', type=int, default=exports.CHUNK_SIZE,
+                        help=f'Rows read per database round trip (default: {exports.CHUNK_SIZE}).')
+
+
+def add_catalogue_arguments(parser):
+    parser.add_argument('--q', default='', help='Full-text search, as in the catalogue search box.')
+    parser.add_argument('--category', default='')
+    parser.add_argument('--author', default='')
+    parser.add_argument('--available', action='store_const', const='1', default='',
+                        help='Only books with a copy on the shelf.')
+
+
+def write_export(command, export, options):
+    output = options['output']
+    compress = options['gzip'] or output.endswith('.gz')
+    chunks = export.stream(options['format'], compress)
+    if output == '-':
+        for chunk in chunks:
+            sys.stdout.buffer.write(chunk)
+        sys.stdout.buffer.flush()
+        return
+    with open(output, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+    command.stderr.write(command.style.SUCCESS(f'Wrote {output}.'))
+
+
+class Command(BaseCommand):
+    help = 'Streams the catalogue as CSV (re-importable with import_books) or JSON Lines'
+
+    def add_arguments(self, parser):
+        add_output_arguments(parser)
+        add_catalogue_arguments(parser)
+        parser.add_argument('--sort', choices=SORT_MAP, default=None,
+                            help='Row order, as in the catalogue (default: title, or relevance with --q).')
+
+    def handle(self, *args, **options):
+        params = {name: options[name] for name in ('q', 'category', 'author', 'available')}
+        if options['sort']:
+            params['sort'] = options['sort']
+        write_export(self, exports.catalogue(params, max(1, options['chunk_size'])), options)
@@ -1,84 +1,136 @@
 import csv
+import json
+import os
+import time
 from django.core.management.base import BaseCommand
-from django.core.exceptions import ValidationError
-from library.models import Book
+from library.importer import BookImporter, ImportStats
+from library.parsing import ParseTimings, RowError, iter_rows, iter_rows_parallel, open_text
 
 class Command(BaseCommand):
     help = 'Imports books from a specified CSV file'
 
     def add_arguments(self, parser):
-        parser.add_argument('csv_file_path', type=str, help='The path to the CSV file to import.')
+        parser.add_argument('csv_file_path', type=str, help='The path to the CSV file to import (.csv.gz is decompressed).')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows written per transaction (default: 1000).')
+        parser.add_argument('--update', action='store_true',
+                            help='Update existing books that share an ISBN instead of skipping them.')
+        parser.add_argument('--resume', action='store_true',
+                            help='Continue from the checkpoint left by an interrupted import.')
+        parser.add_argument('--checkpoint', type=str, default=None,
+                            help='Checkpoint file (default: <csv_file_path>.checkpoint).')
+        parser.add_argument('--workers', type=int, default=0,
+                            help='Parse the file in N worker processes. Requires that no quoted '
+                                 'field spans several lines.')
 
     def handle(self, *args, **options):
         file_path = options['csv_file_path']
+        batch_size = max(1, options['batch_size'])
+        checkpoint_path = options['checkpoint'] or f'{file_path}.checkpoint'
+        verbose = options['verbosity'] >= 2
         self.stdout.write(self.style.NOTICE(f'Starting import from {file_path}...'))
-        
-        imported_count = 0
-        skipped_count = 0
 
         try:
-            with open(file_path, mode='r', encoding='utf-8-sig') as file:
-                reader = csv.reader(file)
-                
-                # Skip header row
-                try:
-                    header = next(reader)
-                except StopIteration:
-                    self.stdout.write(self.style.ERROR('CSV file is empty.'))
-                    return
-
-                for row in reader:
-                    try:
-                        # Map CSV columns to model fields
-                        # 0: SNo, 1: Category, 2: ISBN, 3: Title Name, 4: Author/Writer,
-                        # 7: Publication Year, 11: About the Book
-                        
-                        title = row[3]
-                        author = row[4] if row[4] else None
-                        isbn = row[2] if row[2] else None
-                        
-                        # Skip if essential data is missing
-                        if not title:
-                            self.stdout.write(self.style.WARNING(f'Skipping row {reader.line_num}: Missing title'))
-                            skipped_count += 1
-                            continue
-                            
-                        # Handle publication year
-                        pub_year = None
-                        if row[7] and row[7].isdigit():
-                            pub_year = int(row[7])
-
-                        # Use get_or_create to avoid duplicates based on title and author
-                        # Using ISBN is better if it's guaranteed unique, but title/author is safer
-                        book, created = Book.objects.get_or_create(
-                            title=title,
-                            author=author,
-                            defaults={
-                                'isbn': isbn,
-                                'category': row[1] if row[1] else None,
-                                'publication_year': pub_year,
-                                'description': row[11] if row[11] else None,
-                                'is_available': True
-                            }
-                        )
-                        
-                        if created:
-                            imported_count += 1
-                        else:
-                            self.stdout.write(self.style.WARNING(f'Skipping duplicate: {title}'))
-                            skipped_count += 1
-                            
-                    except (IndexError, ValidationError) as e:
-                        self.stdout.write(self.style.ERROR(f'Error on line {reader.line_num}: {e}'))
-                        skipped_count += 1
-                    except Exception as e:
-                        self.stdout.write(self.style.ERROR(f'Unexpected error on line {reader.line_num}: {e}'))
-                        skipped_count += 1
-
+            file_stat = os.stat(file_path)
         except FileNotFoundError:
             self.stdout.write(self.style.ERROR(f'File not found at {file_path}'))
             return
 
+        # Rows already committed by a previous run (counted after the header)
+        start_row = 0
+        if options['resume']:
+            start_row = self._read_checkpoint(checkpoint_path, file_stat)
+            if start_row:
+                self.stdout.write(self.style.NOTICE(f'Resuming after row {start_row}.'))
+
+        # Check for an empty file before handing it to any workers
+        with open_text(file_path) as file:
+            if next(csv.reader(file), None) is None:
+                self.stdout.write(self.style.ERROR('CSV file is empty.'))
+                return
+
+        importer = BookImporter(
+            update=options['update'],
+            warn=(lambda message: self.stdout.write(self.style.WARNING(message))) if verbose else None,
+        )
+        timings = ParseTimings()
+        if options['workers'] > 0 and file_path.endswith('.gz'):
+            self.stdout.write(self.style.ERROR('--workers cannot split a gzipped file; import it without.'))
+            return
+        if options['workers'] > 0:
+            self.stdout.write(self.style.NOTICE(f"Parsing with {options['workers']} worker processes."))
+            results = iter_rows_parallel(file_path, options['workers'], timings)
+        else:
+            results = iter_rows(file_path, timings)
+
+        totals = ImportStats()
+        write_seconds = 0.0
+        started = time.monotonic()
+
+        records = []
+        row_index = 0
+        for result in results:
+            row_index += 1
+            if row_index <= start_row:
+                continue
+            if isinstance(result, RowError):
+                if verbose:
+                    # +1 for the header line
+                    self.stdout.write(self.style.WARNING(f'Skipping row {row_index + 1}: {result}'))
+                totals.skipped += 1
+            else:
+                records.append(result)
+
+            if len(records) >= batch_size:
+                write_seconds += self._write(importer, records, totals)
+                records = []
+                self._write_checkpoint(checkpoint_path, file_stat, row_index)
+                self._report(totals, row_index - start_row, started)
+
+        write_seconds += self._write(importer, records, totals)
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+        elapsed = time.monotonic() - started
+        rows = max(0, row_index - start_row)
+        rate = rows / elapsed if elapsed else 0
         self.stdout.write(self.style.SUCCESS(
-            f'Import complete: {imported_count} books created, {skipped_count} rows skipped.'
-        ))
\ No newline at end of file
+            f'Import complete: {totals.created} books created, {totals.updated} updated, '
+            f'{totals.skipped} rows skipped ({rate:,.0f} rows/s).'
+        ))
+        self.stdout.write(
+            f'Timings: total {elapsed:.2f}s, DB writes {write_seconds:.2f}s, '
+            f'read/parse {elapsed - write_seconds:.2f}s wall ({timings.cpu:.2f}s CPU parsing rows).'
+        )
+
+    def _write(self, importer, records, totals):
+        started = time.monotonic()
+        totals.add(importer.import_chunk(records))
+        return time.monotonic() - started
+
+    def _report(self, totals, rows, started):
+        elapsed = time.monotonic() - started
+        rate = rows / elapsed if elapsed else 0
+        self.stdout.write(
+            f'  {rows:,} rows processed: {totals.created:,} created, {totals.updated:,} updated, '
+            f'{totals.skipped:,} skipped ({rate:,.0f} rows/s)'
+        )
+
+    def _read_checkpoint(self, path, file_stat):
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return 0
+        if data.get('size') != file_stat.st_size or data.get('mtime') != file_stat.st_mtime:
+            self.stdout.write(self.style.WARNING('CSV file changed since the checkpoint; starting over.'))
+            return 0
+        return data.get('rows', 0)
+
+    def _write_checkpoint(self, path, file_stat, rows):
+        # Written after each committed chunk; replace() keeps it intact on a crash
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'rows': rows, 'size': file_stat.st_size, 'mtime': file_stat.st_mtime}, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from library import recommendations
+
+
+class Command(BaseCommand):
+    help = ('Recomputes "readers also borrowed" recommendations; incrementally from the last run '
+            'unless --full is given (run nightly)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Recompute every book, not just the ones read since the last run.')
+        parser.add_argument('--top', type=int, default=recommendations.TOP_N, help='Neighbours kept per book.')
+        parser.add_argument('--min-co-readers', type=int, default=recommendations.MIN_CO_READERS,
+                            help='Readers two books must share to be neighbours.')
+
+    def handle(self, *args, **options):
+        since = None if options['full'] else recommendations.last_computed()
+        if since is None:
+            self.stdout.write(self.style.NOTICE('Computing recommendations for every book...'))
+        else:
+            self.stdout.write(self.style.NOTICE(f'Updating books read since {since:%Y-%m-%d %H:%M}...'))
+
+        started = time.monotonic()
+        result = recommendations.rebuild(
+            since=since,
+            top_n=max(1, options['top']),
+            min_co_readers=max(1, options['min_co_readers']),
+        )
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'{result.recommendations} recommendations for {result.books} books '
+            f'from {result.students} readers in {elapsed:.1f}s.'
+        ))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from library import stats
+from library.models import LibraryStats
+
+COUNTER_FIELDS = ('books_total', 'books_available', 'requests_pending', 'loans_active', 'loans_overdue')
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the dashboard counters from the book and borrowing tables'
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            before = LibraryStats.objects.filter(pk=stats.STATS_PK).values(*COUNTER_FIELDS).first() or {}
+            after = stats.recount()
+            days = stats.recount_daily_loans()
+
+        drifted = False
+        for field in COUNTER_FIELDS:
+            old, new = before.get(field), getattr(after, field)
+            if old != new:
+                drifted = True
+                self.stdout.write(self.style.WARNING(f'{field}: {old} -> {new}'))
+
+        if not drifted:
+            self.stdout.write('No drift found.')
+        self.stdout.write(self.style.SUCCESS(f'Counters recounted ({days} days of loan history).'))
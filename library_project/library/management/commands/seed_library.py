@@ -0,0 +1,45 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from library import seeding
+
+
+class Command(BaseCommand):
+    help = 'Fills the database with a reproducible synthetic catalogue, students and borrowing histories'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=1000, help='Books to create (default: 1000).')
+        parser.add_argument('--students', type=int, default=200, help='Students to create (default: 200).')
+        parser.add_argument('--loans-per-student', type=int, default=10,
+                            help='Average requests in each student\'s history (default: 10).')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Random seed; the same seed creates the same data (default: 0).')
+        parser.add_argument('--prefix', default='reader',
+                            help='Student usernames are <prefix><n> (default: reader).')
+        parser.add_argument('--password', default='library',
+                            help='Password given to every student (default: library).')
+        parser.add_argument('--batch-size', type=int, default=seeding.BATCH_SIZE,
+                            help=f'Rows per INSERT (default: {seeding.BATCH_SIZE}).')
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(f'Users named {prefix}... already exist; choose another --prefix.')
+
+        started = time.monotonic()
+        result = seeding.seed(
+            books=max(0, options['books']),
+            students=max(0, options['students']),
+            loans_per_student=max(0, options['loans_per_student']),
+            seed=options['seed'],
+            prefix=prefix,
+            password=options['password'],
+            batch_size=max(1, options['batch_size']),
+        )
+        statuses = ', '.join(f'{count} {status.lower()}' for status, count in sorted(result.by_status.items()))
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {result.books} books, {result.students} students and {result.borrowings} borrowings '
+            f'({statuses or "none"}) in {time.monotonic() - started:.1f}s.'
+        ))
@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from library import overdue
+
+
+class Command(BaseCommand):
+    help = 'Marks approved loans that are past their due date as overdue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=overdue.DEFAULT_BATCH_SIZE,
+                            help=f'Loans marked per transaction (default: {overdue.DEFAULT_BATCH_SIZE}).')
+        parser.add_argument('--notify', action='store_true',
+                            help='Email each student whose loan was newly marked overdue.')
+        parser.add_argument('--every', type=int, default=0, metavar='SECONDS',
+                            help='Keep running and sweep again every SECONDS seconds '
+                                 '(instead of an external cron job).')
+
+    def handle(self, *args, **options):
+        batch_size = max(1, options['batch_size'])
+        while True:
+            started = time.monotonic()
+            marked = overdue.sweep(batch_size=batch_size, notify=options['notify'])
+            elapsed = time.monotonic() - started
+            self.stdout.write(self.style.SUCCESS(f'Marked {marked} loans overdue ({elapsed:.2f}s).'))
+
+            if options['every'] <= 0:
+                return
+            time.sleep(max(0, options['every'] - elapsed))
@@ -0,0 +1,56 @@
+from django.db import migrations
+
+FTS_TABLE = 'library_book_fts'
+PG_TABLE = 'library_book_search'
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"title, author, isbn, description, "
+            f"tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, title, author, isbn, description) "
+            f"SELECT id, title, COALESCE(author, ''), COALESCE(isbn, ''), COALESCE(description, '') "
+            f"FROM library_book"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            f"CREATE TABLE IF NOT EXISTS {PG_TABLE} ("
+            f"book_id bigint PRIMARY KEY REFERENCES library_book (id) ON DELETE CASCADE, "
+            f"document tsvector NOT NULL)"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {PG_TABLE}_document_gin ON {PG_TABLE} USING GIN (document)"
+        )
+        schema_editor.execute(
+            f"INSERT INTO {PG_TABLE} (book_id, document) "
+            f"SELECT id, "
+            f"setweight(to_tsvector('simple', title), 'A') || "
+            f"setweight(to_tsvector('simple', COALESCE(author, '')), 'B') || "
+            f"setweight(to_tsvector('simple', COALESCE(isbn, '')), 'B') || "
+            f"setweight(to_tsvector('simple', COALESCE(description, '')), 'D') "
+            f"FROM library_book"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif vendor == 'postgresql':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {PG_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-17 05:50
+
+from django.db import migrations, models
+from django.db.models.functions import TruncDate
+
+
+def seed_stats(apps, schema_editor):
+    Book = apps.get_model('library', 'Book')
+    Borrowing = apps.get_model('library', 'Borrowing')
+    LibraryStats = apps.get_model('library', 'LibraryStats')
+    DailyLoanCount = apps.get_model('library', 'DailyLoanCount')
+
+    LibraryStats.objects.create(
+        pk=1,
+        books_total=Book.objects.count(),
+        books_available=Book.objects.filter(is_available=True).count(),
+        requests_pending=Borrowing.objects.filter(status='PENDING').count(),
+        loans_active=Borrowing.objects.filter(status='APPROVED').count(),
+    )
+    days = (
+        Borrowing.objects.filter(approved_date__isnull=False)
+        .annotate(day=TruncDate('approved_date'))
+        .values('day')
+        .annotate(loans=models.Count('pk'))
+    )
+    DailyLoanCount.objects.bulk_create(DailyLoanCount(day=row['day'], loans=row['loans']) for row in days)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0003_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyLoanCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('loans', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-day'],
+            },
+        ),
+        migrations.CreateModel(
+            name='LibraryStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('books_total', models.IntegerField(default=0)),
+                ('books_available', models.IntegerField(default=0)),
+                ('requests_pending', models.IntegerField(default=0)),
+                ('loans_active', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'library stats',
+            },
+        ),
+        migrations.RunPython(seed_stats, migrations.RunPython.noop),
+    ]
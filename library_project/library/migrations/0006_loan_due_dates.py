@@ -0,0 +1,91 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:01
+
+from datetime import timedelta
+
+from collections import Counter
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_due_dates(apps, schema_editor):
+    # Loans approved before due dates existed get the standard loan period
+    Borrowing = apps.get_model('library', 'Borrowing')
+    loan_period = timedelta(days=getattr(settings, 'LIBRARY_LOAN_DAYS', 14))
+    Borrowing.objects.filter(status='APPROVED', due_date__isnull=True, approved_date__isnull=False).update(
+        due_date=models.F('approved_date') + loan_period,
+    )
+
+
+def close_duplicate_requests(apps, schema_editor):
+    # The old check-then-create in request_book could race, leaving a student
+    # with several active rows for one book; keep one so the constraint applies
+    Borrowing = apps.get_model('library', 'Borrowing')
+    LibraryStats = apps.get_model('library', 'LibraryStats')
+    active = Borrowing.objects.filter(status__in=['PENDING', 'APPROVED'])
+    duplicated = list(
+        active.order_by().values_list('student', 'book').annotate(n=models.Count('pk')).filter(n__gt=1)
+    )
+    extra = []
+    closed = Counter()
+    for student_id, book_id, _ in duplicated:
+        rows = list(active.filter(student=student_id, book=book_id)
+                    .order_by('request_date', 'pk').values_list('pk', 'status'))
+        # The earliest row stays, unless a later one is the loan actually out
+        keep = next((pk for pk, status in rows if status == 'APPROVED'), rows[0][0])
+        for pk, status in rows:
+            if pk != keep:
+                extra.append(pk)
+                closed[status] += 1
+    if not extra:
+        return
+    Borrowing.objects.filter(pk__in=extra).update(status='REJECTED', updated_at=timezone.now())
+    LibraryStats.objects.filter(pk=1).update(
+        requests_pending=models.F('requests_pending') - closed['PENDING'],
+        loans_active=models.F('loans_active') - closed['APPROVED'],
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0005_row_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='borrowing',
+            unique_together=set(),
+        ),
+        migrations.AddField(
+            model_name='borrowing',
+            name='due_date',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='borrowing',
+            name='is_overdue',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunPython(backfill_due_dates, migrations.RunPython.noop),
+        migrations.AddField(
+            model_name='librarystats',
+            name='loans_overdue',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='borrowing',
+            index=models.Index(condition=models.Q(('status', 'APPROVED')), fields=['due_date', 'id'], name='borrowing_loans_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='borrowing',
+            index=models.Index(condition=models.Q(('is_overdue', False), ('status', 'APPROVED')), fields=['due_date'], name='borrowing_overdue_sweep_idx'),
+        ),
+        migrations.RunPython(close_duplicate_requests, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='borrowing',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['PENDING', 'APPROVED'])), fields=('student', 'book'), name='borrowing_one_active_per_book'),
+        ),
+    ]
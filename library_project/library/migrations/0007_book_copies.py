@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:04
+
+from django.db import migrations, models
+
+
+def availability_to_counts(apps, schema_editor):
+    # Every existing book is one copy: on the shelf (1) or out (0)
+    Book = apps.get_model('library', 'Book')
+    Book.objects.filter(is_available=False).update(available_count=0)
+
+
+def counts_to_availability(apps, schema_editor):
+    Book = apps.get_model('library', 'Book')
+    Book.objects.filter(available_count=0).update(is_available=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0006_loan_due_dates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='available_count',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='copies',
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.RunPython(availability_to_counts, counts_to_availability),
+        migrations.RemoveIndex(
+            model_name='book',
+            name='book_available_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='book',
+            name='book_available_title_idx',
+        ),
+        migrations.RemoveField(
+            model_name='book',
+            name='is_available',
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['available_count', 'id'], name='book_available_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(condition=models.Q(('available_count__gt', 0)), fields=['title', 'id'], name='book_available_title_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='book',
+            constraint=models.CheckConstraint(condition=models.Q(('available_count__lte', models.F('copies'))), name='book_available_within_copies'),
+        ),
+    ]
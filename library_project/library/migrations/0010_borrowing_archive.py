@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:33
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0009_book_recommendations'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedBorrowing',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('request_date', models.DateTimeField()),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('APPROVED', 'Approved'), ('REJECTED', 'Rejected'), ('RETURNED', 'Returned'), ('WAITLISTED', 'Moved to waitlist')], max_length=20)),
+                ('approved_date', models.DateTimeField(blank=True, null=True)),
+                ('due_date', models.DateTimeField(blank=True, null=True)),
+                ('return_date', models.DateTimeField(blank=True, null=True)),
+                ('is_overdue', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_borrowings', to='library.book')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_borrowings', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-request_date'],
+                'indexes': [models.Index(fields=['student', '-request_date'], name='archived_student_date_idx')],
+            },
+        ),
+    ]
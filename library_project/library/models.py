@@ -13,12 +13,44 @@ class Book(models.Model):
     publication_year = models.IntegerField(null=True, blank=True)
     description = models.TextField(null=True, blank=True)
     
-    # This is the key field for availability logic
-    is_available = models.BooleanField(default=True)
+    # Inventory: physical copies of this title and how many are on the shelf.
+    # available_count only moves through conditional UPDATEs in library.services
+    copies = models.PositiveIntegerField(default=1)
+    available_count = models.PositiveIntegerField(default=1)
+
+    # Bumped on every change (bulk updates set it explicitly); used for API ETags
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # One (key, id) index per book_list filter/sort column; the id suffix
+        # lets keyset pagination walk each ordering straight off the index
+        indexes = [
+            models.Index(fields=['title', 'id'], name='book_title_idx'),
+            models.Index(fields=['author', 'id'], name='book_author_idx'),
+            models.Index(fields=['category', 'id'], name='book_category_idx'),
+            models.Index(fields=['publication_year', 'id'], name='book_year_idx'),
+            models.Index(fields=['available_count', 'id'], name='book_available_count_idx'),
+            # "Only available" listings, sorted by title
+            models.Index(fields=['title', 'id'], condition=models.Q(available_count__gt=0),
+                         name='book_available_title_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(condition=models.Q(available_count__lte=models.F('copies')),
+                                   name='book_available_within_copies'),
+        ]
 
     def __str__(self):
         return self.title
 
+    @property
+    def is_available(self):
+        return self.available_count > 0
+
+    @is_available.setter
+    def is_available(self, value):
+        # Shorthand for "every copy on the shelf" / "every copy out"
+        self.available_count = self.copies if value else 0
+
 class Borrowing(models.Model):
     """
     Model to track book borrowing requests and approvals.
@@ -27,7 +59,8 @@ class Borrowing(models.Model):
         ('PENDING', 'Pending'),
         ('APPROVED', 'Approved'),
         ('REJECTED', 'Rejected'),
-        ('RETURNED', 'Returned'), # For future use
+        ('RETURNED', 'Returned'),
+        ('WAITLISTED', 'Moved to waitlist'),  # the last copy went out; see Hold
     ]
 
     student = models.ForeignKey(User, on_delete=models.CASCADE, related_name="borrowings")
@@ -37,12 +70,153 @@ class Borrowing(models.Model):
     
     # Dates to be set by the admin
     approved_date = models.DateTimeField(null=True, blank=True)
-    return_date = models.DateTimeField(null=True, blank=True) # Date book is due or returned
+    due_date = models.DateTimeField(null=True, blank=True) # Set on approval
+    return_date = models.DateTimeField(null=True, blank=True) # Date book was returned
+
+    # Set by the overdue sweep (manage.py sweep_overdue)
+    is_overdue = models.BooleanField(default=False)
+
+    # Bumped on every change (bulk updates set it explicitly); used for API ETags
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-request_date']
+        constraints = [
+            # A student can only have one active (pending/approved) request per book
+            models.UniqueConstraint(fields=['student', 'book'],
+                                    condition=models.Q(status__in=['PENDING', 'APPROVED']),
+                                    name='borrowing_one_active_per_book'),
+        ]
+        indexes = [
+            # Active requests for a book (approval, rejecting competitors)
+            models.Index(fields=['book', 'status'], name='borrowing_book_status_idx'),
+            # A student's history, newest first
+            models.Index(fields=['student', '-request_date'], name='borrowing_student_date_idx'),
+            # The staff queue: only PENDING rows, oldest first
+            models.Index(fields=['request_date'], condition=models.Q(status='PENDING'),
+                         name='borrowing_pending_idx'),
+            # Books on loan by due date (staff loans page)
+            models.Index(fields=['due_date', 'id'], condition=models.Q(status='APPROVED'),
+                         name='borrowing_loans_due_idx'),
+            # Loans the overdue sweep has not marked yet; marked rows drop out
+            models.Index(fields=['due_date'], condition=models.Q(status='APPROVED', is_overdue=False),
+                         name='borrowing_overdue_sweep_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.student.username} - {self.book.title} ({self.status})"
+
+class ArchivedBorrowing(models.Model):
+    """
+    A closed borrowing (rejected, returned or moved to a waitlist) moved out
+    of the Borrowing table by ``manage.py archive_borrowings``.
+
+    Keeps the original id and columns, so a student's history reads the same
+    from either table; see library.archive.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    student = models.ForeignKey(User, on_delete=models.CASCADE, related_name="archived_borrowings")
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="archived_borrowings")
+    request_date = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=Borrowing.STATUS_CHOICES)
+    approved_date = models.DateTimeField(null=True, blank=True)
+    due_date = models.DateTimeField(null=True, blank=True)
+    return_date = models.DateTimeField(null=True, blank=True)
+    is_overdue = models.BooleanField(default=False)
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
 
     class Meta:
-        # A student can only have one active (pending/approved) request per book
-        unique_together = [['student', 'book', 'status']]
         ordering = ['-request_date']
+        indexes = [
+            # Older pages of a student's history
+            models.Index(fields=['student', '-request_date'], name='archived_student_date_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.student.username} - {self.book.title} ({self.status}, archived)"
+
+class Hold(models.Model):
+    """
+    A place in a book's FIFO waitlist.
+
+    ``position`` is a ticket number that increases per book. The head of the
+    queue is the lowest ticket; tickets are never renumbered, so a student's
+    place is one plus the number of lower tickets (see ``library.holds``).
+    """
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="holds")
+    student = models.ForeignKey(User, on_delete=models.CASCADE, related_name="holds")
+    position = models.BigIntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['book', 'position']
+        constraints = [
+            models.UniqueConstraint(fields=['student', 'book'], name='hold_one_per_book'),
+        ]
+        indexes = [
+            # Head and tail of a book's queue
+            models.Index(fields=['book', 'position'], name='hold_book_position_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.student.username} - {self.book.title} (#{self.position})"
+
+
+class Recommendation(models.Model):
+    """
+    A precomputed "readers also borrowed" neighbour of a book.
+
+    Rebuilt by ``manage.py recommend_books`` (see library.recommendations);
+    ``rank`` 1 is the closest neighbour.
+    """
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="recommendations")
+    recommended = models.ForeignKey(Book, on_delete=models.CASCADE, related_name="+")
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+    co_readers = models.PositiveIntegerField()
+    computed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering = ['book', 'rank']
+        constraints = [
+            # Also the index book pages read their neighbours through
+            models.UniqueConstraint(fields=['book', 'rank'], name='recommendation_book_rank'),
+        ]
+
+    def __str__(self):
+        return f"{self.book_id} -> {self.recommended_id} (#{self.rank})"
+
+
+class LibraryStats(models.Model):
+    """
+    Library-wide counters for the admin dashboard (a single row, pk=1).
+
+    Kept up to date by ``library.stats`` in the same transaction as the
+    change they count; ``manage.py recount_stats`` repairs any drift.
+    """
+    books_total = models.IntegerField(default=0)
+    books_available = models.IntegerField(default=0)  # titles with a copy on the shelf
+    requests_pending = models.IntegerField(default=0)
+    loans_active = models.IntegerField(default=0)
+    loans_overdue = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = 'library stats'
+
+    def __str__(self):
+        return 'Library stats'
+
+
+class DailyLoanCount(models.Model):
+    """
+    Number of loans approved per day.
+    """
+    day = models.DateField(unique=True)
+    loans = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['-day']
 
     def __str__(self):
-        return f"{self.student.username} - {self.book.title} ({self.status})"
\ No newline at end of file
+        return f"{self.day}: {self.loans}"
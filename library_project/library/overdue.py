@@ -0,0 +1,87 @@
+"""
+Overdue loan sweeps.
+
+Loans past their due date are found through ``borrowing_overdue_sweep_idx``, a
+partial index on ``due_date`` covering only approved loans that are not yet
+marked. Each batch is a short index range read followed by a set-based UPDATE.
+Marked rows leave the index, so the next batch starts again from the head of
+the index and no offset or cursor is needed. The sweep never loads more than
+one batch of ids at a time.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import send_mass_mail
+from django.db import transaction
+from django.utils import timezone
+
+from . import stats
+from .models import Book, Borrowing
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def overdue_loans(now):
+    """Approved, not yet marked loans whose due date is before ``now``."""
+    return Borrowing.objects.filter(status='APPROVED', is_overdue=False, due_date__lt=now)
+
+
+def sweep(now=None, batch_size=DEFAULT_BATCH_SIZE, notify=False):
+    """
+    Mark every overdue loan, ``batch_size`` rows per transaction.
+
+    With ``notify=True`` each newly marked student with an email address is
+    sent one reminder per batch listing their overdue books; the mails of a batch go out over a single connection
+    after the batch commits. Returns the number of loans marked.
+    """
+    now = now or timezone.now()
+    marked = 0
+    while True:
+        batch = list(
+            overdue_loans(now).order_by('due_date').values_list('pk', 'student_id', 'book_id')[:batch_size]
+        )
+        if not batch:
+            return marked
+
+        with transaction.atomic():
+            count = overdue_loans(now).filter(pk__in=[pk for pk, _, _ in batch]).update(
+                is_overdue=True, updated_at=now,
+            )
+            stats.adjust(loans_overdue=count)
+        marked += count
+
+        if notify:
+            send_reminders(batch)
+
+
+def _reminder(titles):
+    if len(titles) == 1:
+        return (f'Overdue: {titles[0]}',
+                f'"{titles[0]}" is past its due date. Please return it to the library as soon as possible.')
+    listing = '\n'.join(f'- {title}' for title in titles)
+    return (f'Overdue: {len(titles)} library books',
+            f'These books are past their due date:\n\n{listing}\n\n'
+            'Please return them to the library as soon as possible.')
+
+
+def send_reminders(loans):
+    """
+    Email each student in ``[(borrowing_id, student_id, book_id)]`` one
+    reminder listing all of their overdue books.
+    """
+    emails = dict(
+        User.objects.filter(pk__in={student_id for _, student_id, _ in loans})
+        .exclude(email='')
+        .values_list('pk', 'email')
+    )
+    titles = dict(Book.objects.filter(pk__in={book_id for _, _, book_id in loans}).values_list('pk', 'title'))
+    books_by_student = defaultdict(list)
+    for _, student_id, book_id in loans:
+        if student_id in emails:
+            books_by_student[student_id].append(titles.get(book_id, 'Your library book'))
+    messages = [
+        (*_reminder(books), settings.DEFAULT_FROM_EMAIL, [emails[student_id]])
+        for student_id, books in books_by_student.items()
+    ]
+    return send_mass_mail(messages) if messages else 0
@@ -0,0 +1,161 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of OFFSET, each page remembers the ``(sort_key, id)`` pair of its
+last row and the next page asks for rows strictly after it. With an index on
+``(sort_key, id)`` every page costs the same as the first one.
+
+NULL sort keys are always placed last, in both directions, so the cursor
+condition can be written without COALESCE (which would defeat the index).
+
+``paginate_merged`` pages through several querysets as one list (a
+student's live and archived borrowings), merging each page in memory.
+"""
+import base64
+import datetime
+import json
+
+from django.core.exceptions import BadRequest, ValidationError
+from django.db.models import F, Q
+
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+
+
+def encode_cursor(value, pk):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        # Full precision ISO string; the ORM parses it back for the lookup
+        value = value.isoformat()
+    raw = json.dumps([value, pk], separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise BadRequest('Invalid page cursor.')
+    if not isinstance(pk, int) or isinstance(pk, bool):
+        raise BadRequest('Invalid page cursor.')
+    return value, pk
+
+
+def _cursor_value(queryset, field, value):
+    """The cursor's sort key converted to ``field``'s type; BadRequest if it isn't one."""
+    if value is None:
+        return None
+    annotation = queryset.query.annotations.get(field)
+    model_field = annotation.output_field if annotation is not None else queryset.model._meta.get_field(field)
+    try:
+        converted = model_field.to_python(value)
+    except (ValidationError, TypeError, ValueError):
+        raise BadRequest('Invalid page cursor.')
+    if converted is None or not isinstance(value, (str, int, float)):
+        raise BadRequest('Invalid page cursor.')
+    return converted
+
+
+def parse_page_size(raw, default=DEFAULT_PAGE_SIZE):
+    try:
+        size = int(raw)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def keyset_order(order_field):
+    """Return ``(field_name, descending, order_by expressions)`` for a sort_map value."""
+    descending = order_field.startswith('-')
+    field = order_field.lstrip('-')
+    if descending:
+        ordering = [F(field).desc(nulls_last=True), F('pk').desc()]
+    else:
+        ordering = [F(field).asc(nulls_last=True), F('pk').asc()]
+    return field, descending, ordering
+
+
+def _after(field, descending, value, pk):
+    """Q object selecting rows that sort strictly after ``(value, pk)``."""
+    cmp = 'lt' if descending else 'gt'
+    if value is None:
+        # Already inside the NULL tail: only the id tie-break is left
+        return Q(**{f'{field}__isnull': True, f'pk__{cmp}': pk})
+    return (
+        Q(**{f'{field}__{cmp}': value}) |
+        Q(**{field: value, f'pk__{cmp}': pk}) |
+        Q(**{f'{field}__isnull': True})
+    )
+
+
+class KeysetPage:
+    """One page of results plus the cursor for the page after it."""
+
+    def __init__(self, object_list, next_cursor, is_first):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.is_first = is_first
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def ordered(queryset, order_field):
+    """Apply the stable ``(sort_key, id)`` ordering used by the paginator."""
+    _, _, ordering = keyset_order(order_field)
+    return queryset.order_by(*ordering)
+
+
+def paginate(queryset, order_field, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Fetch one page of ``queryset`` ordered by ``order_field`` (a sort_map value).
+
+    Only ``page_size + 1`` rows are read: the extra row tells us whether a
+    next page exists.
+    """
+    field, descending, ordering = keyset_order(order_field)
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        value, pk = decode_cursor(cursor)
+        value = _cursor_value(queryset, field, value)
+        queryset = queryset.filter(_after(field, descending, value, pk))
+
+    rows = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, field), last.pk)
+    return KeysetPage(rows, next_cursor, is_first=not cursor)
+
+
+def paginate_merged(querysets, order_field, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    Fetch one page of ``querysets`` merged into one list ordered by
+    ``order_field``. Their ids must not overlap, so one cursor serves them all.
+
+    Each queryset is read for one page past the cursor and the rows are merged
+    in memory, so a page costs one indexed query per queryset.
+    """
+    field, descending, _ = keyset_order(order_field)
+    pages = [paginate(queryset, order_field, cursor, page_size) for queryset in querysets]
+    rows = [row for page in pages for row in page.object_list]
+    # The database's order: (key, id) in the sort direction, NULL keys last
+    keyed = sorted((row for row in rows if getattr(row, field) is not None),
+                   key=lambda row: (getattr(row, field), row.pk), reverse=descending)
+    nulls = sorted((row for row in rows if getattr(row, field) is None), key=lambda row: row.pk, reverse=descending)
+    rows = keyed + nulls
+
+    next_cursor = None
+    if len(rows) > page_size or any(page.has_next for page in pages):
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, field), last.pk)
+    return KeysetPage(rows, next_cursor, is_first=not cursor)
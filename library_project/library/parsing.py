@@ -0,0 +1,156 @@
+"""
+CSV row parsing for catalogue imports.
+
+This module deliberately has no Django imports so that ``import_books
+--workers`` can run ``parse_range`` in worker processes without setting up
+Django in each of them.
+"""
+import csv
+import gzip
+import io
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+# Byte ranges handed out per worker; more ranges keep workers busy while
+# the writer is still consuming earlier ones
+RANGES_PER_WORKER = 4
+
+# CSV columns: 0: SNo, 1: Category, 2: ISBN, 3: Title Name, 4: Author/Writer,
+# 5: Copies, 7: Publication Year, 11: About the Book
+
+
+class RowError(Exception):
+    """A CSV row that cannot be turned into a book."""
+
+
+def parse_row(row):
+    """
+    Map a CSV row to Book field values.
+
+    Raises RowError for rows that must be skipped.
+    """
+    try:
+        title = row[3].strip()
+        author = row[4].strip() or None
+        isbn = row[2].strip() or None
+        category = row[1].strip() or None
+        copies = row[5].strip()
+        year = row[7].strip()
+        description = row[11] or None
+    except IndexError:
+        raise RowError('Row has too few columns')
+
+    if not title:
+        raise RowError('Missing title')
+
+    return {
+        'title': title,
+        'author': author,
+        'isbn': isbn,
+        'category': category,
+        # Catalogues without a Copies column hold one copy of each title
+        'copies': int(copies) if copies.isdigit() else 1,
+        'publication_year': int(year) if year.isdigit() else None,
+        'description': description,
+    }
+
+
+def split_ranges(path, parts):
+    """
+    Split the data rows of a CSV file (everything after the header) into at
+    most ``parts`` byte ranges, each starting at the beginning of a line.
+
+    Quoted fields containing newlines may not straddle a boundary, so files
+    with multi-line descriptions must be imported without workers.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.readline()  # header
+        data_start = f.tell()
+        step = max(1, (size - data_start) // max(1, parts))
+        bounds = [data_start]
+        for i in range(1, parts):
+            f.seek(max(data_start + i * step, bounds[-1]))
+            f.readline()  # move to the start of the next line
+            position = f.tell()
+            if position >= size:
+                break
+            if position > bounds[-1]:
+                bounds.append(position)
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if end > start]
+
+
+def parse_range(task):
+    """
+    Parse the rows in one byte range of ``path``.
+
+    Returns ``(results, cpu_seconds)`` where each result is either a record
+    dict or a RowError, in file order.
+    """
+    path, start, end = task
+    started = time.process_time()
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    results = []
+    for row in csv.reader(io.StringIO(data.decode('utf-8'), newline='')):
+        try:
+            results.append(parse_row(row))
+        except RowError as e:
+            results.append(e)
+    return results, time.process_time() - started
+
+
+class ParseTimings:
+    """CPU seconds spent parsing rows, summed over all processes."""
+
+    def __init__(self):
+        self.cpu = 0.0
+
+
+def open_text(path):
+    """Open a catalogue file for reading; ``.gz`` files (e.g. from export_catalogue) are decompressed."""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode='rt', encoding='utf-8-sig', newline='')
+    return open(path, mode='r', encoding='utf-8-sig', newline='')
+
+
+def iter_rows(path, timings):
+    """Parse the data rows of ``path`` in this process, yielding records or RowErrors in order."""
+    with open_text(path) as file:
+        reader = csv.reader(file)
+        next(reader, None)  # header
+        for row in reader:
+            started = time.process_time()
+            try:
+                result = parse_row(row)
+            except RowError as e:
+                result = e
+            timings.cpu += time.process_time() - started
+            yield result
+
+
+def iter_rows_parallel(path, workers, timings):
+    """
+    Like ``iter_rows`` but parse byte ranges in a pool of ``workers`` processes.
+
+    Results are yielded in file order, and at most two ranges per worker are
+    in flight so memory stays bounded when the writer is the bottleneck.
+    """
+    ranges = iter(split_ranges(path, workers * RANGES_PER_WORKER))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque(
+            pool.submit(parse_range, (path, start, end))
+            for start, end in islice(ranges, workers * 2)
+        )
+        while pending:
+            results, cpu = pending.popleft().result()
+            timings.cpu += cpu
+            next_range = next(ranges, None)
+            if next_range is not None:
+                pending.append(pool.submit(parse_range, (path, *next_range)))
+            yield from results
@@ -0,0 +1,286 @@
+"""
+Request profiling.
+
+``ProfilingMiddleware`` records, for every request, the wall time, the time
+spent in database queries, the number of queries, how many of them repeated
+an earlier query of the same request (same SQL and parameters) and the time
+spent rendering templates. Samples are kept per view name in a fixed-size
+window, so the percentiles describe recent traffic and memory stays bounded.
+``render_metrics()`` exposes them in the Prometheus text format.
+
+Queries are timed by an execute wrapper installed on every database
+connection as it opens. Templates are timed by the ``DjangoTemplates``
+backend below, which settings.TEMPLATES selects. Both report to the sample
+of the request being served, found through a context variable, so work done
+in ``sync_to_async`` worker threads is counted too.
+
+Staff can add ``?profile=1`` to a URL to get a cProfile report of that one
+request instead of its response. Python 3.10 and later are supported (as by
+Django 5.2), but ASGI requests are profiled differently across versions. Up
+to 3.11, cProfile only sees the thread it was enabled in, so a sync view,
+which runs in a worker thread, is profiled separately in that thread and
+both profiles go into the report. From 3.12, cProfile is built on
+``sys.monitoring``. That sees every thread and allows one profiler per
+process, so enabling a second one would raise ValueError. The event loop's
+profiler then covers the worker thread on its own.
+
+Like the cache metrics, the numbers are per process.
+"""
+import cProfile
+import io
+import math
+import pstats
+import sys
+import threading
+from collections import defaultdict, deque
+from contextvars import ContextVar
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.http import HttpResponse
+from django.template.backends import django as django_backend
+
+# Most recent requests per view the percentiles are taken over
+WINDOW = 1000
+QUANTILES = (0.5, 0.95, 0.99)
+# Functions listed in a ?profile=1 report
+PROFILE_LINES = 60
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_current = ContextVar('library_profile_sample', default=None)
+# Profiles of the worker threads of an ASGI ?profile=1 request
+_thread_profiles = ContextVar('library_thread_profiles', default=None)
+_windows = defaultdict(lambda: deque(maxlen=WINDOW))
+_totals = defaultdict(lambda: defaultdict(float))
+_lock = threading.Lock()
+
+
+class Sample:
+    """What one request spent, filled in while it is served."""
+
+    __slots__ = ('wall', 'db', 'queries', 'duplicates', 'template', 'seen')
+
+    def __init__(self):
+        self.wall = self.db = self.template = 0.0
+        self.queries = self.duplicates = 0
+        self.seen = set()
+
+
+def _record_query(execute, sql, params, many, context):
+    sample = _current.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    started = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        sample.db += perf_counter() - started
+        sample.queries += 1
+        key = (sql, repr(params))
+        if key in sample.seen:
+            sample.duplicates += 1
+        else:
+            sample.seen.add(key)
+
+
+def install(sender=None, connection=None, **kwargs):
+    """``connection_created`` receiver: time the queries run on ``connection``."""
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+class Template(django_backend.Template):
+    def render(self, context=None, request=None):
+        sample = _current.get()
+        if sample is None:
+            return super().render(context, request)
+        started = perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            sample.template += perf_counter() - started
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """The stock Django template backend, with render times reported to the profiler."""
+
+    def from_string(self, template_code):
+        return Template(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name).template, self)
+
+
+def record(view, sample):
+    with _lock:
+        _windows[view].append((sample.wall, sample.db, sample.template))
+        totals = _totals[view]
+        totals['count'] += 1
+        totals['wall'] += sample.wall
+        totals['db'] += sample.db
+        totals['template'] += sample.template
+        totals['queries'] += sample.queries
+        totals['duplicates'] += sample.duplicates
+
+
+def _quantile(ordered, q):
+    # Nearest rank
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def metrics():
+    """
+    Per-view totals since startup, and wall/db/template times in seconds at
+    each of QUANTILES over the last WINDOW requests:
+    ``{view: {'count': ..., 'wall': [p50, p95, p99], ...}}``.
+    """
+    with _lock:
+        windows = {view: list(samples) for view, samples in _windows.items()}
+        totals = {view: dict(counts) for view, counts in _totals.items()}
+    snapshot = {}
+    for view, samples in windows.items():
+        entry = {
+            'count': int(totals[view]['count']),
+            'queries': int(totals[view]['queries']),
+            'duplicates': int(totals[view]['duplicates']),
+            'sums': {kind: totals[view][kind] for kind in ('wall', 'db', 'template')},
+        }
+        for i, kind in enumerate(('wall', 'db', 'template')):
+            ordered = sorted(sample[i] for sample in samples)
+            entry[kind] = [_quantile(ordered, q) for q in QUANTILES]
+        snapshot[view] = entry
+    return snapshot
+
+
+def reset_metrics():
+    with _lock:
+        _windows.clear()
+        _totals.clear()
+
+
+def _label(value):
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def render_metrics():
+    """The metrics in the Prometheus text exposition format."""
+    snapshot = sorted(metrics().items())
+    lines = []
+    for kind, name, help_text in (
+        ('wall', 'library_request_seconds', 'Wall time of a request, by view.'),
+        ('db', 'library_db_seconds', 'Time a request spent in database queries, by view.'),
+        ('template', 'library_template_seconds', 'Time a request spent rendering templates, by view.'),
+    ):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} summary']
+        for view, entry in snapshot:
+            view = _label(view)
+            for q, value in zip(QUANTILES, entry[kind]):
+                lines.append(f'{name}{{view="{view}",quantile="{q}"}} {value:.6f}')
+            lines.append(f'{name}_sum{{view="{view}"}} {entry["sums"][kind]:.6f}')
+            lines.append(f'{name}_count{{view="{view}"}} {entry["count"]}')
+    for key, name, help_text in (
+        ('queries', 'library_db_queries_total', 'Database queries run, by view.'),
+        ('duplicates', 'library_duplicate_queries_total',
+         'Queries that repeated an earlier query of the same request, by view.'),
+    ):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        lines += [f'{name}{{view="{_label(view)}"}} {entry[key]}' for view, entry in snapshot]
+    return '\n'.join(lines) + '\n'
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else '<unresolved>'
+
+
+def _wants_profile(request):
+    return request.GET.get('profile') == '1'
+
+
+def _profiler_active():
+    """Whether a process-wide profiler is running (``sys.monitoring``, Python 3.12+)."""
+    monitoring = getattr(sys, 'monitoring', None)
+    return monitoring is not None and monitoring.get_tool(monitoring.PROFILER_ID) is not None
+
+
+def _profile_report(*profilers):
+    out = io.StringIO()
+    stats = pstats.Stats(profilers[0], stream=out)
+    for profiler in profilers[1:]:
+        stats.add(profiler)
+    stats.sort_stats('cumulative').print_stats(PROFILE_LINES)
+    return HttpResponse(out.getvalue(), content_type='text/plain; charset=utf-8')
+
+
+class ProfilingMiddleware:
+    """
+    Record a Sample for every request; answer staff ``?profile=1`` requests
+    with a cProfile report.
+
+    Must come after AuthenticationMiddleware, which ``?profile=1`` relies on.
+    Under ASGI the report also covers whatever else the event loop ran while
+    the request was awaiting.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if _wants_profile(request) and request.user.is_staff:
+            profiler = cProfile.Profile()
+            profiler.runcall(self.get_response, request)
+            return _profile_report(profiler)
+
+        sample = Sample()
+        token = _current.set(sample)
+        started = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            sample.wall = perf_counter() - started
+            _current.reset(token)
+        record(_view_name(request), sample)
+        return response
+
+    async def __acall__(self, request):
+        if _wants_profile(request) and (await request.auser()).is_staff:
+            profiler = cProfile.Profile()
+            thread_profiles = []
+            token = _thread_profiles.set(thread_profiles)
+            profiler.enable()
+            try:
+                await self.get_response(request)
+            finally:
+                profiler.disable()
+                _thread_profiles.reset(token)
+            return _profile_report(profiler, *thread_profiles)
+
+        sample = Sample()
+        token = _current.set(sample)
+        started = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            sample.wall = perf_counter() - started
+            _current.reset(token)
+        record(_view_name(request), sample)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        thread_profiles = _thread_profiles.get()
+        if thread_profiles is None or iscoroutinefunction(view_func) or _profiler_active():
+            return None
+        # A sync process_view runs in the thread the sync view would run in;
+        # call the view here, under a profiler enabled in this thread
+        profiler = cProfile.Profile()
+        thread_profiles.append(profiler)
+        return profiler.runcall(view_func, request, *view_args, **view_kwargs)
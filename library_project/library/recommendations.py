@@ -0,0 +1,189 @@
+"""
+"Readers also borrowed" recommendations from borrowing co-occurrence.
+
+Think of the borrowing history as a sparse student x book matrix A holding a
+1 where the student has borrowed the book (APPROVED or RETURNED loans).
+``A.T @ A`` is the item-item co-occurrence matrix: how many readers two
+books share. It is computed the way a sparse product is, one student row at
+a time, adding every pair on the student's shelf into a dict of Counters.
+The cost is the sum of squared shelf sizes, which MAX_SHELF bounds.
+Archived loans (library.archive) are part of the history too.
+
+Scores are cosine similarities, ``shared / sqrt(readers(a) * readers(b))``,
+so a bestseller doesn't become every book's neighbour. The TOP_N best per
+book go into the Recommendation table. Book pages read them back with one
+lookup on its (book, rank) index.
+
+``rebuild()`` recomputes everything. ``rebuild(since=...)`` only recomputes
+books read by students with a loan approved since then. Neighbours that
+were not recomputed keep their old reader counts until the next full
+rebuild. ``manage.py recommend_books`` runs either one.
+"""
+import heapq
+import math
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.utils import timezone
+
+from .models import ArchivedBorrowing, Borrowing, Recommendation
+
+# Loans that count as "read"
+READ_STATUSES = ('APPROVED', 'RETURNED')
+TOP_N = 10
+# Fewer shared readers than this is noise, not taste
+MIN_CO_READERS = 2
+# Most recent books per student that are paired up
+MAX_SHELF = 200
+# Recent books a student's recommendations are drawn from
+PROFILE_SEEDS = 20
+BATCH_SIZE = 2000
+
+
+@dataclass
+class RebuildResult:
+    books: int = 0
+    recommendations: int = 0
+    students: int = 0
+    full: bool = True
+
+
+def _read(model):
+    return model.objects.filter(status__in=READ_STATUSES)
+
+
+def _shelves(scopes):
+    """
+    student -> up to MAX_SHELF books they have read, most recent first;
+    ``scopes`` are live loans first, then archived ones.
+    """
+    shelves = defaultdict(list)
+    seen = set()
+    for borrowings in scopes:
+        rows = borrowings.order_by('student', '-request_date').values_list('student', 'book')
+        for student, book in rows.iterator(chunk_size=BATCH_SIZE):
+            shelf = shelves[student]
+            if len(shelf) < MAX_SHELF and (student, book) not in seen:
+                seen.add((student, book))
+                shelf.append(book)
+    return shelves
+
+
+def co_occurrences(shelves, books=None):
+    """
+    ``{book: Counter({other: shared readers})}`` over ``shelves``; only rows
+    for ``books`` if given.
+    """
+    counts = defaultdict(Counter)
+    for shelf in shelves.values():
+        for a in shelf:
+            if books is not None and a not in books:
+                continue
+            row = counts[a]
+            for b in shelf:
+                if b != a:
+                    row[b] += 1
+    return counts
+
+
+def neighbours(counts, readers, top_n=TOP_N, min_co_readers=MIN_CO_READERS):
+    """``{book: [(other, score, shared)]}``, best first."""
+    ranked = {}
+    for book, row in counts.items():
+        scored = (
+            (other, shared / math.sqrt(readers[book] * readers[other]), shared)
+            for other, shared in row.items() if shared >= min_co_readers
+        )
+        best = heapq.nlargest(top_n, scored, key=lambda item: (item[1], item[2], -item[0]))
+        if best:
+            ranked[book] = best
+    return ranked
+
+
+def last_computed():
+    return Recommendation.objects.aggregate(last=Max('computed_at'))['last']
+
+
+def rebuild(since=None, top_n=TOP_N, min_co_readers=MIN_CO_READERS, batch_size=BATCH_SIZE):
+    """
+    Recompute the Recommendation table, or only the rows of books touched by
+    loans approved at or after ``since``. Returns a RebuildResult.
+    """
+    started = timezone.now()
+    tables = (Borrowing, ArchivedBorrowing)
+    result = RebuildResult(full=since is None)
+
+    if since is None:
+        scopes = [_read(model) for model in tables]
+        books = None
+    else:
+        # New loans are never archived yet, so only the live table has them
+        changed = _read(Borrowing).filter(approved_date__gte=since).values('student')
+        touched = Q()
+        for model in tables:
+            touched |= Q(book__in=_read(model).filter(student__in=changed).values('book'))
+        # Everyone who read a touched book: their shelves make up its row of A.T @ A
+        readers_of = Q()
+        for model in tables:
+            readers_of |= Q(student__in=_read(model).filter(touched).values('student'))
+        scopes = [_read(model).filter(readers_of) for model in tables]
+        books = {book for model in tables
+                 for book in _read(model).filter(student__in=changed).values_list('book', flat=True)}
+
+    shelves = _shelves(scopes)
+    # A student with both a live and an archived loan of a book counts twice; rare enough to ignore
+    readers = Counter()
+    for model in tables:
+        readers.update(dict(
+            _read(model).values('book').annotate(n=Count('student', distinct=True)).values_list('book', 'n')
+        ))
+    ranked = neighbours(co_occurrences(shelves, books), readers, top_n, min_co_readers)
+
+    rows = [
+        Recommendation(book_id=book, recommended_id=other, rank=rank, score=score,
+                       co_readers=shared, computed_at=started)
+        for book, best in ranked.items()
+        for rank, (other, score, shared) in enumerate(best, 1)
+    ]
+    with transaction.atomic():
+        if books is None:
+            Recommendation.objects.all().delete()
+        else:
+            stale = sorted(books)
+            for i in range(0, len(stale), batch_size):
+                Recommendation.objects.filter(book__in=stale[i:i + batch_size]).delete()
+        Recommendation.objects.bulk_create(rows, batch_size=batch_size)
+
+    result.books = len(ranked)
+    result.recommendations = len(rows)
+    result.students = len(shelves)
+    return result
+
+
+def for_book(book_id, limit=TOP_N):
+    """The book's neighbours, closest first, with their titles and authors."""
+    return (
+        Recommendation.objects.filter(book_id=book_id)
+        .select_related('recommended')
+        .only('rank', 'score', 'recommended__title', 'recommended__author')
+        .order_by('rank')[:limit]
+    )
+
+
+def for_student(student, limit=6):
+    """
+    ``[{'recommended', 'title', 'author', 'score'}]`` for books close to the
+    student's PROFILE_SEEDS most recent borrowings and not borrowed by them.
+    """
+    history = Borrowing.objects.filter(student=student)
+    seeds = history.order_by('-request_date').values('book')[:PROFILE_SEEDS]
+    return (
+        Recommendation.objects.filter(book__in=seeds)
+        .exclude(recommended__in=history.values('book'))
+        .exclude(recommended__in=ArchivedBorrowing.objects.filter(student=student).values('book'))
+        .values('recommended', title=F('recommended__title'), author=F('recommended__author'))
+        .annotate(score=Sum('score'))
+        .order_by('-score', 'recommended')[:limit]
+    )
@@ -0,0 +1,162 @@
+"""
+Read-replica routing.
+
+Replicas are the database aliases in ``settings.LIBRARY_READ_REPLICAS``
+(settings builds them from ``LIBRARY_DB_REPLICAS``). Writes always go to
+'default', the primary. Reads go to a replica only inside views wrapped in
+``replica_reads``: the catalogue pages, the student profile and the Book
+admin changelist. Everything else reads from the primary too: the write
+views (their reads feed the writes), management commands and any code
+running outside a request.
+
+Read-your-writes: once a request writes, its remaining reads go to the
+primary, and ``ReadYourWritesMiddleware`` sets a cookie that keeps the
+client's reads on the primary for ``LIBRARY_READ_YOUR_WRITES_SECONDS``.
+Within that window a client sees its own requests, approvals and edits even
+if the replicas lag behind. Cache fills made from replica reads expire
+within the same window (see ``cache_timeout``), so a lagging replica can't
+leave a stale row in the shared cache for long.
+
+The routing state of the request being served lives in a context variable,
+like the profiler's, so async views and their worker threads share it.
+"""
+import random
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+COOKIE_NAME = 'library_primary_until'
+
+_current = ContextVar('library_db_route', default=None)
+
+
+class Route:
+    """Where the current request reads from."""
+
+    __slots__ = ('pinned', 'replica', 'wrote')
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned  # wrote recently, read from the primary
+        self.replica = None
+        self.wrote = False
+
+
+def replicas():
+    return list(getattr(settings, 'LIBRARY_READ_REPLICAS', ()))
+
+
+def window():
+    return getattr(settings, 'LIBRARY_READ_YOUR_WRITES_SECONDS', 5)
+
+
+def reading_replica():
+    """The replica the current request reads from, or None for the primary."""
+    route = _current.get()
+    if route is None or route.pinned or route.wrote:
+        return None
+    return route.replica
+
+
+def cache_timeout(timeout):
+    """``timeout``, cut to the read-your-writes window for data read from a replica."""
+    return min(timeout, window()) if reading_replica() else timeout
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return reading_replica()
+
+    def db_for_write(self, model, **hints):
+        route = _current.get()
+        if route is not None:
+            route.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the primary's rows
+        pool = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Replicas get their schema from the primary
+        return False if db in replicas() else None
+
+
+def _choose_replica():
+    route = _current.get()
+    pool = replicas()
+    if route is not None and pool and route.replica is None:
+        route.replica = random.choice(pool)
+
+
+def replica_reads(view):
+    """Let ``view`` (sync or async) read from a replica unless the client wrote recently."""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            _choose_replica()
+            return await view(request, *args, **kwargs)
+    else:
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            _choose_replica()
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+def _pinned(request):
+    try:
+        return float(request.COOKIES.get(COOKIE_NAME, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def _finish(route, response):
+    if route.wrote and replicas():
+        seconds = window()
+        # The value is checked too: not every client expires cookies on time
+        response.set_cookie(COOKIE_NAME, f'{time.time() + seconds:.3f}', max_age=seconds,
+                            httponly=True, samesite='Lax')
+    return response
+
+
+class ReadYourWritesMiddleware:
+    """
+    Track the routing state of each request and pin recent writers to the
+    primary. Goes before SessionMiddleware, so session saves count as writes.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        route = Route(pinned=_pinned(request))
+        token = _current.set(route)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return _finish(route, response)
+
+    async def __acall__(self, request):
+        route = Route(pinned=_pinned(request))
+        token = _current.set(route)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return _finish(route, response)
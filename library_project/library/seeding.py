@@ -0,0 +1,152 @@
+"""
+Synthetic catalogue and borrowing history for benchmarks and load tests.
+
+Everything is drawn from one ``random.Random(seed)``, so a seed always
+produces the same books, students and histories. Popularity is skewed: books
+are picked with Zipf-like weights, so a few titles collect most of the loans
+and waiting requests, as they do in a real library.
+
+Rows are written with ``bulk_create``. That bypasses the model signals, so
+the search index, facet counts, caches and dashboard counters are brought
+up to date afterwards, the same way the book importer does it.
+"""
+import random
+from dataclasses import dataclass, field
+from datetime import timedelta
+from itertools import accumulate
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from . import caching, facets, search, services, stats, typeahead
+from .models import Book, Borrowing
+
+WORDS = (
+    'shadow river winter garden empire silent glass hidden northern memory city ocean '
+    'stone broken last golden forest crown night letters fire paper distant small '
+    'kingdom wild secret iron summer island house light storm quiet lost machine '
+    'history theory practice introduction principles modern art science journey'
+).split()
+FIRST_NAMES = ('Ada Alan Amara Ben Carla Chen Dara Elena Farid Grace Hugo Ines Jonas Kemi Lena '
+               'Marco Nadia Omar Priya Rosa Sven Tariq Uma Viktor Wen Yara Zoe').split()
+LAST_NAMES = ('Adams Bauer Costa Diaz Eriksen Fischer Garcia Haddad Ito Jensen Kowalski Larsen '
+              'Moreau Novak Okafor Petrov Quinn Rossi Sato Tanaka Usman Varga Weber Yilmaz Zhang').split()
+CATEGORIES = ('Fiction', 'Science Fiction', 'Fantasy', 'Mystery', 'History', 'Biography', 'Science',
+              'Mathematics', 'Computer Science', 'Philosophy', 'Poetry', 'Art', 'Economics',
+              'Psychology', 'Travel', 'Children', 'Reference', 'Engineering')
+
+HISTORY_DAYS = 365
+# Requests this recent may still be pending or on loan
+ACTIVE_DAYS = 30
+BATCH_SIZE = 2000
+
+
+@dataclass
+class SeedResult:
+    books: int = 0
+    students: int = 0
+    borrowings: int = 0
+    by_status: dict = field(default_factory=dict)
+
+
+def _books(rng, count):
+    authors = [f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}' for _ in range(max(1, count // 8))]
+    for _ in range(count):
+        title = ' '.join(rng.sample(WORDS, rng.randint(2, 5))).title()
+        copies = rng.choices((1, 2, 3, 5), weights=(60, 25, 10, 5))[0]
+        yield Book(
+            title=title,
+            author=rng.choice(authors),
+            category=rng.choice(CATEGORIES),
+            publication_year=rng.randint(1900, 2025),
+            description=' '.join(rng.choices(WORDS, k=rng.randint(12, 40))).capitalize() + '.',
+            copies=copies,
+            available_count=copies,
+        )
+
+
+def _history(rng, student_id, books, cum_weights, loans_per_student, now, on_shelf, active):
+    """One student's requests, oldest first; ``on_shelf``/``active`` track inventory across students."""
+    requests = sorted(now - timedelta(seconds=rng.uniform(0, HISTORY_DAYS * 86400))
+                      for _ in range(rng.randint(0, 2 * loans_per_student)))
+    for requested in requests:
+        book = rng.choices(books, cum_weights=cum_weights)[0]
+        borrowing = Borrowing(student_id=student_id, book_id=book.pk, request_date=requested)
+        recent = now - requested < timedelta(days=ACTIVE_DAYS)
+        roll = rng.random()
+        free = on_shelf[book.pk] > 0 and (student_id, book.pk) not in active
+
+        if roll < 0.08:
+            borrowing.status = 'REJECTED'
+        elif recent and free and roll < 0.25:
+            borrowing.status = 'PENDING'
+            active.add((student_id, book.pk))
+        else:
+            borrowing.approved_date = requested + timedelta(seconds=rng.uniform(600, 2 * 86400))
+            borrowing.approved_date = min(borrowing.approved_date, now)
+            borrowing.due_date = services.due_date(borrowing.approved_date)
+            if recent and free and roll < 0.6:
+                borrowing.status = 'APPROVED'
+                borrowing.is_overdue = borrowing.due_date < now
+                on_shelf[book.pk] -= 1
+                active.add((student_id, book.pk))
+            else:
+                borrowing.status = 'RETURNED'
+                kept = timedelta(days=rng.uniform(1, settings.LIBRARY_LOAN_DAYS + 7))
+                borrowing.return_date = min(borrowing.approved_date + kept, now)
+        yield borrowing
+
+
+def seed(books=1000, students=200, loans_per_student=10, seed=0, prefix='reader',
+         password='library', batch_size=BATCH_SIZE, now=None):
+    """
+    Insert ``books`` books, ``students`` students named ``<prefix><n>`` and
+    their borrowing histories. Returns a SeedResult.
+    """
+    rng = random.Random(seed)
+    now = now or timezone.now()
+    result = SeedResult()
+
+    with transaction.atomic():
+        new_books = Book.objects.bulk_create(_books(rng, books), batch_size=batch_size)
+        hashed = make_password(password)
+        new_students = User.objects.bulk_create(
+            (User(username=f'{prefix}{i}', password=hashed, email=f'{prefix}{i}@example.com')
+             for i in range(students)),
+            batch_size=batch_size,
+        )
+        result.books, result.students = len(new_books), len(new_students)
+
+        cum_weights = list(accumulate(1 / (rank + 1) ** 0.8 for rank in range(len(new_books))))
+        on_shelf = {book.pk: book.copies for book in new_books}
+        active = set()
+        borrowings = []
+        for student in new_students if new_books else ():
+            borrowings += _history(rng, student.pk, new_books, cum_weights, loans_per_student, now, on_shelf, active)
+
+        # bulk_create() stamps request_date (auto_now_add); bulk_update() writes ours back
+        dates = [borrowing.request_date for borrowing in borrowings]
+        Borrowing.objects.bulk_create(borrowings, batch_size=batch_size)
+        for borrowing, requested in zip(borrowings, dates):
+            borrowing.request_date = requested
+        Borrowing.objects.bulk_update(borrowings, ['request_date'], batch_size=batch_size)
+
+        lent = [book for book in new_books if on_shelf[book.pk] != book.copies]
+        for book in lent:
+            book.available_count = on_shelf[book.pk]
+        Book.objects.bulk_update(lent, ['available_count'], batch_size=batch_size)
+
+        search.index_books(new_books)
+        typeahead.books_changed(new_books)
+        facets.books_added(new_books)
+        caching.books_changed([])
+        stats.recount()
+        stats.recount_daily_loans()
+
+    result.borrowings = len(borrowings)
+    for borrowing in borrowings:
+        result.by_status[borrowing.status] = result.by_status.get(borrowing.status, 0) + 1
+    return result
@@ -0,0 +1,344 @@
+"""
+Borrowing state transitions shared by the views and the Django admin.
+
+Every transition is a conditional UPDATE (``... WHERE status = 'PENDING'``,
+``... SET available_count = available_count - 1 WHERE available_count > 0``)
+inside a transaction, so when two staff members race for the last copy of a
+book only one approval can win. The update count tells us whether we won; no
+decision is taken on a value read earlier.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from . import caching, facets, holds, live, stats
+from .models import Book, Borrowing, Hold
+
+# Outcomes reported by the functions below
+REQUESTED = 'requested'
+ALREADY_ACTIVE = 'already_active'
+APPROVED = 'approved'
+REJECTED = 'rejected'
+QUEUED = 'queued'
+WAITLISTED = 'waitlisted'
+NOT_PENDING = 'not_pending'
+UNAVAILABLE = 'unavailable'
+RETURNED = 'returned'
+NOT_ON_LOAN = 'not_on_loan'
+UPDATED = 'updated'
+TOO_FEW_COPIES = 'too_few_copies'
+
+ACTIVE_STATUSES = ('PENDING', 'APPROVED')
+
+
+def due_date(approved):
+    """When a loan approved at ``approved`` is due back."""
+    return approved + timedelta(days=settings.LIBRARY_LOAN_DAYS)
+
+
+def request_book(student, book):
+    """
+    Create a PENDING request for ``book``, or put the student on its
+    waitlist when every copy is out.
+
+    Returns REQUESTED, QUEUED or ALREADY_ACTIVE.
+    """
+    try:
+        with transaction.atomic():
+            if Borrowing.objects.filter(student=student, book=book, status__in=ACTIVE_STATUSES).exists():
+                return ALREADY_ACTIVE
+            if not Book.objects.filter(pk=book.pk, available_count__gt=0).exists():
+                holds.lock_book(book.pk)
+                if Hold.objects.filter(student=student, book=book).exists():
+                    return ALREADY_ACTIVE
+                holds.enqueue([(book.pk, student.pk, timezone.now())])
+                return QUEUED
+            Borrowing.objects.create(student=student, book=book, status='PENDING')
+    except IntegrityError:
+        # A concurrent duplicate won the one-active-request (or one-hold) per book race
+        return ALREADY_ACTIVE
+    return REQUESTED
+
+
+def leave_waitlist(student, book):
+    """Take the student off the book's waitlist; returns whether they were on it."""
+    with transaction.atomic():
+        return holds.leave(student, book.pk)
+
+
+def _waitlist_pending(book_ids, now, exclude=()):
+    """
+    Move the pending requests for ``book_ids`` (oldest first) onto the books'
+    waitlists and mark them WAITLISTED.
+
+    Returns ``[(borrowing_id, book_id, student_id)]`` for the moved requests.
+    """
+    pending = list(
+        Borrowing.objects.filter(book_id__in=book_ids, status='PENDING')
+        .exclude(pk__in=exclude)
+        .order_by('request_date', 'pk')
+        .values_list('pk', 'book_id', 'student_id', 'request_date')
+    )
+    if not pending:
+        return []
+    holds.enqueue([(book_id, student_id, requested) for _, book_id, student_id, requested in pending])
+    Borrowing.objects.filter(pk__in=[pk for pk, _, _, _ in pending]).update(status='WAITLISTED', updated_at=now)
+    return [(pk, book_id, student_id) for pk, book_id, student_id, _ in pending]
+
+
+def _take_copy(book_id, now):
+    """Lend one copy of a book; returns the copies left, or None if none were on the shelf."""
+    taken = Book.objects.filter(pk=book_id, available_count__gt=0).update(
+        available_count=F('available_count') - 1, updated_at=now,
+    )
+    if not taken:
+        return None
+    # Our UPDATE holds the row lock, so this is exactly what we left behind
+    return Book.objects.filter(pk=book_id).values_list('available_count', flat=True).get()
+
+
+def _put_back_copy(book_id, now):
+    """Shelve one returned copy; returns True if it was the only copy now available."""
+    shelved = Book.objects.filter(pk=book_id, available_count__lt=F('copies')).update(
+        available_count=F('available_count') + 1, updated_at=now,
+    )
+    if not shelved:
+        return False
+    return Book.objects.filter(pk=book_id).values_list('available_count', flat=True).get() == 1
+
+
+def approve(borrowing_id, now=None):
+    """
+    Approve one pending request and lend out one copy of its book. If that
+    was the last copy, the other pending requests for the book move to its
+    waitlist.
+
+    Returns APPROVED, NOT_PENDING or UNAVAILABLE (every copy is out).
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        # Claim the request first: the write takes the lock before anything is read
+        claimed = Borrowing.objects.filter(pk=borrowing_id, status='PENDING').update(
+            status='APPROVED', approved_date=now, due_date=due_date(now), updated_at=now,
+        )
+        if not claimed:
+            return NOT_PENDING
+
+        book_id, student_id = Borrowing.objects.filter(pk=borrowing_id).values_list('book_id', 'student_id').get()
+        left = _take_copy(book_id, now)
+        if left is None:
+            # Every copy is out; undo the claim
+            transaction.set_rollback(True)
+            return UNAVAILABLE
+
+        waitlisted = []
+        if not left:
+            waitlisted = _waitlist_pending([book_id], now)
+            live.availability_changed(book_id, False)
+
+        stats.adjust(requests_pending=-(1 + len(waitlisted)), loans_active=1, books_available=-int(not left))
+        stats.loans_approved()
+        facets.availability_changed()
+        caching.books_changed([book_id])
+        live.request_status_changed(book_id, [(borrowing_id, student_id)], 'APPROVED')
+        for pk, _, waiting_student_id in waitlisted:
+            live.request_status_changed(book_id, [(pk, waiting_student_id)], 'WAITLISTED')
+    return APPROVED
+
+
+def reject(borrowing_ids):
+    """Reject the given requests that are still pending; returns how many were."""
+    with transaction.atomic():
+        pending = Borrowing.objects.filter(pk__in=borrowing_ids, status='PENDING')
+        if live.has_subscribers():
+            for pk, book_id, student_id in pending.values_list('pk', 'book_id', 'student_id'):
+                live.request_status_changed(book_id, [(pk, student_id)], 'REJECTED')
+        rejected = pending.update(status='REJECTED', updated_at=timezone.now())
+        stats.adjust(requests_pending=-rejected)
+    return rejected
+
+
+def return_book(borrowing_id, now=None):
+    """
+    Check a loaned copy back in. If anyone is on the book's waitlist, the copy
+    goes straight to the head of the queue as a new loan; otherwise it goes
+    back on the shelf.
+
+    Returns RETURNED, or NOT_ON_LOAN if the borrowing is not an active loan.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        returned = Borrowing.objects.filter(pk=borrowing_id, status='APPROVED').update(
+            status='RETURNED', return_date=now, updated_at=now,
+        )
+        if not returned:
+            return NOT_ON_LOAN
+
+        book_id, student_id, was_overdue = (
+            Borrowing.objects.filter(pk=borrowing_id).values_list('book_id', 'student_id', 'is_overdue').get()
+        )
+        stats.adjust(loans_active=-1, loans_overdue=-int(was_overdue))
+        live.request_status_changed(book_id, [(borrowing_id, student_id)], 'RETURNED')
+
+        holds.lock_book(book_id)
+        if _serve_holds(book_id, 1, now):
+            return RETURNED
+
+        flipped = _put_back_copy(book_id, now)
+        stats.adjust(books_available=int(flipped))
+        facets.availability_changed()
+        caching.books_changed([book_id])
+        if flipped:
+            live.availability_changed(book_id, True)
+    return RETURNED
+
+
+def _serve_holds(book_id, copies, now):
+    """
+    Lend up to ``copies`` copies of a book straight to the head of its
+    waitlist, with the book locked. Holders who already have an active
+    request for the book lose their hold instead. Returns the new loans.
+    """
+    loans = []
+    while len(loans) < copies:
+        head = holds.pop_head(book_id)
+        if head is None:
+            break
+        if Borrowing.objects.filter(student_id=head.student_id, book_id=book_id,
+                                    status__in=ACTIVE_STATUSES).exists():
+            # They got a request in some other way meanwhile; the hold is spent
+            continue
+        # The copy never reaches the shelf; the Borrowing signals count the new loan
+        loan = Borrowing.objects.create(
+            student_id=head.student_id, book_id=book_id, status='APPROVED',
+            approved_date=now, due_date=due_date(now),
+        )
+        live.request_status_changed(book_id, [(loan.pk, head.student_id)], 'APPROVED')
+        loans.append(loan)
+    return loans
+
+
+def set_copies(book_id, copies, now=None):
+    """
+    Change how many copies of a book the library owns. Added copies serve
+    the waitlist first and the rest go on the shelf; removed copies come off
+    the shelf, so there can never be fewer copies than are on loan.
+
+    Returns UPDATED, or TOO_FEW_COPIES if more than ``copies`` are on loan.
+    """
+    now = now or timezone.now()
+    with transaction.atomic():
+        holds.lock_book(book_id)
+        old_copies, available = Book.objects.filter(pk=book_id).values_list('copies', 'available_count').get()
+        added = copies - old_copies
+        if available + added < 0:
+            return TOO_FEW_COPIES
+        served = len(_serve_holds(book_id, added, now)) if added > 0 else 0
+        # A delta rather than a value read earlier, like every other counter move
+        Book.objects.filter(pk=book_id).update(
+            copies=copies, available_count=F('available_count') + added - served, updated_at=now,
+        )
+
+        was_available, is_available = available > 0, available + added - served > 0
+        waitlisted = []
+        if was_available and not is_available:
+            waitlisted = _waitlist_pending([book_id], now)
+        stats.adjust(requests_pending=-len(waitlisted), books_available=int(is_available) - int(was_available))
+        facets.availability_changed()
+        caching.books_changed([book_id])
+        if was_available != is_available:
+            live.availability_changed(book_id, is_available)
+        for pk, _, student_id in waitlisted:
+            live.request_status_changed(book_id, [(pk, student_id)], 'WAITLISTED')
+    return UPDATED
+
+
+def bulk_approve(borrowing_ids, now=None):
+    """
+    Approve a batch of borrowing requests in a constant number of queries.
+
+    For each book among the selected requests, the earliest selected requests
+    win, one per copy on the shelf. When that takes the last copy, every other
+    pending request for the book moves to its waitlist. Requests for a book
+    with every copy out are left pending.
+
+    Returns ``{borrowing_id: outcome}`` covering the selected ids and every
+    request waitlisted as a side effect.
+    """
+    now = now or timezone.now()
+    borrowing_ids = set(borrowing_ids)
+    outcomes = {pk: NOT_PENDING for pk in borrowing_ids}
+
+    with transaction.atomic():
+        # Row locks on PostgreSQL; on SQLite the IMMEDIATE transaction already
+        # holds the write lock, so nothing read here can change underneath us
+        candidates = list(
+            Borrowing.objects.select_for_update()
+            .filter(pk__in=borrowing_ids, status='PENDING')
+            .order_by('request_date', 'pk')
+            .values_list('pk', 'book_id', 'student_id')
+        )
+        book_ids = {book_id for _, book_id, _ in candidates}
+        available = dict(
+            Book.objects.select_for_update()
+            .filter(pk__in=book_ids, available_count__gt=0)
+            .values_list('pk', 'available_count')
+        )
+
+        winners = {}
+        students = {}
+        for pk, book_id, student_id in candidates:
+            students[pk] = student_id
+            if book_id not in available:
+                outcomes[pk] = UNAVAILABLE
+            elif len(winners.setdefault(book_id, [])) < available[book_id]:
+                winners[book_id].append(pk)
+            # once the copies run out, later requests for the book are waitlisted below
+
+        if not winners:
+            return outcomes
+
+        approved_ids = [pk for pks in winners.values() for pk in pks]
+        exhausted = [book_id for book_id, pks in winners.items() if len(pks) == available[book_id]]
+        approved = Borrowing.objects.filter(pk__in=approved_ids, status='PENDING').update(
+            status='APPROVED', approved_date=now, due_date=due_date(now), updated_at=now,
+        )
+        # One UPDATE lends out every winning copy; the counts were locked above
+        Book.objects.filter(pk__in=winners.keys()).update(
+            available_count=F('available_count') - Case(
+                *[When(pk=book_id, then=Value(len(pks))) for book_id, pks in winners.items()]
+            ),
+            updated_at=now,
+        )
+        waitlisted = _waitlist_pending(exhausted, now, exclude=approved_ids) if exhausted else []
+
+        stats.adjust(requests_pending=-(approved + len(waitlisted)), loans_active=approved,
+                     books_available=-len(exhausted))
+        stats.loans_approved(approved)
+        facets.availability_changed()
+        caching.books_changed(winners.keys())
+        for book_id in exhausted:
+            live.availability_changed(book_id, False)
+        for book_id, pks in winners.items():
+            live.request_status_changed(book_id, [(pk, students[pk]) for pk in pks], 'APPROVED')
+        for pk, book_id, student_id in waitlisted:
+            live.request_status_changed(book_id, [(pk, student_id)], 'WAITLISTED')
+
+    outcomes.update({pk: APPROVED for pk in approved_ids})
+    outcomes.update({pk: WAITLISTED for pk, _, _ in waitlisted})
+    return outcomes
+
+
+def summarize(outcomes):
+    """Human-readable one-liner for a bulk_approve() result."""
+    counts = Counter(outcomes.values())
+    parts = [f'{counts[APPROVED]} approved', f'{counts[WAITLISTED]} moved to the waitlist']
+    if counts[UNAVAILABLE]:
+        parts.append(f'{counts[UNAVAILABLE]} left pending (no copies available)')
+    if counts[NOT_PENDING]:
+        parts.append(f'{counts[NOT_PENDING]} no longer pending')
+    return ', '.join(parts) + '.'
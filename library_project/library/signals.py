@@ -0,0 +1,81 @@
+"""
+Signal handlers that keep derived data in sync with the core models.
+"""
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from . import caching, facets, live, search, stats, typeahead
+from .models import Book, Borrowing
+
+
+@receiver(post_init, sender=Book)
+def book_loaded(sender, instance, **kwargs):
+    # Remember facet values so saves can send count deltas instead of recounting
+    instance._facet_snapshot = facets.snapshot(instance)
+    instance._list_snapshot = caching.snapshot(instance)
+    count = instance.__dict__.get('available_count')
+    instance._was_available = None if count is None else count > 0
+
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, created=False, update_fields=None, **kwargs):
+    if created:
+        stats.adjust(books_total=1, books_available=int(instance.is_available))
+    elif instance._was_available is not None and instance._was_available != instance.is_available:
+        stats.adjust(books_available=1 if instance.is_available else -1)
+        live.availability_changed(instance.pk, instance.is_available)
+    instance._was_available = instance.is_available
+
+    facets.book_changed(instance, created)
+    lists_changed = caching.list_fields_changed(instance)
+    caching.books_changed([instance.pk], lists=created or lists_changed)
+    # Saves that only touch non-indexed columns (e.g. availability) skip re-indexing
+    if update_fields and not set(update_fields) & set(search.INDEXED_FIELDS):
+        return
+    search.index_book(instance)
+    typeahead.books_changed([instance])
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, **kwargs):
+    stats.adjust(books_total=-1, books_available=-int(bool(instance._was_available)))
+    facets.book_deleted(instance)
+    caching.books_changed([instance.pk])
+    search.remove_books([instance.pk])
+    typeahead.books_removed([instance.pk])
+
+
+@receiver(post_init, sender=Borrowing)
+def borrowing_loaded(sender, instance, **kwargs):
+    instance._saved_status = instance.__dict__.get('status')
+
+
+@receiver(post_save, sender=Borrowing)
+def borrowing_saved(sender, instance, created=False, **kwargs):
+    old = None if created else instance._saved_status
+    if old != instance.status:
+        stats.status_changed(old, instance.status)
+        if old == 'APPROVED' and instance.is_overdue:
+            stats.adjust(loans_overdue=-1)
+        if instance.status == 'APPROVED':
+            stats.loans_approved()
+        # Cached pages only show the Book's own counts; the services that move
+        # them invalidate, so a new request doesn't retire every cached list
+        if not created:
+            live.request_status_changed(instance.book_id, [(instance.pk, instance.student_id)], instance.status)
+    instance._saved_status = instance.status
+
+
+@receiver(post_delete, sender=Borrowing)
+def borrowing_deleted(sender, instance, **kwargs):
+    stats.status_changed(instance._saved_status, None)
+    if instance._saved_status == 'APPROVED' and instance.is_overdue:
+        stats.adjust(loans_overdue=-1)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    # Covers is_staff/is_active/password changes; see library.auth
+    caching.users_changed([instance.pk])
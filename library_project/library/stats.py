@@ -0,0 +1,110 @@
+"""
+Denormalized library-wide counters.
+
+Every change to books or borrowings adjusts the single LibraryStats row with
+an ``UPDATE ... SET col = col + delta`` in the same transaction, so the
+admin dashboard reads all its numbers from one row instead of running
+COUNT(*) scans. ``recount()`` rebuilds everything from the base tables.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import ArchivedBorrowing, Book, Borrowing, DailyLoanCount, LibraryStats
+
+STATS_PK = 1
+
+# Which counter a borrowing in each status contributes to
+STATUS_COUNTERS = {
+    'PENDING': 'requests_pending',
+    'APPROVED': 'loans_active',
+}
+
+
+def current():
+    """The counters row, recreated from the tables if it is missing."""
+    try:
+        return LibraryStats.objects.get(pk=STATS_PK)
+    except LibraryStats.DoesNotExist:
+        return recount()
+
+
+def adjust(**deltas):
+    """Apply counter deltas, e.g. ``adjust(requests_pending=-1, loans_active=1)``."""
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    updated = LibraryStats.objects.filter(pk=STATS_PK).update(
+        **{name: F(name) + delta for name, delta in deltas.items()}
+    )
+    if not updated:
+        # Row missing (e.g. flushed): counting now already includes this change
+        recount()
+
+
+def status_changed(old, new, count=1):
+    """Deltas for ``count`` borrowings moving from status ``old`` to ``new``."""
+    deltas = {}
+    if old in STATUS_COUNTERS:
+        deltas[STATUS_COUNTERS[old]] = -count
+    if new in STATUS_COUNTERS:
+        name = STATUS_COUNTERS[new]
+        deltas[name] = deltas.get(name, 0) + count
+    adjust(**deltas)
+
+
+def loans_approved(count=1, day=None):
+    """Add ``count`` approvals to today's loan total."""
+    if not count:
+        return
+    day = day or timezone.localdate()
+    updated = DailyLoanCount.objects.filter(day=day).update(loans=F('loans') + count)
+    if not updated:
+        _, created = DailyLoanCount.objects.get_or_create(day=day, defaults={'loans': count})
+        if not created:
+            DailyLoanCount.objects.filter(day=day).update(loans=F('loans') + count)
+
+
+def loans_per_day(days=7):
+    """``[(date, loans)]`` for the last ``days`` days, oldest first, zero-filled."""
+    today = timezone.localdate()
+    start = today - timedelta(days=days - 1)
+    counts = dict(DailyLoanCount.objects.filter(day__gte=start).values_list('day', 'loans'))
+    return [(start + timedelta(days=i), counts.get(start + timedelta(days=i), 0))
+            for i in range(days)]
+
+
+def recount():
+    """
+    Recompute every counter from the base tables.
+
+    Returns the refreshed LibraryStats row.
+    """
+    stats, _ = LibraryStats.objects.update_or_create(pk=STATS_PK, defaults={
+        'books_total': Book.objects.count(),
+        'books_available': Book.objects.filter(available_count__gt=0).count(),
+        'requests_pending': Borrowing.objects.filter(status='PENDING').count(),
+        'loans_active': Borrowing.objects.filter(status='APPROVED').count(),
+        'loans_overdue': Borrowing.objects.filter(status='APPROVED', is_overdue=True).count(),
+    })
+    return stats
+
+
+def recount_daily_loans():
+    """Rebuild DailyLoanCount from approval dates, archived loans included; returns the number of days."""
+    days = Counter()
+    for model in (Borrowing, ArchivedBorrowing):
+        for day, loans in (
+            model.objects.filter(approved_date__isnull=False)
+            .annotate(day=TruncDate('approved_date'))
+            .values('day')
+            .annotate(loans=Count('pk'))
+            .values_list('day', 'loans')
+        ):
+            days[day] += loans
+    DailyLoanCount.objects.all().delete()
+    rows = DailyLoanCount.objects.bulk_create(DailyLoanCount(day=day, loans=loans) for day, loans in days.items())
+    return len(rows)
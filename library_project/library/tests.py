@@ -1,3 +1,1548 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import (archive, benchmark, caching, exports, facets, holds, live, overdue, pagination, parsing, profiling,
+               recommendations, routing, search, seeding, services, stats, typeahead)
+from .catalogue import CatalogueQuery
+from .models import ArchivedBorrowing, Book, Borrowing, DailyLoanCount, Hold, Recommendation
+
+
+class SearchIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.dune = Book.objects.create(title='Dune', author='Frank Herbert', isbn='9780441013593',
+                                        description='Desert planet epic')
+        self.messiah = Book.objects.create(title='Dune Messiah', author='Frank Herbert',
+                                           description='Sequel set on Arrakis')
+        self.hobbit = Book.objects.create(title='The Hobbit', author='J. R. R. Tolkien',
+                                          description='A hobbit goes on an adventure in the desert')
+
+    def ids(self, query):
+        return list(search.search_books(Book.objects.all(), query)
+                    .order_by('search_rank', 'pk').values_list('pk', flat=True))
+
+    def test_prefix_and_multi_token_matching(self):
+        self.assertEqual(set(self.ids('herb')), {self.dune.pk, self.messiah.pk})
+        self.assertEqual(self.ids('dune mess'), [self.messiah.pk])
+        self.assertEqual(self.ids('9780441'), [self.dune.pk])
+
+    def test_title_matches_rank_above_description_matches(self):
+        self.assertEqual(self.ids('desert')[0], self.dune.pk)
+
+    def test_index_follows_edits_and_deletes(self):
+        self.hobbit.title = 'The Silmarillion'
+        self.hobbit.save()
+        self.assertEqual(self.ids('silmar'), [self.hobbit.pk])
+        self.assertEqual(self.ids('hobbit'), [self.hobbit.pk])  # still in description
+        self.messiah.delete()
+        self.assertEqual(self.ids('messiah'), [])
+
+    def test_rebuild_index(self):
+        self.assertEqual(search.rebuild_index(batch_size=2), 3)
+        self.assertEqual(set(self.ids('frank')), {self.dune.pk, self.messiah.pk})
+
+    def test_book_list_uses_search(self):
+        user = User.objects.create_user('reader', password='pw')
+        self.client.force_login(user)
+        response = self.client.get(reverse('book_list'), {'q': 'messi'})
+        self.assertEqual([b.pk for b in response.context['books']], [self.messiah.pk])
+        self.assertEqual(response.context['current_sort'], 'relevance')
+
+    def test_relevance_page_matches_once(self):
+        books = Book.objects.bulk_create(
+            Book(title=f'{"River" if i % 2 else "Lake"} tale {i}', author=f'Author {i % 50}')
+            for i in range(5000)
+        )
+        search.index_books(books)
+        query = CatalogueQuery({'q': 'river'})
+        with CaptureQueriesContext(connection) as ctx:
+            page = pagination.paginate(query.books, query.order_field)
+            pagination.paginate(query.books, query.order_field, page.next_cursor)
+        self.assertEqual(len(page), pagination.DEFAULT_PAGE_SIZE)
+        ranks = [book.search_rank for book in page]
+        self.assertEqual(ranks, sorted(ranks))
+        for captured in ctx.captured_queries:
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + captured['sql'])
+                plan = [row[-1] for row in cursor.fetchall()]
+            # One pass over the full-text index, not one MATCH per candidate book
+            self.assertEqual(sum('VIRTUAL TABLE' in step for step in plan), 1, plan)
+            self.assertFalse([step for step in plan if 'CORRELATED' in step], plan)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        years = [1990, None, 1985, 1990, None, 2001, 1985]
+        for i, year in enumerate(years):
+            Book.objects.create(title=f'Book {i}', author=None if i % 3 == 0 else f'Author {i % 2}',
+                                publication_year=year, is_available=bool(i % 2))
+
+    def walk(self, order_field, page_size=2):
+        seen, cursor = [], None
+        while True:
+            page = pagination.paginate(Book.objects.all(), order_field, cursor=cursor, page_size=page_size)
+            seen.extend(b.pk for b in page)
+            if not page.has_next:
+                return seen
+            cursor = page.next_cursor
+
+    def test_every_ordering_visits_each_row_once_in_order(self):
+        for order_field in ('title', '-title', 'author', '-author', 'publication_year',
+                            '-publication_year', 'available_count', '-available_count'):
+            with self.subTest(order_field=order_field):
+                expected = list(pagination.ordered(Book.objects.all(), order_field)
+                                .values_list('pk', flat=True))
+                self.assertEqual(self.walk(order_field), expected)
+
+    def test_cursors_of_the_wrong_type_are_bad_requests(self):
+        self.client.force_login(User.objects.create_user('reader', password='pw'))
+        for value, pk, sort in (('x', 'notint', 'title'), ('x', 1.5, 'title'), ('notint', 1, 'year'),
+                                ([1], 1, 'year'), ('x', 1, 'relevance')):
+            cursor = pagination.encode_cursor(value, pk)
+            with self.subTest(value=value, pk=pk, sort=sort):
+                response = self.client.get(reverse('book_list'), {'sort': sort, 'q': 'book', 'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+        cursor = pagination.encode_cursor(1990, 1)
+        self.assertEqual(self.client.get(reverse('book_list'), {'sort': 'year', 'cursor': cursor}).status_code, 200)
+
+    def test_book_list_pages_and_streams(self):
+        self.client.force_login(User.objects.create_user('reader', password='pw'))
+        response = self.client.get(reverse('book_list'), {'per_page': 3})
+        self.assertEqual(len(response.context['books']), 3)
+        self.assertTrue(response.context['page'].has_next)
+        response = self.client.get(reverse('book_list') + '?' + response.context['next_query'])
+        self.assertEqual([b.title for b in response.context['books']], ['Book 3', 'Book 4', 'Book 5'])
+
+        response = self.client.get(reverse('book_list'), {'stream': '1'})
+        body = b''.join(response.streaming_content).decode()
+        self.assertEqual(body.count('/book/'), 7)
+        self.assertTrue(body.rstrip().endswith('</html>'))
+
+
+class FacetCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        Book.objects.create(title='A', category='Fiction', author='Ann')
+        Book.objects.create(title='B', category='Fiction', author='Bob', is_available=False)
+        Book.objects.create(title='C', category='History', author='Ann')
+
+    def test_counts_are_patched_without_recounting(self):
+        self.assertEqual(facets.facet_counts('category'), {'Fiction': 2, 'History': 1})
+        with self.captureOnCommitCallbacks(execute=True):
+            book = Book.objects.get(title='C')
+            book.category = 'Fiction'
+            book.save()
+            Book.objects.create(title='D', category='Poetry')
+            Book.objects.get(title='A').delete()
+        with self.assertNumQueries(0):
+            self.assertEqual(facets.facet_counts('category'), {'Fiction': 2, 'Poetry': 1})
+
+    def test_book_list_facets_respect_other_filters(self):
+        self.client.force_login(User.objects.create_user('reader', password='pw'))
+        response = self.client.get(reverse('book_list'), {'author': 'Ann', 'available': '1'})
+        self.assertEqual(response.context['categories'],
+                         [('Fiction', 'Fiction (1)'), ('History', 'History (1)')])
+        self.assertEqual(response.context['authors'], [('Ann', 'Ann (2)')])
+
+
+def write_catalogue_csv(path, rows):
+    header = ['SNo', 'Category', 'ISBN', 'Title Name', 'Author/Writer', '', '', 'Publication Year',
+              '', '', '', 'About the Book']
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        for i, (category, isbn, title, author, year) in enumerate(rows, 1):
+            writer.writerow([i, category, isbn, title, author, '', '', year, '', '', '', f'About {title}'])
+
+
+class ImportBooksTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'books.csv')
+        write_catalogue_csv(self.path, [
+            ('Fiction', '111', 'Dune', 'Frank Herbert', '1965'),
+            ('Fiction', '222', 'Emma', 'Jane Austen', 'n/a'),
+            ('Fiction', '', 'Dune', 'Frank Herbert', '1965'),  # duplicate title/author
+            ('History', '111', 'Other', 'Someone', ''),  # duplicate ISBN
+            ('', '', '', 'Nobody', ''),  # missing title
+            ('Poetry', '333', 'Odes', 'Keats', '1819'),
+        ])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_import(self, *args):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('import_books', self.path, '--batch-size', '2', *args, stdout=out)
+        return out.getvalue()
+
+    def test_bulk_import_deduplicates_and_indexes(self):
+        Book.objects.create(title='Odes', author='Keats')
+        output = self.run_import()
+        self.assertIn('2 books created, 0 updated, 4 rows skipped', output)
+        self.assertEqual(Book.objects.get(isbn='222').publication_year, None)
+        self.assertEqual(set(search.search_books(Book.objects.all(), 'dune')
+                             .values_list('isbn', flat=True)), {'111'})
+        self.assertFalse(os.path.exists(self.path + '.checkpoint'))
+
+    def test_update_mode_upserts_on_isbn(self):
+        Book.objects.create(title='Old title', author='Keats', isbn='333', category='Misc')
+        self.assertEqual(facets.facet_counts('category'), {'Misc': 1})
+        self.run_import('--update')
+        book = Book.objects.get(isbn='333')
+        self.assertEqual((book.title, book.category, book.publication_year), ('Odes', 'Poetry', 1819))
+        # The later 'Other' row shares ISBN 111 with Dune, so it overwrites it
+        self.assertEqual(Book.objects.get(isbn='111').title, 'Other')
+        self.assertEqual(facets.facet_counts('category'), {'Fiction': 1, 'History': 1, 'Poetry': 1})
+
+    def test_parallel_workers_match_sequential_import(self):
+        self.run_import('--workers', '2')
+        parallel = list(Book.objects.order_by('pk').values_list('title', 'isbn'))
+        Book.objects.all().delete()
+        self.run_import()
+        self.assertEqual(parallel, list(Book.objects.order_by('pk').values_list('title', 'isbn')))
+
+    def test_split_ranges_align_to_lines(self):
+        ranges = parsing.split_ranges(self.path, 4)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        self.assertEqual(ranges[-1][1], len(data))
+        for start, _ in ranges:
+            self.assertEqual(data[start - 1:start], b'\n')
+
+    def test_resume_skips_committed_rows(self):
+        stat = os.stat(self.path)
+        with open(self.path + '.checkpoint', 'w') as f:
+            json.dump({'rows': 4, 'size': stat.st_size, 'mtime': stat.st_mtime}, f)
+        self.run_import('--resume')
+        self.assertEqual(list(Book.objects.values_list('title', flat=True)), ['Odes'])
+
+
+class QueryPlanTests(TestCase):
+    """Every query a view runs against the library tables must use an index."""
+
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user('staff', password='pw', is_staff=True)
+        self.student = User.objects.create_user('student', password='pw')
+        self.books = [Book.objects.create(title=f'Book {i}', author=f'Author {i % 3}',
+                                          category=f'Cat {i % 2}', publication_year=1990 + i)
+                      for i in range(6)]
+        self.pending = Borrowing.objects.create(student=self.student, book=self.books[0])
+        Borrowing.objects.create(student=self.staff, book=self.books[0])
+
+    def assert_indexed(self, method, url, user, data=None):
+        self.client.force_login(user)
+        with CaptureQueriesContext(connection) as ctx:
+            getattr(self.client, method)(url, data or {})
+        self.assert_plans_indexed(ctx, f'{url} {data}')
+
+    def assert_plans_indexed(self, ctx, label):
+        for query in ctx.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or 'library_' not in sql:
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+                plan = [row[-1] for row in cursor.fetchall()]
+            scans = [step for step in plan
+                     if step.startswith('SCAN library_') and 'INDEX' not in step
+                     and 'VIRTUAL TABLE' not in step]
+            self.assertEqual(scans, [], f'{label}: full scan in {sql}\n{plan}')
+
+    def test_book_list_filters_and_sorts(self):
+        for params in ({}, {'category': 'Cat 1'}, {'author': 'Author 2'}, {'available': '1'},
+                       {'sort': 'year'}, {'sort': '-author'}, {'sort': 'available'},
+                       {'q': 'book'}, {'category': 'Cat 0', 'sort': 'year'}):
+            with self.subTest(params=params):
+                self.assert_indexed('get', reverse('book_list'), self.student, params)
+
+    def test_borrowing_views(self):
+        book = self.books[1]
+        self.assert_indexed('get', reverse('book_detail', args=[book.pk]), self.student)
+        self.assert_indexed('post', reverse('request_book', args=[book.pk]), self.student)
+        self.assert_indexed('get', reverse('student_profile'), self.student)
+        self.assert_indexed('get', reverse('admin_pending_requests'), self.staff)
+        self.assert_indexed('get', reverse('admin_dashboard'), self.staff)
+        self.assert_indexed('post', reverse('approve_request', args=[self.pending.pk]), self.staff)
+        self.assert_indexed('get', reverse('admin_active_loans'), self.staff)
+        self.assert_indexed('post', reverse('return_loan', args=[self.pending.pk]), self.staff)
+
+    def test_overdue_sweep(self):
+        services.approve(self.pending.pk, now=timezone.now() - timedelta(days=30))
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(overdue.sweep(), 1)
+        self.assert_plans_indexed(ctx, 'sweep')
+
+
+class QueryCountTests(TestCase):
+    """Each view in library/urls.py runs a fixed number of queries, however many rows exist."""
+
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user('staff', password='pw', is_staff=True)
+        self.student = User.objects.create_user('student', password='pw')
+        self.books = Book.objects.bulk_create(
+            Book(title=f'Book {i}', author=f'Author {i % 4}', category=f'Cat {i % 3}') for i in range(40)
+        )
+        students = User.objects.bulk_create(User(username=f'reader{i}') for i in range(30))
+        Borrowing.objects.bulk_create(
+            Borrowing(student=s, book=self.books[i]) for i, s in enumerate(students)
+        )
+        Borrowing.objects.bulk_create(
+            Borrowing(student=self.student, book=book, status='REJECTED') for book in self.books[:30]
+        )
+        self.pending = Borrowing.objects.filter(status='PENDING').first()
+        DailyLoanCount.objects.create(day=timezone.localdate())
+
+    def assert_queries(self, num, method, url, user=None, data=None):
+        if user:
+            self.client.force_login(user)
+        with self.assertNumQueries(num):
+            response = getattr(self.client, method)(url, data or {})
+            if hasattr(response, 'streaming_content'):
+                b''.join(response.streaming_content)
+        return response
+
+    def test_student_views(self):
+        book = self.books[35]
+        # user (the session is cached; logging in reloads the user) + 2 facet lists (cold cache) + page
+        self.assert_queries(4, 'get', reverse('book_list'), self.student)
+        # cached page body
+        self.assert_queries(1, 'get', reverse('book_list'), self.student)
+        # warm facet cache, uncached page
+        self.assert_queries(2, 'get', reverse('book_list'), self.student, {'sort': 'year'})
+        self.assert_queries(2, 'get', reverse('book_list'), self.student, {'stream': '1'})
+        self.assert_queries(4, 'get', reverse('book_detail', args=[book.pk]), self.student)
+        # cached book row; user + active request + recommendations
+        self.assert_queries(3, 'get', reverse('book_detail', args=[book.pk]), self.student)
+        # user + live and archived history pages + waitlist places + recommendations
+        self.assert_queries(5, 'get', reverse('student_profile'), self.student)
+
+    def test_staff_views(self):
+        self.assert_queries(3, 'get', reverse('admin_dashboard'), self.staff)
+        self.assert_queries(2, 'get', reverse('admin_pending_requests'), self.staff)
+        self.staff.is_superuser = True
+        self.staff.save()
+        self.assert_queries(4, 'get', reverse('admin:library_borrowing_changelist'), self.staff)
+
+    def test_anonymous_views(self):
+        self.assert_queries(0, 'get', reverse('register'))
+        self.assert_queries(0, 'get', reverse('admin_login'))
+        self.assert_queries(0, 'get', reverse('admin_register'))
+
+    def test_write_views(self):
+        self.assert_queries(8, 'post', reverse('request_book', args=[self.books[35].pk]), self.student)
+        self.assert_queries(11, 'post', reverse('approve_request', args=[self.pending.pk]), self.staff)
+        other = Borrowing.objects.filter(status='PENDING').first()
+        self.assert_queries(6, 'post', reverse('reject_request', args=[other.pk]), self.staff)
+        self.assert_queries(10, 'post', reverse('register'),
+                            data={'username': 'new', 'password1': 'x8Yq!pLm2#', 'password2': 'x8Yq!pLm2#'})
+
+
+    def test_loan_and_waitlist_views(self):
+        loan = Borrowing.objects.filter(status='PENDING').last()
+        services.approve(loan.pk)
+        self.assert_queries(2, 'get', reverse('admin_active_loans'), self.staff)
+        # user + borrowing + savepoint, return, read back, counters, lock, queue head,
+        # shelve, read back, counters, release
+        self.assert_queries(12, 'post', reverse('return_loan', args=[loan.pk]), self.staff)
+        self.assert_queries(10, 'post', reverse('bulk_approve_requests'), self.staff, {'ids': [self.pending.pk]})
+
+        book = self.books[36]
+        book.is_available = False
+        book.save()
+        services.request_book(self.student, book)
+        # user + book + savepoint, lock, delete, release: later holders are not renumbered
+        self.assert_queries(6, 'post', reverse('leave_waitlist', args=[book.pk]), self.student)
+        # The live feed is off by default: only the user is loaded before the 404
+        self.assert_queries(1, 'get', reverse('book_events', args=[book.pk]), self.student)
+
+    def test_metrics_and_export_views(self):
+        # Metrics come from process memory
+        self.assert_queries(1, 'get', reverse('admin_metrics'), self.staff)
+        self.assert_queries(2, 'get', reverse('export_catalogue'), self.staff)
+        # user + live and archived borrowings
+        self.assert_queries(3, 'get', reverse('export_borrowings'), self.staff)
+
+    def test_api_views(self):
+        book = self.books[35]
+        self.assert_queries(2, 'get', reverse('api_book_list'), self.student)
+        self.assert_queries(2, 'get', reverse('api_book_suggest'), self.student, {'q': 'boo'})
+        self.assert_queries(2, 'get', reverse('api_book_detail', args=[book.pk]), self.student)
+        # user + live and archived borrowings
+        self.assert_queries(3, 'get', reverse('api_my_borrowings'), self.student)
+        self.assert_queries(2, 'get', reverse('api_pending_requests'), self.staff)
+
+        approve, reject, bulk = Borrowing.objects.filter(status='PENDING')[:3]
+        self.assert_queries(10, 'post', reverse('api_approve_request', args=[approve.pk]), self.staff)
+        self.assert_queries(5, 'post', reverse('api_reject_request', args=[reject.pk]), self.staff)
+        self.client.force_login(self.staff)
+        with self.assertNumQueries(10):
+            self.client.post(reverse('api_bulk_approve_requests'), {'ids': [bulk.pk]},
+                             content_type='application/json')
+        self.assert_queries(11, 'post', reverse('api_return_loan', args=[approve.pk]), self.staff)
+
+class BulkApproveTests(TestCase):
+    def setUp(self):
+        self.books = [Book.objects.create(title=f'Book {i}') for i in range(3)]
+        self.books[2].is_available = False
+        self.books[2].save()
+        self.students = [User.objects.create_user(f'student{i}') for i in range(3)]
+        # Created in order, so request_date increases with i
+        self.requests = {
+            (b, s): Borrowing.objects.create(student=self.students[s], book=self.books[b])
+            for b in range(3) for s in range(3)
+        }
+
+    def test_earliest_selected_request_wins_per_book(self):
+        selected = [self.requests[0, 2].pk, self.requests[0, 1].pk, self.requests[1, 2].pk,
+                    self.requests[2, 0].pk]
+        DailyLoanCount.objects.create(day=timezone.localdate())
+        # savepoint, 3 reads, 3 updates, queue tails + insert, counters, daily loans, release
+        with self.assertNumQueries(12):
+            outcomes = services.bulk_approve(selected)
+
+        self.assertEqual(outcomes[self.requests[0, 1].pk], services.APPROVED)
+        self.assertEqual(outcomes[self.requests[0, 2].pk], services.WAITLISTED)
+        self.assertEqual(outcomes[self.requests[0, 0].pk], services.WAITLISTED)
+        # Waitlisted in request order
+        self.assertEqual(list(Hold.objects.filter(book=self.books[0]).values_list('student', flat=True)),
+                         [self.students[0].pk, self.students[2].pk])
+        self.assertEqual(outcomes[self.requests[1, 2].pk], services.APPROVED)
+        self.assertEqual(outcomes[self.requests[2, 0].pk], services.UNAVAILABLE)
+        self.assertEqual(
+            Borrowing.objects.filter(book=self.books[1], status='APPROVED').get().student,
+            self.students[2],
+        )
+        self.assertEqual(Borrowing.objects.filter(book=self.books[2], status='PENDING').count(), 3)
+        self.assertEqual(list(Book.objects.order_by('pk').values_list('available_count', flat=True)),
+                         [0, 0, 0])
+
+    def test_staff_endpoint(self):
+        staff = User.objects.create_user('staff', is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.post(reverse('bulk_approve_requests'),
+                                    {'ids': [self.requests[0, 0].pk, self.requests[1, 1].pk]}, follow=True)
+        self.assertContains(response, '2 approved, 4 moved to the waitlist.')
+
+
+class ConcurrentBorrowingTests(TransactionTestCase):
+    """
+    Hammer the request/approve endpoints from many threads against the
+    file-backed test database and check the availability invariants.
+    """
+
+    def run_threads(self, target, args_list):
+        errors = []
+        barrier = threading.Barrier(len(args_list))
+
+        def run(*args):
+            try:
+                barrier.wait()
+                target(*args)
+            except Exception as e:  # surfaced by the assertion below
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=args) for args in args_list]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_only_one_approval_wins_per_book(self):
+        books = [Book.objects.create(title=f'Book {i}') for i in range(3)]
+        students = [User.objects.create_user(f'student{i}') for i in range(10)]
+        staff = [User.objects.create_user(f'staff{i}', is_staff=True) for i in range(4)]
+
+        def borrow(student):
+            client = Client()
+            client.force_login(student)
+            for book in random.sample(books, len(books)):
+                client.post(reverse('request_book', args=[book.pk]))
+
+        self.run_threads(borrow, [(s,) for s in students])
+        self.assertEqual(Borrowing.objects.filter(status='PENDING').count(), 30)
+
+        pending = list(Borrowing.objects.values_list('pk', flat=True))
+
+        def approve(member, use_bulk):
+            client = Client()
+            client.force_login(member)
+            if use_bulk:
+                client.post(reverse('bulk_approve_requests'), {'ids': random.sample(pending, 10)})
+            for pk in random.sample(pending, len(pending)):
+                client.post(reverse('approve_request', args=[pk]))
+
+        self.run_threads(approve, [(m, i % 2 == 0) for i, m in enumerate(staff)])
+
+        for book in Book.objects.all():
+            approved = book.borrowings.filter(status='APPROVED').count()
+            self.assertEqual(approved, 1, book.title)
+            self.assertFalse(book.is_available)
+            self.assertFalse(book.borrowings.filter(status='PENDING').exists())
+
+    def test_write_benchmark_on_the_wal_profile(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+        Book.objects.bulk_create(Book(title=f'Book {i}') for i in range(20))
+        stats.recount()
+
+        report = benchmark.write_throughput(clients=4, requests_per_client=5)
+        self.assertEqual(report['status_codes'], {'302': 20})
+        self.assertEqual(report['errors'], {})
+        self.assertGreater(report['requests_per_second'], 0)
+        self.assertEqual(report['database']['journal_mode'], 'wal')
+        # The throwaway students and their requests are gone again
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(Borrowing.objects.exists())
+        self.assertEqual(stats.current().requests_pending, 0)
+
+
+class LibraryStatsTests(TestCase):
+    def counters(self):
+        row = stats.current()
+        return (row.books_total, row.books_available, row.requests_pending, row.loans_active)
+
+    def test_counters_follow_every_write_path(self):
+        books = [Book.objects.create(title=f'Book {i}') for i in range(4)]
+        students = [User.objects.create_user(f'student{i}') for i in range(3)]
+        for student in students:
+            services.request_book(student, books[0])
+            services.request_book(student, books[1])
+        services.approve(Borrowing.objects.filter(book=books[0]).earliest('request_date').pk)
+        services.bulk_approve(Borrowing.objects.filter(book=books[1]).values_list('pk', flat=True)[:1])
+        services.request_book(students[0], books[2])
+        services.reject(Borrowing.objects.filter(book=books[2]).values_list('pk', flat=True))
+        books[3].is_available = False
+        books[3].save()
+        books[2].delete()
+
+        self.assertEqual(self.counters(), (3, 0, 0, 2))
+        self.assertEqual(self.counters(), tuple(getattr(stats.recount(), f) for f in
+                                                ('books_total', 'books_available',
+                                                 'requests_pending', 'loans_active')))
+        self.assertEqual(stats.loans_per_day()[-1], (timezone.localdate(), 2))
+
+    def test_recount_command_repairs_drift(self):
+        Book.objects.create(title='Book')
+        stats.adjust(books_total=5)
+        out = StringIO()
+        call_command('recount_stats', stdout=out)
+        self.assertIn('books_total: 6 -> 1', out.getvalue())
+        self.assertEqual(stats.current().books_total, 1)
+
+
+class CachingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        caching.reset_metrics()
+        self.student = User.objects.create_user('student')
+        self.books = [Book.objects.create(title=f'Book {i}') for i in range(3)]
+        self.client.force_login(self.student)
+
+    def test_list_pages_and_cards_are_cached_and_invalidated(self):
+        self.client.get(reverse('book_list'))
+        self.client.get(reverse('book_list'))
+        self.client.get(reverse('book_list'), {'sort': '-title'})
+        self.assertEqual(caching.metrics()['list']['hits'], 1)
+        self.assertEqual(caching.metrics()['card'], {'hits': 3, 'misses': 3, 'ratio': 0.5})
+
+        Borrowing.objects.create(student=self.student, book=self.books[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            services.approve(Borrowing.objects.get().pk)
+        self.assertIsNone(cache.get(caching.card_key(self.books[0].pk)))
+        self.assertIsNotNone(cache.get(caching.card_key(self.books[1].pk)))
+
+        response = self.client.get(reverse('book_list'))
+        self.assertEqual(caching.metrics()['list']['misses'], 3)
+        self.assertContains(response, 'Unavailable', count=1)
+
+    def test_book_detail_row_is_cached(self):
+        url = reverse('book_detail', args=[self.books[0].pk])
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.books[0].title = 'Renamed'
+            self.books[0].save()
+        self.assertContains(self.client.get(url), 'Renamed')
+        self.assertEqual(caching.metrics()['book']['misses'], 2)
+        self.assertEqual(self.client.get(reverse('book_detail', args=[999])).status_code, 404)
+
+    def test_cached_page_links_only_carry_list_params(self):
+        self.client.get(reverse('book_list'), {'per_page': 2, 'profile': '1', 'utm_source': 'x', 'stream': '0'})
+        other = Client()
+        other.force_login(User.objects.create_user('other'))
+        response = other.get(reverse('book_list'), {'per_page': 2})
+        self.assertEqual(caching.metrics()['list']['hits'], 1)
+        self.assertContains(response, '?per_page=2&amp;cursor=')
+        for param in ('profile', 'utm_source', 'stream'):
+            self.assertNotContains(response, param + '=')
+
+    def test_only_list_field_changes_retire_list_pages(self):
+        self.client.get(reverse('book_list'))
+        book = self.books[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            book.description = 'Now with a blurb'
+            book.isbn = '978-0'
+            book.save()
+        self.assertIsNone(cache.get(caching.card_key(book.pk)))
+        self.client.get(reverse('book_list'))
+        self.assertEqual(caching.metrics()['list']['hits'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book.category = 'Poetry'
+            book.save()
+        self.assertContains(self.client.get(reverse('book_list')), 'Poetry')
+        self.assertEqual(caching.metrics()['list'], {'hits': 1, 'misses': 2, 'ratio': 1 / 3})
+
+    def test_new_requests_keep_cached_list_pages(self):
+        self.client.get(reverse('book_list'))
+        with self.captureOnCommitCallbacks(execute=True):
+            services.request_book(self.student, self.books[1])
+        self.client.get(reverse('book_list'))
+        self.assertEqual(caching.metrics()['list']['hits'], 1)
+
+
+class ApiTests(TestCase):
+    def setUp(self):
+        self.student = User.objects.create_user('student')
+        self.staff = User.objects.create_user('staff', is_staff=True)
+        self.books = [Book.objects.create(title=f'Book {i}', author='Author', isbn=str(i)) for i in range(3)]
+        self.client.force_login(self.student)
+
+    def test_book_list_sparse_fields_and_cursor(self):
+        url = reverse('api_book_list')
+        data = self.client.get(url, {'fields': 'title,is_available', 'per_page': 2}).json()
+        self.assertEqual(data['results'][0], {'id': self.books[0].pk, 'title': 'Book 0', 'is_available': True})
+        data = self.client.get(url, {'fields': 'title', 'cursor': data['next_cursor']}).json()
+        self.assertEqual([row['title'] for row in data['results']], ['Book 2'])
+        self.assertIsNone(data['next_cursor'])
+        self.assertEqual(self.client.get(url, {'fields': 'password'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'cursor': 'junk'}).status_code, 400)
+
+    def test_conditional_get_until_availability_changes(self):
+        url = reverse('api_book_list')
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(1):  # page (session and user are cached by now)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        services.request_book(self.student, self.books[1])
+        self.client.force_login(self.staff)
+        response = self.client.post(reverse('api_approve_request', args=[Borrowing.objects.get().pk]))
+        self.assertEqual(response.json()['outcome'], services.APPROVED)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json()['results'][1]['is_available'])
+
+        detail = reverse('api_book_detail', args=[self.books[1].pk])
+        etag = self.client.get(detail)['ETag']
+        self.assertEqual(self.client.get(detail, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_borrowings_and_staff_queue(self):
+        services.request_book(self.student, self.books[0])
+        data = self.client.get(reverse('api_my_borrowings'), {'fields': 'book,status'}).json()
+        self.assertEqual(data['results'][0]['book'], {'id': self.books[0].pk, 'title': 'Book 0'})
+        self.assertEqual(self.client.get(reverse('api_pending_requests')).status_code, 403)
+
+        self.client.force_login(self.staff)
+        queue = self.client.get(reverse('api_pending_requests'), {'fields': 'student'}).json()
+        self.assertEqual(queue['results'], [{'id': Borrowing.objects.get().pk, 'student': 'student'}])
+        response = self.client.post(reverse('api_bulk_approve_requests'),
+                                    json.dumps({'ids': [queue['results'][0]['id']]}),
+                                    content_type='application/json')
+        self.assertEqual(response.json()['results'][0]['outcome'], services.APPROVED)
+
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse('api_book_list')).status_code, 401)
+
+
+@override_settings(LIBRARY_LIVE_UPDATES=True)
+class LiveFeedTests(TestCase):
+    def setUp(self):
+        self.student = User.objects.create_user('student')
+        self.other = User.objects.create_user('other')
+        self.book = Book.objects.create(title='Book')
+
+    async def test_feed_pushes_availability_and_own_request_status(self):
+        mine = await Borrowing.objects.acreate(student=self.student, book=self.book)
+        theirs = await Borrowing.objects.acreate(student=self.other, book=self.book)
+        await self.async_client.aforce_login(self.student)
+        response = await self.async_client.get(reverse('book_events', args=[self.book.pk]))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+
+        async def next_event():
+            return await asyncio.wait_for(anext(stream), 5)
+
+        self.assertEqual(await next_event(), b'retry: 5000\n\n')
+        self.assertIn(b'"is_available": true', await next_event())
+        self.assertTrue(live.has_subscribers(live.book_channel(self.book.pk)))
+
+        def approve_theirs():
+            with self.captureOnCommitCallbacks(execute=True):
+                services.approve(theirs.pk)
+
+        await sync_to_async(approve_theirs)()
+        self.assertIn(b'"is_available": false', await next_event())
+        # The other student's approval is not sent to this viewer
+        event = await next_event()
+        self.assertTrue(event.startswith(b'event: request\n'))
+        self.assertEqual(json.loads(event.split(b'data: ')[1]),
+                         {'type': 'request', 'book': self.book.pk, 'borrowing': mine.pk, 'status': 'WAITLISTED'})
+
+        # A client disconnect cancels the parked stream, which unsubscribes it
+        waiting = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertFalse(live.has_subscribers())
+
+    async def test_feed_only_opened_under_asgi_when_enabled(self):
+        await self.async_client.aforce_login(self.student)
+        page = await self.async_client.get(reverse('book_detail', args=[self.book.pk]))
+        self.assertContains(page, 'EventSource')
+        with self.settings(LIBRARY_LIVE_UPDATES=False):
+            page = await self.async_client.get(reverse('book_detail', args=[self.book.pk]))
+            self.assertNotContains(page, 'EventSource')
+            response = await self.async_client.get(reverse('book_events', args=[self.book.pk]))
+            self.assertEqual(response.status_code, 404)
+
+    def test_wsgi_pages_never_open_the_feed(self):
+        self.client.force_login(self.student)
+        self.assertNotContains(self.client.get(reverse('book_detail', args=[self.book.pk])), 'EventSource')
+        self.assertEqual(self.client.get(reverse('book_events', args=[self.book.pk])).status_code, 404)
+
+    async def test_streams_are_async_under_asgi(self):
+        staff = await User.objects.acreate(username='staff', is_staff=True)
+        await self.async_client.aforce_login(staff)
+        for url, params in ((reverse('book_list'), {'stream': '1'}),
+                            (reverse('export_catalogue'), {'format': 'csv'})):
+            with self.subTest(url=url):
+                response = await self.async_client.get(url, params)
+                self.assertTrue(response.is_async)
+                body = b''.join([chunk async for chunk in response.streaming_content])
+                self.assertIn(b'Book', body)
+
+
+class ReturnAndOverdueTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('staff', is_staff=True)
+        self.students = [User.objects.create_user(f'student{i}', email=f's{i}@example.com' if i % 2 else '')
+                         for i in range(6)]
+        self.books = [Book.objects.create(title=f'Book {i}') for i in range(6)]
+
+    def lend(self, student, book, approved):
+        services.request_book(student, book)
+        borrowing = Borrowing.objects.get(student=student, book=book, status='PENDING')
+        self.assertEqual(services.approve(borrowing.pk, now=approved), services.APPROVED)
+        borrowing.refresh_from_db()
+        return borrowing
+
+    def test_return_makes_book_available_again(self):
+        student, book = self.students[0], self.books[0]
+        now = timezone.now()
+        for _ in range(2):
+            # Borrowing the same book twice must not trip the active-request constraint
+            loan = self.lend(student, book, now)
+            self.assertEqual(loan.due_date, now + timedelta(days=14))
+            self.client.force_login(self.staff)
+            self.client.post(reverse('return_loan', args=[loan.pk]))
+            loan.refresh_from_db()
+            self.assertEqual(loan.status, 'RETURNED')
+            self.assertIsNotNone(loan.return_date)
+            self.assertTrue(Book.objects.get(pk=book.pk).is_available)
+
+        self.assertEqual(services.return_book(loan.pk), services.NOT_ON_LOAN)
+        counters = stats.current()
+        self.assertEqual((counters.loans_active, counters.books_available), (0, 6))
+
+    def test_sweep_marks_overdue_loans_in_batches(self):
+        now = timezone.now()
+        loans = [self.lend(student, book, now - timedelta(days=20))
+                 for student, book in zip(self.students[:5], self.books)]
+        self.lend(self.students[5], self.books[5], now)
+
+        out = StringIO()
+        call_command('sweep_overdue', '--batch-size', '2', '--notify', stdout=out)
+        self.assertIn('Marked 5 loans overdue', out.getvalue())
+        self.assertEqual(Borrowing.objects.filter(is_overdue=True).count(), 5)
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['s1@example.com', 's3@example.com'])
+        self.assertEqual(overdue.sweep(), 0)
+        self.assertEqual(stats.current().loans_overdue, 5)
+
+        services.return_book(loans[0].pk)
+        self.assertEqual(stats.current().loans_overdue, 4)
+        self.assertEqual(stats.recount().loans_overdue, 4)
+
+    def test_one_reminder_per_student_lists_every_overdue_book(self):
+        now = timezone.now()
+        student = self.students[1]
+        for book in self.books[:2]:
+            self.lend(student, book, now - timedelta(days=20))
+
+        self.assertEqual(overdue.sweep(notify=True), 2)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, [student.email])
+        for book in self.books[:2]:
+            self.assertIn(book.title, mail.outbox[0].body)
+
+
+class MultiCopyTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.book = Book.objects.create(title='Popular', copies=2, available_count=2)
+        self.students = [User.objects.create_user(f'student{i}') for i in range(4)]
+        for student in self.students:
+            services.request_book(student, self.book)
+        self.requests = list(Borrowing.objects.order_by('request_date', 'pk'))
+
+    def available(self):
+        return Book.objects.get(pk=self.book.pk).available_count
+
+    def test_each_approval_lends_one_copy(self):
+        self.assertEqual(services.approve(self.requests[0].pk), services.APPROVED)
+        self.assertEqual(self.available(), 1)
+        # Copies are left, so the queue is kept
+        self.assertEqual(Borrowing.objects.filter(status='PENDING').count(), 3)
+
+        self.assertEqual(services.approve(self.requests[1].pk), services.APPROVED)
+        self.assertEqual(self.available(), 0)
+        self.assertEqual(Borrowing.objects.filter(status='WAITLISTED').count(), 2)
+        self.assertEqual(stats.current().books_available, 0)
+
+        # Returned copies go to the waitlist before the shelf
+        services.return_book(self.requests[0].pk)
+        services.return_book(self.requests[1].pk)
+        self.assertEqual(self.available(), 0)
+        loans = Borrowing.objects.filter(status='APPROVED').order_by('pk')
+        self.assertEqual([loan.student for loan in loans], self.students[2:])
+        for loan in loans:
+            services.return_book(loan.pk)
+        self.assertEqual(self.available(), 2)
+        self.assertEqual(stats.current().books_available, 1)
+        self.assertEqual(stats.recount().books_available, 1)
+
+    def test_bulk_approve_fills_every_copy(self):
+        outcomes = services.bulk_approve([r.pk for r in self.requests[1:]])
+        self.assertEqual([outcomes[r.pk] for r in self.requests],
+                         [services.WAITLISTED, services.APPROVED, services.APPROVED, services.WAITLISTED])
+        self.assertEqual(self.available(), 0)
+
+    def test_available_filter_and_sort_use_the_counter(self):
+        Book.objects.create(title='Out', is_available=False)
+        Book.objects.create(title='Single')
+        self.client.force_login(self.students[0])
+        response = self.client.get(reverse('book_list'), {'available': '1', 'sort': 'available'})
+        self.assertEqual([b.title for b in response.context['books']], ['Popular', 'Single'])
+        self.assertContains(response, 'Available (2/2)')
+
+    def test_admin_borrowing_form_cannot_change_status(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='pw'))
+        request = self.requests[0]
+        url = reverse('admin:library_borrowing_change', args=[request.pk])
+        self.client.post(url, {'student': request.student_id, 'book': self.book.pk, 'status': 'APPROVED',
+                               'approved_date_0': '2024-01-01', 'approved_date_1': '10:00'})
+        self.assertEqual(Borrowing.objects.get(pk=request.pk).status, 'PENDING')
+        self.assertEqual(self.available(), 2)
+
+    def test_copies_change_through_the_service(self):
+        services.bulk_approve([r.pk for r in self.requests])
+        self.assertEqual(Hold.objects.count(), 2)
+        self.assertEqual(services.set_copies(self.book.pk, 1), services.TOO_FEW_COPIES)
+
+        # New copies serve the waitlist before the shelf
+        self.assertEqual(services.set_copies(self.book.pk, 5), services.UPDATED)
+        self.assertEqual(Borrowing.objects.filter(status='APPROVED').count(), 4)
+        self.assertEqual(Hold.objects.count(), 0)
+        self.assertEqual(self.available(), 1)
+        self.assertEqual(services.set_copies(self.book.pk, 4), services.UPDATED)
+        self.assertEqual(self.available(), 0)
+        self.assertEqual(stats.current().books_available, stats.recount().books_available)
+
+    def test_admin_form_never_writes_available_count(self):
+        staff = User.objects.create_superuser('admin', password='pw')
+        self.client.force_login(staff)
+        url = reverse('admin:library_book_change', args=[self.book.pk])
+        form = {'title': 'Popular', 'copies': 3}
+        # A loan approved after the librarian opened the form
+        services.approve(self.requests[0].pk)
+        self.assertEqual(self.client.post(url, form).status_code, 302)
+        book = Book.objects.get(pk=self.book.pk)
+        self.assertEqual((book.copies, book.available_count), (3, 2))
+
+        services.approve(self.requests[1].pk)
+        response = self.client.post(url, dict(form, copies=1))
+        self.assertContains(response, '2 copies are on loan')
+        self.assertEqual(Book.objects.get(pk=self.book.pk).copies, 3)
+
+
+class HoldQueueTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user('staff', is_staff=True)
+        self.book = Book.objects.create(title='Popular')
+        self.students = [User.objects.create_user(f'student{i}') for i in range(4)]
+        services.request_book(self.students[0], self.book)
+        self.loan = Borrowing.objects.get()
+        services.approve(self.loan.pk)
+
+    def places(self):
+        return list(holds.with_places(Hold.objects.filter(book=self.book)).values_list('student', 'place'))
+
+    def test_returned_copy_goes_to_the_head_of_the_queue(self):
+        for student in self.students[1:]:
+            self.assertEqual(services.request_book(student, self.book), services.QUEUED)
+        self.assertEqual(services.request_book(self.students[1], self.book), services.ALREADY_ACTIVE)
+
+        self.client.force_login(self.students[2])
+        self.assertContains(self.client.get(reverse('book_detail', args=[self.book.pk])),
+                            'You are #2 on the waitlist')
+
+        self.assertEqual(services.return_book(self.loan.pk), services.RETURNED)
+        loan = Borrowing.objects.get(status='APPROVED')
+        self.assertEqual(loan.student, self.students[1])
+        self.assertIsNotNone(loan.due_date)
+        self.assertFalse(Book.objects.get(pk=self.book.pk).is_available)
+        self.assertEqual(self.places(), [(self.students[2].pk, 1), (self.students[3].pk, 2)])
+        counters = stats.current()
+        self.assertEqual((counters.loans_active, counters.books_available), (1, 0))
+
+    def test_holder_with_an_active_request_is_skipped(self):
+        for student in self.students[1:3]:
+            services.request_book(student, self.book)
+        # e.g. a request made before the one-hold rules, or straight after a copy was shelved
+        direct = Borrowing.objects.create(student=self.students[1], book=self.book)
+        self.assertEqual(services.return_book(self.loan.pk), services.RETURNED)
+        self.assertEqual(Borrowing.objects.get(status='APPROVED').student, self.students[2])
+        self.assertEqual(Borrowing.objects.get(pk=direct.pk).status, 'PENDING')
+        self.assertFalse(Hold.objects.exists())
+
+    def test_leaving_moves_later_holders_up(self):
+        for student in self.students[1:]:
+            services.request_book(student, self.book)
+        tickets = dict(Hold.objects.values_list('student', 'position'))
+        self.client.force_login(self.students[1])
+        self.client.post(reverse('leave_waitlist', args=[self.book.pk]))
+        self.assertEqual(self.places(), [(self.students[2].pk, 1), (self.students[3].pk, 2)])
+        # Later holders keep their tickets; only the leaver's row is touched
+        self.assertEqual(dict(Hold.objects.values_list('student', 'position')),
+                         {pk: tickets[pk] for pk in (self.students[2].pk, self.students[3].pk)})
+        self.assertFalse(services.leave_waitlist(self.students[1], self.book))
+
+        services.request_book(self.students[1], self.book)
+        self.assertEqual(self.places()[-1], (self.students[1].pk, 3))
+
+    def test_place_lookup_reads_only_the_queue_index(self):
+        readers = User.objects.bulk_create(User(username=f'reader{i}') for i in range(10_000))
+        now = timezone.now()
+        holds.enqueue([(self.book.pk, reader.pk, now) for reader in readers])
+
+        last = Hold.objects.filter(student=readers[-1], book=self.book)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(holds.with_places(last).get().place, 10_000)
+        self.assertEqual(len(ctx.captured_queries), 1)
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + ctx.captured_queries[0]['sql'])
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertNotIn('SCAN library_hold', plan)
+        self.assertIn('COVERING INDEX hold_book_position_idx', plan)
+
+
+class ProfilingTests(TestCase):
+    def setUp(self):
+        profiling.reset_metrics()
+        cache.clear()
+        self.staff = User.objects.create_user('staff', is_staff=True)
+        self.student = User.objects.create_user('student')
+        self.book = Book.objects.create(title='Book')
+
+    def test_requests_are_timed_per_view(self):
+        self.client.force_login(self.student)
+        for _ in range(3):
+            self.client.get(reverse('student_profile'))
+        timings = profiling.metrics()['student_profile']
+        self.assertEqual(timings['count'], 3)
+        # history pages (live and archived), waitlist places
+        # and recommendations, plus the user once (the session is cached; the user is loaded
+        # lazily, inside the view)
+        self.assertEqual(timings['queries'], 13)
+        self.assertGreater(timings['template'][0], 0)
+        p50, p95, p99 = timings['wall']
+        self.assertTrue(0 < p50 <= p95 <= p99)
+
+    async def test_async_views_count_queries_run_in_worker_threads(self):
+        await self.async_client.aforce_login(self.student)
+        await self.async_client.get(reverse('book_detail', args=[self.book.pk]))
+        timings = profiling.metrics()['book_detail']
+        self.assertGreater(timings['queries'], 0)
+        self.assertGreater(timings['db'][0], 0)
+
+    def test_repeated_queries_are_reported(self):
+        def view(request):
+            for _ in range(3):
+                list(Book.objects.filter(pk=self.book.pk))
+            list(Book.objects.filter(pk=self.book.pk + 1))
+            return HttpResponse()
+
+        profiling.ProfilingMiddleware(view)(RequestFactory().get('/'))
+        timings = profiling.metrics()['<unresolved>']
+        self.assertEqual((timings['queries'], timings['duplicates']), (4, 2))
+
+    def test_metrics_endpoint(self):
+        self.client.force_login(self.student)
+        self.client.get(reverse('book_list'))
+        self.assertEqual(self.client.get(reverse('admin_metrics')).status_code, 302)
+
+        self.client.force_login(self.staff)
+        body = self.client.get(reverse('admin_metrics')).content.decode()
+        self.assertIn('library_request_seconds{view="book_list",quantile="0.99"}', body)
+        self.assertIn('library_db_queries_total{view="book_list"}', body)
+
+        self.client.logout()
+        with override_settings(LIBRARY_METRICS_TOKEN='s3cret'):
+            response = self.client.get(reverse('admin_metrics'), HTTP_AUTHORIZATION='Bearer s3cret')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+    def test_profile_report_is_staff_only(self):
+        url = reverse('book_detail', args=[self.book.pk]) + '?profile=1'
+        self.client.force_login(self.student)
+        self.assertContains(self.client.get(url), 'Book')
+        self.client.force_login(self.staff)
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        self.assertContains(response, 'function calls')
+
+    async def test_profile_report_covers_sync_views_under_asgi(self):
+        await self.async_client.aforce_login(self.staff)
+        response = await self.async_client.get(reverse('student_profile'), {'profile': '1'})
+        self.assertEqual(response['Content-Type'], 'text/plain; charset=utf-8')
+        # The view ran in a worker thread, outside the event loop's profiler
+        self.assertContains(response, '(student_profile)')
+
+    async def test_no_nested_profiler_when_one_profiles_every_thread(self):
+        # As on Python 3.12+, where the loop's profiler already sees the worker
+        # thread and a second cProfile.Profile().enable() raises ValueError
+        await self.async_client.aforce_login(self.staff)
+        with mock.patch.object(profiling, '_profiler_active', return_value=True), \
+                mock.patch.object(profiling.cProfile.Profile, 'runcall') as runcall:
+            response = await self.async_client.get(reverse('student_profile'), {'profile': '1'})
+        runcall.assert_not_called()
+        self.assertContains(response, 'function calls')
+
+
+class SeedAndBenchmarkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        call_command('seed_library', '--books', '60', '--students', '15', '--loans-per-student', '6',
+                     stdout=StringIO())
+
+    def test_seeded_data_is_consistent_and_reproducible(self):
+        self.assertEqual((Book.objects.count(), User.objects.count()), (60, 15))
+        self.assertTrue(Borrowing.objects.filter(status='RETURNED').exists())
+        # Copies on the shelf match the loans out
+        for book in Book.objects.all():
+            on_loan = book.borrowings.filter(status='APPROVED').count()
+            self.assertEqual(book.available_count, book.copies - on_loan)
+        # Bulk-inserted books are in the search index
+        first = Book.objects.order_by('pk').first()
+        self.assertIn(first, search.search_books(Book.objects.all(), first.title))
+        counters = stats.current()
+        self.assertEqual(counters.loans_active, Borrowing.objects.filter(status='APPROVED').count())
+        self.assertLess(Borrowing.objects.earliest('request_date').request_date,
+                        timezone.now() - timedelta(days=seeding.ACTIVE_DAYS))
+
+        titles = list(Book.objects.order_by('pk').values_list('title', flat=True))
+        statuses = list(Borrowing.objects.order_by('pk').values_list('status', flat=True))
+        call_command('seed_library', '--books', '60', '--students', '15', '--loans-per-student', '6',
+                     '--prefix', 'again', stdout=StringIO())
+        self.assertEqual(list(Book.objects.order_by('pk').values_list('title', flat=True)[60:]), titles)
+        self.assertEqual(list(Borrowing.objects.order_by('pk').values_list('status', flat=True)
+                              [len(statuses):]), statuses)
+
+    def test_benchmark_report_leaves_the_database_untouched(self):
+        borrowings = list(Borrowing.objects.values_list('pk', 'status'))
+        report = benchmark.Benchmark(iterations=2, warmup=0).run()
+        self.assertEqual(list(Borrowing.objects.values_list('pk', 'status')), borrowings)
+        self.assertFalse(User.objects.filter(username=benchmark.STAFF_USERNAME).exists())
+
+        scenarios = report['scenarios']
+        self.assertIn('book_list[category,sort=year]', scenarios)
+        self.assertEqual(scenarios['request_book']['status_codes'], {'302': 2})
+        self.assertEqual(scenarios['approve_request']['status_codes'], {'302': 2})
+        self.assertGreater(scenarios['book_detail']['queries']['min'], 0)
+        self.assertLessEqual(scenarios['book_detail']['latency_ms']['p50'],
+                             scenarios['book_detail']['latency_ms']['p99'])
+        self.assertEqual(json.loads(json.dumps(report))['data']['books'], 60)
+
+        rows = dict((name, queries) for name, _, _, queries in benchmark.compare(report, report))
+        self.assertEqual(rows['pending_requests'], 0)
+
+    def test_auth_benchmark_counts_saved_queries(self):
+        report = benchmark.auth_queries(iterations=2)
+        self.assertEqual(report['pages']['book_list'], {'before': 2, 'after': 0, 'saved': 2})
+        self.assertEqual(report['pages']['pending_requests']['saved'], 2)
+        self.assertFalse(User.objects.filter(username=benchmark.STAFF_USERNAME).exists())
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.staff = User.objects.create_user('staff', is_staff=True)
+        self.student = User.objects.create_user('student')
+        self.books = [
+            Book.objects.create(title='Dune', author='Frank Herbert', isbn='111', category='Fiction',
+                                publication_year=1965, description='Spice,\n"sand" and worms', copies=2,
+                                available_count=2),
+            Book.objects.create(title='Odes', author='Keats', category='Poetry'),
+            Book.objects.create(title='SPQR', author='Mary Beard', isbn='333', category='History',
+                                publication_year=2015, description='Rome'),
+        ]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_catalogue_export_round_trips_through_import_books(self):
+        fields = ('title', 'author', 'isbn', 'category', 'publication_year', 'description')
+        before = list(Book.objects.order_by('title').values_list(*fields))
+        path = os.path.join(self.tmp.name, 'catalogue.csv.gz')
+        call_command('export_catalogue', '--output', path, '--chunk-size', '2', stderr=StringIO())
+
+        Book.objects.all().delete()
+        call_command('import_books', path, stdout=StringIO())
+        self.assertEqual(list(Book.objects.order_by('title').values_list(*fields)), before)
+
+    def test_catalogue_export_round_trips_copies(self):
+        Book.objects.filter(pk=self.books[2].pk).update(copies=3, available_count=3)
+        path = os.path.join(self.tmp.name, 'catalogue.csv')
+        call_command('export_catalogue', '--output', path, stderr=StringIO())
+
+        Book.objects.all().delete()
+        call_command('import_books', path, stdout=StringIO())
+        self.assertEqual(dict(Book.objects.values_list('title', 'copies')), {'Dune': 2, 'Odes': 1, 'SPQR': 3})
+        self.assertEqual(Book.objects.get(title='SPQR').available_count, 3)
+
+    def test_catalogue_download_takes_book_list_filters(self):
+        url = reverse('export_catalogue')
+        self.client.force_login(self.student)
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        self.client.force_login(self.staff)
+        response = self.client.get(url, {'format': 'jsonl', 'category': 'Fiction'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([(row['title'], row['available_count']) for row in rows], [('Dune', 2)])
+
+        response = self.client.get(url, {'gzip': '1', 'sort': '-year', 'available': '1'})
+        self.assertIn('.csv.gz', response['Content-Disposition'])
+        reader = csv.reader(gzip.decompress(b''.join(response.streaming_content)).decode().splitlines())
+        self.assertEqual([row[3] for row in reader], ['Title Name', 'SPQR', 'Dune', 'Odes'])
+
+    def test_borrowing_export_filters(self):
+        now = timezone.now()
+        for book in self.books:
+            services.request_book(self.student, book)
+        services.approve(Borrowing.objects.get(book=self.books[0]).pk)
+        Borrowing.objects.filter(book=self.books[2]).update(request_date=now - timedelta(days=10))
+
+        self.client.force_login(self.staff)
+        url = reverse('export_borrowings')
+        body = b''.join(self.client.get(url, {'status': 'pending', 'category': 'Poetry'}).streaming_content)
+        rows = list(csv.DictReader(body.decode().splitlines()))
+        self.assertEqual([(row['title'], row['username'], row['status']) for row in rows],
+                         [('Odes', 'student', 'PENDING')])
+
+        since = (now - timedelta(days=1)).date().isoformat()
+        lines = b''.join(self.client.get(url, {'format': 'jsonl', 'since': since}).streaming_content)
+        self.assertEqual(sorted(json.loads(line)['title'] for line in lines.splitlines()), ['Dune', 'Odes'])
+
+        self.assertEqual(self.client.get(url, {'status': 'lost'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'since': 'yesterday'}).status_code, 400)
+        with self.assertRaisesMessage(CommandError, "Unknown status 'LOST'"):
+            call_command('export_borrowings', '--status', 'lost')
+
+    def test_borrowings_export_builder(self):
+        for book in self.books:
+            services.request_book(self.student, book)
+        Borrowing.objects.filter(book=self.books[2]).update(request_date=timezone.now() - timedelta(days=10))
+
+        def titles(params):
+            return [row[2] for row in exports.borrowings(params, chunk_size=1).rows]
+
+        self.assertEqual(titles({}), ['SPQR', 'Dune', 'Odes'])
+        until = (timezone.localdate() - timedelta(days=5)).isoformat()
+        self.assertEqual(titles({'until': until}), ['SPQR'])
+        self.assertEqual(titles({'q': 'dune', 'status': 'pending'}), ['Dune'])
+        self.assertEqual(titles({'status': 'approved'}), [])
+        with self.assertRaisesMessage(ValueError, 'until must be a date'):
+            exports.borrowings({'until': '2024-13-01'})
+
+
+class TypeaheadTests(TestCase):
+    def setUp(self):
+        typeahead.reset()
+        self.addCleanup(typeahead.reset)
+        self.books = [
+            Book.objects.create(title='Dune', author='Frank Herbert', isbn='978-0-441-17271-9'),
+            Book.objects.create(title='Dune Messiah', author='Frank Herbert'),
+            Book.objects.create(title='The Left Hand of Darkness', author='Ursula K. Le Guin'),
+            Book.objects.create(title='Les Misérables', author='Victor Hugo'),
+        ]
+
+    def titles(self, prefix, limit=8):
+        return [suggestion['title'] for suggestion in typeahead.suggest(prefix, limit)]
+
+    def test_prefix_word_author_isbn_and_accent_matches(self):
+        self.assertEqual(self.titles('du'), ['Dune', 'Dune Messiah'])
+        self.assertEqual(self.titles('du', limit=1), ['Dune'])
+        self.assertEqual(self.titles('left h'), ['The Left Hand of Darkness'])
+        self.assertEqual(self.titles('herb'), ['Dune', 'Dune Messiah'])
+        self.assertEqual(typeahead.suggest('le gu')[0]['match'], 'author')
+        self.assertEqual(self.titles('9780441'), ['Dune'])
+        self.assertEqual(self.titles('LES MISER'), ['Les Misérables'])
+        self.assertEqual(self.titles('  '), [])
+        self.assertEqual(self.titles('x' * 60), [])
+
+    def test_index_follows_book_changes_on_commit(self):
+        self.assertEqual(self.titles('found'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            book = Book.objects.create(title='Foundation', author='Isaac Asimov')
+        self.assertEqual(self.titles('found'), ['Foundation'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book.title = 'Second Foundation'
+            book.save()
+        self.assertEqual(self.titles('found'), ['Second Foundation'])
+        self.assertEqual(self.titles('second'), ['Second Foundation'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            book.delete()
+        self.assertEqual(self.titles('found'), [])
+        self.assertEqual(len(typeahead.get_index()), 4)
+
+    def test_suggestion_endpoint(self):
+        self.client.force_login(User.objects.create_user('student'))
+        url = reverse('api_book_suggest')
+        typeahead.get_index()
+        with self.assertNumQueries(1):  # user, reloaded after logging in
+            data = self.client.get(url, {'q': 'dune m'}).json()
+        self.assertEqual(data['suggestions'], [{'id': self.books[1].pk, 'title': 'Dune Messiah',
+                                                'author': 'Frank Herbert', 'match': 'title'}])
+        self.assertEqual(len(self.client.get(url, {'q': 'd', 'limit': 1}).json()['suggestions']), 1)
+        self.assertEqual(self.client.get(url, {'q': 'd', 'limit': 'all'}).status_code, 400)
+        self.assertContains(self.client.get(reverse('book_list')), 'list="q-suggestions"')
+
+    def test_benchmark_reports_memory_and_latency(self):
+        report = benchmark.typeahead_footprint(titles=500, queries=50)
+        self.assertEqual(report['entries']['title'], 500)
+        self.assertGreater(report['memory_bytes'], 0)
+        self.assertEqual(report['queries'], 50)
+        self.assertLess(report['latency_us']['p50'], 1000)
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.books = Book.objects.bulk_create(Book(title=f'Book {i}', isbn=str(i)) for i in range(6))
+        self.students = User.objects.bulk_create(User(username=f'reader{i}') for i in range(6))
+
+    def read(self, student, *books, status='RETURNED'):
+        Borrowing.objects.bulk_create(
+            Borrowing(student=student, book=self.books[i], status=status, approved_date=timezone.now())
+            for i in books
+        )
+
+    def neighbours(self, i):
+        return [(r.recommended.title, r.co_readers) for r in recommendations.for_book(self.books[i].pk)]
+
+    def test_cosine_neighbours_from_read_loans(self):
+        # Books 0 and 1 share three readers; book 2 is on every shelf; 5 was only requested
+        for student in self.students[:3]:
+            self.read(student, 0, 1, 2)
+        self.read(self.students[3], 2, 3)
+        self.read(self.students[4], 2, 3, 4)
+        Borrowing.objects.create(student=self.students[0], book=self.books[5])
+
+        result = recommendations.rebuild()
+        self.assertEqual((result.students, result.full), (5, True))
+        # 1 beats the bestseller 2 (3 shared readers of 3 vs 3 of 5)
+        self.assertEqual(self.neighbours(0), [('Book 1', 3), ('Book 2', 3)])
+        self.assertEqual(self.neighbours(3), [('Book 2', 2)])
+        self.assertEqual(self.neighbours(4), [])  # one shared reader is below MIN_CO_READERS
+        self.assertEqual(self.neighbours(5), [])
+
+        self.read(self.students[3], 0, 1)
+        self.assertEqual([row['title'] for row in recommendations.for_student(self.students[3])], [])
+        self.assertEqual([row['title'] for row in recommendations.for_student(self.students[4])], ['Book 0', 'Book 1'])
+
+    def test_incremental_rebuild_only_touches_books_read_since(self):
+        for student in self.students[:2]:
+            self.read(student, 0, 1)
+        for student in self.students[4:]:
+            self.read(student, 3, 4)
+        call_command('recommend_books', stdout=StringIO())
+        self.assertEqual(self.neighbours(0), [('Book 1', 2)])
+        before = set(Recommendation.objects.filter(book=self.books[3]).values_list('pk', flat=True))
+
+        since = recommendations.last_computed()
+        for student in self.students[2:4]:
+            self.read(student, 0, 2)
+        out = StringIO()
+        call_command('recommend_books', stdout=out)
+        self.assertIn('Updating books read since', out.getvalue())
+        self.assertGreater(recommendations.last_computed(), since)
+        self.assertEqual(self.neighbours(0), [('Book 1', 2), ('Book 2', 2)])
+        self.assertEqual(self.neighbours(2), [('Book 0', 2)])
+        # Books nobody new read keep their rows
+        self.assertEqual(set(Recommendation.objects.filter(book=self.books[3]).values_list('pk', flat=True)), before)
+
+    def test_pages_show_recommendations(self):
+        for student in self.students[:2]:
+            self.read(student, 0, 1)
+        recommendations.rebuild()
+        self.client.force_login(self.students[5])
+        self.assertContains(self.client.get(reverse('book_detail', args=[self.books[0].pk])), 'Readers also borrowed')
+        self.assertNotContains(self.client.get(reverse('student_profile')), 'Recommended for You')
+
+        self.read(self.students[5], 1)
+        response = self.client.get(reverse('student_profile'))
+        self.assertContains(response, 'Recommended for You')
+        self.assertContains(response, reverse('book_detail', args=[self.books[0].pk]))
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    """A primary and a stale copy of it, as two SQLite files."""
+
+    REPLICA = 'replica_test'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.path = os.path.join(cls.tmp.name, 'replica.sqlite3')
+        # Added after the test runner set up its databases, so it leaves this one alone
+        connections.settings[cls.REPLICA] = {**connections['default'].settings_dict, 'NAME': cls.path}
+        cls.databases = frozenset({'default', cls.REPLICA})
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[cls.REPLICA].close()
+        del connections[cls.REPLICA]
+        del connections.settings[cls.REPLICA]
+        cls.tmp.cleanup()
+
+    def setUp(self):
+        cache.clear()
+        self.student = User.objects.create_user('student')
+        self.staff = User.objects.create_user('staff', is_staff=True, is_superuser=True)
+        self.old = Book.objects.create(title='Old Book')
+        self.client.force_login(self.student)
+        self.staff_client = Client()
+        self.staff_client.force_login(self.staff)
+
+        # Snapshot the primary; rows written after this are missing from the replica
+        connections[self.REPLICA].close()
+        target = sqlite3.connect(self.path)
+        connection.ensure_connection()
+        connection.connection.backup(target)
+        target.close()
+        self.new = Book.objects.create(title='New Book')
+
+        overridden = override_settings(LIBRARY_READ_REPLICAS=[self.REPLICA])
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+
+    def test_read_views_use_the_replica_until_the_client_writes(self):
+        self.assertEqual(self.client.get(reverse('book_detail', args=[self.new.pk])).status_code, 404)
+        self.assertNotContains(self.client.get(reverse('book_list')), 'New Book')
+        self.assertContains(self.client.get(reverse('book_list'), {'q': 'old'}), 'Old Book')
+
+        # The write goes to the primary and pins this client's reads there
+        response = self.client.post(reverse('request_book', args=[self.old.pk]))
+        self.assertIn(routing.COOKIE_NAME, response.cookies)
+        self.assertTrue(Borrowing.objects.using('default').filter(book=self.old).exists())
+        self.assertFalse(Borrowing.objects.using(self.REPLICA).exists())
+        self.assertContains(self.client.get(reverse('book_detail', args=[self.new.pk])), 'New Book')
+        self.assertContains(self.client.get(reverse('student_profile')), 'Old Book')
+
+        # Other clients still read the replica; so does this one once the window has passed
+        newer = Book.objects.create(title='Newer Book')
+        self.assertNotContains(self.staff_client.get(reverse('admin:library_book_changelist')), 'New Book')
+        self.client.cookies[routing.COOKIE_NAME] = '0'
+        self.assertEqual(self.client.get(reverse('book_detail', args=[newer.pk])).status_code, 404)
+
+    def test_writes_and_code_outside_views_use_the_primary(self):
+        router = routing.ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Book))
+        self.assertEqual(router.db_for_write(Book), 'default')
+        self.assertFalse(router.allow_migrate(self.REPLICA, 'library'))
+        self.assertIsNone(router.allow_migrate('default', 'library'))
+
+        path = os.path.join(self.tmp.name, 'books.csv')
+        write_catalogue_csv(path, [('Fiction', '999', 'Imported Book', 'Someone', '')])
+        call_command('import_books', path, stdout=StringIO())
+        self.assertTrue(Book.objects.using('default').filter(title='Imported Book').exists())
+        self.assertFalse(Book.objects.using(self.REPLICA).filter(title='Imported Book').exists())
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.student = User.objects.create_user('student')
+        self.books = [Book.objects.create(title=f'Book {i}', isbn=str(i)) for i in range(7)]
+        now = timezone.now()
+
+        def borrowing(i, status, days_ago):
+            b = Borrowing.objects.create(student=self.student, book=self.books[i], status=status)
+            when = now - timedelta(days=days_ago)
+            Borrowing.objects.filter(pk=b.pk).update(request_date=when, updated_at=when,
+                                                     approved_date=when if status == 'RETURNED' else None)
+            return b
+
+        self.old_returned = borrowing(0, 'RETURNED', 400)
+        self.old_rejected = borrowing(1, 'REJECTED', 300)
+        self.recent_returned = borrowing(2, 'RETURNED', 5)
+        self.old_approved = borrowing(3, 'APPROVED', 200)  # still on loan
+        self.pending = borrowing(4, 'PENDING', 1)
+        self.older_approved = borrowing(6, 'APPROVED', 600)  # older than the archived rows
+
+    def test_command_moves_old_closed_rows_in_batches(self):
+        stats.recount()
+        before = stats.current()
+        out = StringIO()
+        call_command('archive_borrowings', '--older-than', '30', '--batch-size', '1', '-v', '2', stdout=out)
+        self.assertIn('Archived 2 borrowings in 2 batches', out.getvalue())
+
+        self.assertEqual(set(ArchivedBorrowing.objects.values_list('pk', 'status')),
+                         {(self.old_returned.pk, 'RETURNED'), (self.old_rejected.pk, 'REJECTED')})
+        self.assertEqual(set(Borrowing.objects.values_list('pk', flat=True)),
+                         {self.recent_returned.pk, self.old_approved.pk, self.pending.pk, self.older_approved.pk})
+        after = stats.recount()
+        self.assertEqual((after.requests_pending, after.loans_active), (before.requests_pending, before.loans_active))
+        # Loan history still counts the archived loan
+        self.assertEqual(stats.recount_daily_loans(), 2)
+
+        self.assertEqual(list(archive.archive(30)), [])
+        with self.assertRaises(CommandError):
+            call_command('archive_borrowings', stdout=StringIO(), stderr=StringIO())
+
+    def test_repeat_rejections_of_the_same_book(self):
+        for _ in range(2):
+            services.request_book(self.student, self.books[5])
+            services.reject([Borrowing.objects.get(book=self.books[5], status='PENDING').pk])
+        self.assertEqual(Borrowing.objects.filter(book=self.books[5], status='REJECTED').count(), 2)
+
+    def test_profile_merges_live_and_archived_history_by_date(self):
+        list(archive.archive(30))
+        self.client.force_login(self.student)
+        url = reverse('student_profile')
+        titles = []
+        cursor = None
+        for _ in range(3):
+            response = self.client.get(url, {'per_page': 2, **({'cursor': cursor} if cursor else {})})
+            page = response.context['borrowings']
+            titles += [b.book.title for b in page]
+            cursor = page.next_cursor
+        self.assertIsNone(cursor)
+        self.assertEqual(titles, ['Book 4', 'Book 2', 'Book 3', 'Book 1', 'Book 0', 'Book 6'])
+
+    def test_api_lists_archived_borrowings(self):
+        list(archive.archive(30))
+        self.client.force_login(self.student)
+        url = reverse('api_my_borrowings')
+        ids, cursor = [], None
+        for _ in range(3):
+            data = self.client.get(url, {'per_page': 2, 'fields': 'book', **({'cursor': cursor} if cursor else {})}).json()
+            ids += [row['id'] for row in data['results']]
+            cursor = data['next_cursor']
+        self.assertIsNone(cursor)
+        self.assertEqual(ids, [self.pending.pk, self.recent_returned.pk, self.old_approved.pk,
+                               self.old_rejected.pk, self.old_returned.pk, self.older_approved.pk])
+
+    def test_borrowing_export_includes_the_archive(self):
+        list(archive.archive(30))
+        rows = list(exports.borrowings({}).rows)
+        self.assertEqual([row[2] for row in rows], ['Book 6', 'Book 0', 'Book 1', 'Book 3', 'Book 2', 'Book 4'])
+        self.assertEqual([row[2] for row in exports.borrowings({'status': 'rejected'}).rows], ['Book 1'])
+
+
+class CachedAuthTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = User.objects.create_user('staff', password='old-pw', is_staff=True)
+        self.client.force_login(self.staff)
+        self.client.get(reverse('admin_pending_requests'))
+
+    def test_warm_requests_skip_session_and_user_queries(self):
+        with self.assertNumQueries(1):  # the queue page
+            self.client.get(reverse('admin_pending_requests'))
+        self.assertGreater(caching.metrics()['user']['hits'], 0)
+
+    def test_password_hash_stays_out_of_the_cache(self):
+        entry = cache.get(caching.user_key(self.staff.pk))
+        self.assertNotIn(self.staff.password, repr(entry))
+        user = caching.get_user(self.staff.pk)
+        self.assertEqual((user.username, user.is_staff), ('staff', True))
+        self.assertEqual(user.get_session_auth_hash(), self.staff.get_session_auth_hash())
+        # Saving the cached user leaves the stored password alone
+        user.save()
+        self.assertTrue(User.objects.get(pk=self.staff.pk).check_password('old-pw'))
+
+    def test_changing_your_own_password_keeps_you_logged_in(self):
+        response = self.client.post(reverse('admin:password_change'), {
+            'old_password': 'old-pw', 'new_password1': 'Brand-new-pw-42', 'new_password2': 'Brand-new-pw-42',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.client.get(reverse('admin_dashboard')).status_code, 200)
+        self.assertTrue(User.objects.get(pk=self.staff.pk).check_password('Brand-new-pw-42'))
+
+    def test_staff_and_password_changes_apply_on_the_next_request(self):
+        self.staff.is_staff = False
+        self.staff.save()
+        self.assertEqual(self.client.get(reverse('admin_pending_requests')).status_code, 302)
+
+        self.staff.is_staff = True
+        self.staff.save()
+        self.assertEqual(self.client.get(reverse('admin_pending_requests')).status_code, 200)
+
+        # A new password ends the existing sessions
+        self.staff.set_password('new-pw')
+        self.staff.save()
+        response = self.client.get(reverse('student_profile'))
+        self.assertRedirects(response, f"{reverse('login')}?next={reverse('student_profile')}",
+                             fetch_redirect_response=False)
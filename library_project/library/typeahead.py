@@ -0,0 +1,219 @@
+"""
+In-process prefix index for search-box suggestions.
+
+The index is a set of sorted arrays, one per kind of match: whole titles,
+title words (the title from its second word on), authors and ISBNs. Each
+array pairs a normalized key with a book id. A lookup is a ``bisect`` to the
+first key with the typed prefix followed by a short forward scan, so it
+costs O(log n + k) and never touches the database.
+
+The index is loaded from one ``values_list`` pass on first use. After that
+the Book signals (and the bulk import paths) patch it once their
+transaction commits. Like the cache metrics it is per process: changes made
+by other processes show up when the index is reloaded, which happens in the
+background once it is MAX_AGE seconds old.
+"""
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+
+from django.db import connection, transaction
+
+# Suggestion order: a title that starts with the prefix beats an author
+# match, which beats a match further into a title
+KINDS = ('title', 'author', 'word', 'isbn')
+# Keys are cut here; typing beyond it still matches, the scan just checks more
+MAX_KEY = 40
+MAX_AGE = 600
+LOAD_CHUNK_SIZE = 5000
+
+
+def normalize(text):
+    """Casefolded, accent-free words separated by single spaces."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c if c.isalnum() else ' ' for c in text if not unicodedata.combining(c))
+    return ' '.join(text.casefold().split())
+
+
+def _isbn_key(isbn):
+    return ''.join(c for c in (isbn or '').casefold() if c.isalnum())
+
+
+def _keys(title, author, isbn):
+    """``(kind, key)`` pairs a book is found under."""
+    title, author = normalize(title), normalize(author)
+    if title:
+        yield 'title', title[:MAX_KEY]
+        words = title.split(' ')
+        for i in range(1, len(words)):
+            yield 'word', ' '.join(words[i:])[:MAX_KEY]
+    if author:
+        words = author.split(' ')
+        for i in range(len(words)):
+            yield 'author', ' '.join(words[i:])[:MAX_KEY]
+    isbn = _isbn_key(isbn)
+    if isbn:
+        yield 'isbn', isbn
+
+
+class Index:
+    """Sorted ``keys``/``ids`` arrays per kind, plus ``books``: id -> (title, author, isbn)."""
+
+    def __init__(self):
+        self.keys = {kind: [] for kind in KINDS}
+        self.ids = {kind: array('q') for kind in KINDS}
+        self.books = {}
+
+    @classmethod
+    def build(cls, rows):
+        """An index over ``(pk, title, author, isbn)`` rows."""
+        index = cls()
+        entries = {kind: [] for kind in KINDS}
+        for pk, title, author, isbn in rows:
+            index.books[pk] = (title, author, isbn)
+            for kind, key in _keys(title, author, isbn):
+                entries[kind].append((key, pk))
+        for kind, pairs in entries.items():
+            pairs.sort()
+            index.keys[kind] = [key for key, _ in pairs]
+            index.ids[kind] = array('q', (pk for _, pk in pairs))
+        return index
+
+    def add(self, pk, title, author, isbn):
+        self.remove(pk)
+        self.books[pk] = (title, author, isbn)
+        for kind, key in _keys(title, author, isbn):
+            i = bisect_right(self.keys[kind], key)
+            self.keys[kind].insert(i, key)
+            self.ids[kind].insert(i, pk)
+
+    def remove(self, pk):
+        book = self.books.pop(pk, None)
+        if book is None:
+            return
+        for kind, key in _keys(*book):
+            keys, ids = self.keys[kind], self.ids[kind]
+            i = bisect_left(keys, key)
+            while i < len(keys) and keys[i] == key:
+                if ids[i] == pk:
+                    del keys[i]
+                    del ids[i]
+                    break
+                i += 1
+
+    def suggest(self, prefix, limit=8):
+        """Up to ``limit`` ``{'id', 'title', 'author', 'match'}`` dicts for books matching ``prefix``."""
+        text = normalize(prefix)
+        if not text:
+            return []
+        probes = {kind: text for kind in KINDS}
+        probes['isbn'] = _isbn_key(prefix)
+        # Long prefixes are compared against the cut keys
+        short = {kind: probe[:MAX_KEY] for kind, probe in probes.items()}
+
+        found = []
+        seen = set()
+        for kind in KINDS:
+            keys, ids, probe = self.keys[kind], self.ids[kind], short[kind]
+            if not probe:
+                continue
+            i = bisect_left(keys, probe)
+            while i < len(keys) and len(found) < limit and keys[i].startswith(probe):
+                pk = ids[i]
+                i += 1
+                if pk in seen:
+                    continue
+                title, author, isbn = self.books[pk]
+                if len(probes[kind]) > MAX_KEY and probes[kind] not in normalize(
+                        isbn if kind == 'isbn' else author if kind == 'author' else title):
+                    continue
+                seen.add(pk)
+                found.append({'id': pk, 'title': title, 'author': author, 'match': kind})
+            if len(found) >= limit:
+                break
+        return found
+
+    def __len__(self):
+        return len(self.books)
+
+
+_index = None
+_loaded_at = 0.0
+_reloading = False
+_lock = threading.Lock()
+
+
+def _load():
+    from .models import Book
+    rows = Book.objects.values_list('pk', 'title', 'author', 'isbn').iterator(chunk_size=LOAD_CHUNK_SIZE)
+    return Index.build(rows)
+
+
+def _reload_in_background():
+    global _index, _loaded_at, _reloading
+    try:
+        index = _load()
+        with _lock:
+            _index, _loaded_at = index, time.monotonic()
+    finally:
+        _reloading = False
+        connection.close()
+
+
+def get_index():
+    """The process's index, loading it on first use and refreshing it when old."""
+    global _index, _loaded_at, _reloading
+    with _lock:
+        index, age = _index, time.monotonic() - _loaded_at
+        if index is not None and age > MAX_AGE and not _reloading:
+            _reloading = True
+            threading.Thread(target=_reload_in_background, daemon=True).start()
+    if index is None:
+        index = _load()
+        with _lock:
+            if _index is None:
+                _index, _loaded_at = index, time.monotonic()
+            index = _index
+    return index
+
+
+def suggest(prefix, limit=8):
+    index = get_index()
+    with _lock:
+        return index.suggest(prefix, limit)
+
+
+def books_changed(books):
+    """Patch the index with new or edited books once the transaction commits."""
+    rows = [(book.pk, book.title, book.author, book.isbn) for book in books]
+
+    def patch():
+        with _lock:
+            if _index is not None:
+                for row in rows:
+                    _index.add(*row)
+
+    if rows:
+        transaction.on_commit(patch)
+
+
+def books_removed(pks):
+    pks = list(pks)
+
+    def patch():
+        with _lock:
+            if _index is not None:
+                for pk in pks:
+                    _index.remove(pk)
+
+    if pks:
+        transaction.on_commit(patch)
+
+
+def reset():
+    """Forget the index; the next lookup reloads it."""
+    global _index
+    with _lock:
+        _index = None
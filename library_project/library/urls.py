@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views
+from . import api, views
 
 urlpatterns = [
     # Student dashboard, shows all books
@@ -7,9 +7,15 @@ urlpatterns = [
     
     # Book detail page
     path('book/<int:pk>/', views.book_detail, name='book_detail'),
+
+    # Live availability / request-status feed for the book page (server-sent events)
+    path('book/<int:pk>/events/', views.book_events, name='book_events'),
     
     # POST endpoint to request a book
     path('book/<int:pk>/request/', views.request_book, name='request_book'),
+
+    # POST endpoint to leave a book's waitlist
+    path('book/<int:pk>/leave-waitlist/', views.leave_waitlist, name='leave_waitlist'),
     
     # Student profile page
     path('profile/', views.student_profile, name='student_profile'),
@@ -21,9 +27,26 @@ urlpatterns = [
     path('staff/dashboard/', views.admin_dashboard, name='admin_dashboard'),
     path('staff/pending-requests/', views.pending_requests, name='admin_pending_requests'),
     path('staff/pending-requests/<int:pk>/approve/', views.approve_request, name='approve_request'),
+    path('staff/pending-requests/approve/', views.bulk_approve_requests, name='bulk_approve_requests'),
     path('staff/pending-requests/<int:pk>/reject/', views.reject_request, name='reject_request'),
+    path('staff/loans/', views.active_loans, name='admin_active_loans'),
+    path('staff/loans/<int:pk>/return/', views.return_loan, name='return_loan'),
+    path('staff/metrics/', views.metrics, name='admin_metrics'),
+    path('staff/exports/catalogue/', views.export_catalogue, name='export_catalogue'),
+    path('staff/exports/borrowings/', views.export_borrowings, name='export_borrowings'),
     
     # Admin Login and Registration
     path('staff/login/', views.admin_login, name='admin_login'),
     path('staff/register/', views.admin_register, name='admin_register'),
+
+    # JSON API
+    path('api/books/', api.book_list, name='api_book_list'),
+    path('api/books/suggest/', api.book_suggestions, name='api_book_suggest'),
+    path('api/books/<int:pk>/', api.book_detail, name='api_book_detail'),
+    path('api/me/borrowings/', api.my_borrowings, name='api_my_borrowings'),
+    path('api/staff/requests/', api.pending_requests, name='api_pending_requests'),
+    path('api/staff/requests/approve/', api.bulk_approve_requests, name='api_bulk_approve_requests'),
+    path('api/staff/requests/<int:pk>/approve/', api.approve_request, name='api_approve_request'),
+    path('api/staff/requests/<int:pk>/reject/', api.reject_request, name='api_reject_request'),
+    path('api/staff/loans/<int:pk>/return/', api.return_loan, name='api_return_loan'),
 ]
\ No newline at end of file
@@ -1,10 +1,20 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db import IntegrityError
-from django.db.models import Q
-from .models import Book, Borrowing
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from .models import ArchivedBorrowing, Book, Borrowing, Hold
+from . import caching, exports, holds, live, pagination, profiling, recommendations, routing, services, stats
+from .catalogue import CatalogueQuery
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, QueryDict, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
+from django.template.loader import render_to_string
 from django.utils import timezone
+from django.utils.safestring import mark_safe
 
 # Registration and admin helpers
 from django.contrib.auth.forms import UserCreationForm
@@ -12,87 +22,222 @@ from django.contrib.auth import login as auth_login
 from django.contrib.admin.views.decorators import staff_member_required
 from django.views.decorators.http import require_POST
 
+async def _auser(request):
+    # Resolve the user once and let templates (request.user) reuse it
+    request.user = await request.auser()
+    return request.user
+
+
+# The read-heavy pages are async views: cache hits are served on the event
+# loop and only misses drop into a worker thread for the ORM and templates.
+arender = sync_to_async(render)
+
+RECOMMENDATIONS_SHOWN = 6
+
+
 @login_required
-def book_list(request):
+@routing.replica_reads
+async def book_list(request):
     """
     Display a list of all books, showing their availability.
     """
-    # Filtering/searching/sorting support
-    q = request.GET.get('q', '').strip()
-    category = request.GET.get('category', '')
-    author = request.GET.get('author', '')
-    available = request.GET.get('available', '')  # '1' for only available
-
-    # Sorting support via ?sort=title|author|year|available
-    sort = request.GET.get('sort', 'title')
-    sort_map = {
-        'title': 'title',
-        'author': 'author',
-        'year': 'publication_year',
-        'available': '-is_available',  # show available first
-        '-title': '-title',
-        '-author': '-author',
-        '-year': '-publication_year',
-        '-available': 'is_available',
-    }
+    await _auser(request)
+    streaming = request.GET.get('stream') == '1'
+
+    # The page body does not depend on the user, so it is cached per query
+    if not streaming:
+        body = await caching.aget_list_body(request.GET)
+        if body is not None:
+            return await arender(request, 'library/book_list.html', {'body': body})
 
-    order_field = sort_map.get(sort, 'title')
+    return await sync_to_async(_render_book_list)(request, streaming)
 
-    books_qs = Book.objects.all()
 
-    if q:
-        books_qs = books_qs.filter(
-            Q(title__icontains=q) |
-            Q(author__icontains=q) |
-            Q(description__icontains=q) |
-            Q(isbn__icontains=q)
-        )
+def _render_book_list(request, streaming):
+    # Filtering/searching/sorting support
+    query = CatalogueQuery(request.GET)
+
+    context = {
+        'current_sort': query.sort,
+        'q': query.q,
+        'selected_category': query.category,
+        'selected_author': query.author,
+        'selected_available': query.available,
+        'categories': query.category_choices(),
+        'authors': query.author_choices(),
+    }
+
+    # ?stream=1 renders every matching row in chunks instead of one page
+    if streaming:
+        return _stream_book_list(request, pagination.ordered(query.books, query.order_field), context)
 
-    if category:
-        books_qs = books_qs.filter(category=category)
+    page = _paginate(request, query.books, query.order_field)
+    context['books'] = page
+    context['cards'] = caching.book_cards(page)
+    context.update(_page_context(request, page, caching.LIST_PARAMS))
+    body = render_to_string('library/book_list_body.html', context)
+    caching.set_list_body(request.GET, body)
+    return render(request, 'library/book_list.html', {'body': mark_safe(body)})
 
-    if author:
-        books_qs = books_qs.filter(author=author)
 
-    if available == '1':
-        books_qs = books_qs.filter(is_available=True)
+def _page_context(request, page, names=None):
+    """
+    Template context for the shared first/next page links. With ``names``,
+    the links keep only those query parameters, normalized the way
+    ``caching.list_key`` does, so a cached page can't carry another
+    client's extra parameters.
+    """
+    if names is None:
+        params = request.GET.copy()
+    else:
+        params = QueryDict(mutable=True)
+        for name in names:
+            value = request.GET.get(name, '').strip()
+            if value:
+                params[name] = value
+    params.pop('cursor', None)
+    first_query = params.urlencode()
+    next_query = None
+    if page.has_next:
+        params['cursor'] = page.next_cursor
+        next_query = params.urlencode()
+    return {'page': page, 'first_query': first_query, 'next_query': next_query}
+
+
+def _paginate(request, queryset, order_field):
+    return pagination.paginate(
+        queryset,
+        order_field,
+        cursor=request.GET.get('cursor'),
+        page_size=pagination.parse_page_size(request.GET.get('per_page')),
+    )
+
+
+STREAM_CHUNK_SIZE = 500
+STREAM_MARKER = '<!-- book-rows -->'
+
+
+def _stream_book_list(request, books_qs, context):
+    """
+    Stream the catalogue page: the surrounding page is rendered once and split
+    at the rows marker, then rows are rendered in chunks read with .iterator().
+    """
+    body = render_to_string('library/book_list_body.html', dict(context, streaming=True))
+    page_html = render_to_string('library/book_list.html', {'body': mark_safe(body)}, request=request)
+    head, tail = page_html.split(STREAM_MARKER, 1)
+
+    def rows():
+        yield head
+        chunk = []
+        for book in books_qs.iterator(chunk_size=STREAM_CHUNK_SIZE):
+            chunk.append(book)
+            if len(chunk) >= STREAM_CHUNK_SIZE:
+                yield ''.join(caching.book_cards(chunk))
+                chunk = []
+        if chunk:
+            yield ''.join(caching.book_cards(chunk))
+        yield tail
+
+    return _streaming_response(request, rows(), content_type='text/html; charset=utf-8')
+
+
+def _streaming_response(request, chunks, **kwargs):
+    """
+    A StreamingHttpResponse over the sync iterator ``chunks``.
 
-    books = books_qs.order_by(order_field)
+    Django buffers a sync iterator whole under ASGI (and an async one under
+    WSGI), so under ASGI the chunks are pulled one at a time in a worker
+    thread instead.
+    """
+    if isinstance(request, ASGIRequest):
+        chunks = _aiterate(chunks)
+    return StreamingHttpResponse(chunks, **kwargs)
 
-    # Get distinct categories and authors for filter dropdowns
-    categories = Book.objects.exclude(category__isnull=True).exclude(category__exact='').order_by('category').values_list('category', flat=True).distinct()
-    authors = Book.objects.exclude(author__isnull=True).exclude(author__exact='').order_by('author').values_list('author', flat=True).distinct()
 
-    return render(request, 'library/book_list.html', {
-        'books': books,
-        'current_sort': sort,
-        'q': q,
-        'selected_category': category,
-        'selected_author': author,
-        'selected_available': available,
-        'categories': categories,
-        'authors': authors,
-    })
+async def _aiterate(chunks):
+    chunks = iter(chunks)
+    done = object()
+    # Thread-sensitive, so an open .iterator() cursor stays on its connection's thread
+    next_chunk = sync_to_async(next, thread_sensitive=True)
+    while (chunk := await next_chunk(chunks, done)) is not done:
+        yield chunk
 
 @login_required
-def book_detail(request, pk):
+@routing.replica_reads
+async def book_detail(request, pk):
     """
     Show details for a single book and allow requesting it.
     """
-    book = get_object_or_404(Book, pk=pk)
-    
+    user = await _auser(request)
+    book = await caching.aget_book(pk)
+    if book is None:
+        raise Http404('No Book matches the given query.')
+
     # Check if the user has an active (pending or approved) request
-    existing_request = Borrowing.objects.filter(
-        student=request.user,
+    existing_request = await Borrowing.objects.filter(
+        student=user,
         book=book,
         status__in=['PENDING', 'APPROVED']
-    ).first()
+    ).afirst()
+
+    # ...or is waiting for a copy
+    hold = None
+    if existing_request is None and not book.is_available:
+        hold = await holds.with_places(Hold.objects.filter(student=user, book=book)).afirst()
+
+    also_borrowed = [r.recommended async for r in recommendations.for_book(book.pk, RECOMMENDATIONS_SHOWN)]
     
-    return render(request, 'library/book_detail.html', {
+    return await arender(request, 'library/book_detail.html', {
         'book': book,
-        'existing_request': existing_request
+        'existing_request': existing_request,
+        'hold': hold,
+        'also_borrowed': also_borrowed,
+        'live_updates': live.enabled(request),
     })
 
+
+EVENTS_KEEPALIVE = 25  # seconds; keeps proxies from closing idle streams
+
+
+def _sse(event, data):
+    return f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+
+@login_required
+async def book_events(request, pk):
+    """
+    Server-sent events for a book page: availability changes, and approvals
+    or rejections of the viewer's own requests for the book.
+    """
+    if not live.enabled(request):
+        raise Http404('Live updates are not enabled.')
+    user = await _auser(request)
+    if not await Book.objects.filter(pk=pk).aexists():
+        raise Http404('No Book matches the given query.')
+
+    async def events():
+        # Subscribe before reading the current state so no change is missed
+        with live.subscribe(live.book_channel(pk)) as subscription:
+            book = await Book.objects.only('available_count').aget(pk=pk)
+            yield 'retry: 5000\n\n'
+            yield _sse('availability', {'type': 'availability', 'book': pk, 'is_available': book.is_available})
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                if event['type'] == 'request':
+                    if event['student'] != user.pk:
+                        continue
+                    event = {key: value for key, value in event.items() if key != 'student'}
+                yield _sse(event['type'], event)
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # don't let nginx buffer the stream
+    return response
+
 @login_required
 def request_book(request, pk):
     """
@@ -103,38 +248,57 @@ def request_book(request, pk):
 
     book = get_object_or_404(Book, pk=pk)
 
-    # Check if book is available
-    if not book.is_available:
-        messages.error(request, "This book is currently unavailable.")
+    # Availability and duplicate checks happen atomically in the service
+    outcome = services.request_book(request.user, book)
+    if outcome == services.QUEUED:
+        messages.info(request, "Every copy is out, so you have joined the waitlist for this book.")
         return redirect('book_detail', pk=pk)
-
-    # Check if user already has an active request
-    has_active_request = Borrowing.objects.filter(
-        student=request.user,
-        book=book,
-        status__in=['PENDING', 'APPROVED']
-    ).exists()
-
-    if has_active_request:
+    if outcome == services.ALREADY_ACTIVE:
         messages.warning(request, "You already have an active request for this book.")
         return redirect('book_detail', pk=pk)
-        
-    # Create the pending request
-    try:
-        Borrowing.objects.create(student=request.user, book=book, status='PENDING')
-        messages.success(request, "Your request to borrow this book has been submitted.")
-    except IntegrityError:
-         messages.error(request, "An error occurred. You may have already requested this book.")
 
+    messages.success(request, "Your request to borrow this book has been submitted.")
     return redirect('book_list')
 
 @login_required
+@require_POST
+def leave_waitlist(request, pk):
+    book = get_object_or_404(Book, pk=pk)
+    if services.leave_waitlist(request.user, book):
+        messages.success(request, "You have left the waitlist for this book.")
+    return redirect('book_detail', pk=pk)
+
+@login_required
+@routing.replica_reads
 def student_profile(request):
     """
-    Show the logged-in student's profile with their borrowing history.
+    Show the logged-in student's profile with their borrowing history,
+    live and archived borrowings together, newest request first.
     """
-    borrowings = Borrowing.objects.filter(student=request.user).order_by('-request_date')
-    return render(request, 'library/student_profile.html', {'borrowings': borrowings})
+    fields = ('status', 'request_date', 'approved_date', 'due_date', 'return_date', 'is_overdue', 'book__title')
+    history = [
+        model.objects.filter(student=request.user).select_related('book').only(*fields)
+        for model in (Borrowing, ArchivedBorrowing)
+    ]
+    page = pagination.paginate_merged(
+        history,
+        '-request_date',
+        cursor=request.GET.get('cursor'),
+        page_size=pagination.parse_page_size(request.GET.get('per_page')),
+    )
+    # Waitlist places and recommendations, shown above the history on its first page
+    waiting = suggested = []
+    if page.is_first:
+        waiting = holds.with_places(
+            Hold.objects.filter(student=request.user).select_related('book').only('position', 'book__title')
+        ).order_by('created_at')
+        suggested = recommendations.for_student(request.user, RECOMMENDATIONS_SHOWN)
+    return render(request, 'library/student_profile.html', {
+        'borrowings': page,
+        'holds': waiting,
+        'recommended': suggested,
+        **_page_context(request, page),
+    })
 
 
 def register(request):
@@ -176,56 +340,146 @@ def register(request):
 @staff_member_required
 def admin_dashboard(request):
     """Simple admin dashboard showing counts and quick links."""
-    total_books = Book.objects.count()
-    available = Book.objects.filter(is_available=True).count()
-    pending_requests = Borrowing.objects.filter(status='PENDING').count()
+    # Counters are maintained on every change, so this is a single-row read
+    counters = stats.current()
     return render(request, 'library/admin_dashboard.html', {
-        'total_books': total_books,
-        'available': available,
-        'pending_requests': pending_requests,
+        'total_books': counters.books_total,
+        'available': counters.books_available,
+        'pending_requests': counters.requests_pending,
+        'active_loans': counters.loans_active,
+        'overdue_loans': counters.loans_overdue,
+        'loans_per_day': stats.loans_per_day(),
+        'cache_metrics': sorted(caching.metrics().items()),
+        'request_metrics': sorted(profiling.metrics().items()),
     })
 
 
+@staff_member_required
+def _staff_metrics(request):
+    return HttpResponse(profiling.render_metrics(), content_type=profiling.CONTENT_TYPE)
+
+
+def metrics(request):
+    """Per-view timings in the Prometheus text format, for staff or a scraper holding the token."""
+    token = settings.LIBRARY_METRICS_TOKEN
+    if token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(profiling.render_metrics(), content_type=profiling.CONTENT_TYPE)
+    return _staff_metrics(request)
+
+
+def _export_response(request, kind, build):
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in exports.FORMATS:
+        return HttpResponseBadRequest(f"Unknown format; use one of {', '.join(exports.FORMATS)}.")
+    try:
+        export = build(request.GET)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    compress = request.GET.get('gzip') == '1'
+    response = _streaming_response(
+        request,
+        export.stream(fmt, compress),
+        content_type='application/gzip' if compress else exports.CONTENT_TYPES[fmt],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{exports.filename(kind, fmt, compress)}"'
+    return response
+
+
+@staff_member_required
+def export_catalogue(request):
+    """Download the catalogue, filtered like book_list (?format=csv|jsonl&gzip=1)."""
+    return _export_response(request, 'catalogue', exports.catalogue)
+
+
+@staff_member_required
+def export_borrowings(request):
+    """Download borrowings (?status=&since=&until=, book_list filters, ?format=csv|jsonl&gzip=1)."""
+    return _export_response(request, 'borrowings', exports.borrowings)
+
+
 @staff_member_required
 def pending_requests(request):
     """Show pending borrowing requests for admin to act on."""
-    requests_qs = Borrowing.objects.filter(status='PENDING').order_by('request_date')
-    return render(request, 'library/admin_pending_requests.html', {'requests': requests_qs})
+    requests_qs = (
+        Borrowing.objects.filter(status='PENDING')
+        .select_related('book', 'student')
+        .only('request_date', 'book__title', 'student__username')
+    )
+    page = _paginate(request, requests_qs, 'request_date')
+    return render(request, 'library/admin_pending_requests.html', {
+        'requests': page,
+        **_page_context(request, page),
+    })
+
+
+@staff_member_required
+def active_loans(request):
+    """Books currently on loan, soonest due first, with a check-in button."""
+    loans_qs = (
+        Borrowing.objects.filter(status='APPROVED')
+        .select_related('book', 'student')
+        .only('approved_date', 'due_date', 'is_overdue', 'book__title', 'student__username')
+    )
+    page = _paginate(request, loans_qs, 'due_date')
+    return render(request, 'library/admin_active_loans.html', {
+        'loans': page,
+        'now': timezone.now(),
+        **_page_context(request, page),
+    })
+
+
+@staff_member_required
+@require_POST
+def return_loan(request, pk):
+    borrowing = get_object_or_404(Borrowing.objects.select_related('book', 'student'), pk=pk)
+    if services.return_book(borrowing.pk) == services.NOT_ON_LOAN:
+        messages.warning(request, 'This book is not on loan.')
+        return redirect('admin_active_loans')
+
+    messages.success(request, f'"{borrowing.book.title}" returned by {borrowing.student.username}.')
+    return redirect('admin_active_loans')
 
 
 @staff_member_required
 @require_POST
 def approve_request(request, pk):
-    borrowing = get_object_or_404(Borrowing, pk=pk)
-    if borrowing.status != 'PENDING':
+    borrowing = get_object_or_404(Borrowing.objects.select_related('book', 'student'), pk=pk)
+
+    # The service re-checks the status and availability with conditional updates
+    outcome = services.approve(borrowing.pk)
+    if outcome == services.NOT_PENDING:
         messages.warning(request, 'This request is no longer pending.')
         return redirect('admin_pending_requests')
+    if outcome == services.UNAVAILABLE:
+        messages.error(request, f'"{borrowing.book.title}" is already on loan.')
+        return redirect('admin_pending_requests')
 
-    borrowing.status = 'APPROVED'
-    borrowing.approved_date = timezone.now()
-    borrowing.save()
+    messages.success(request, f'Request for "{borrowing.book.title}" by {borrowing.student.username} approved.')
+    return redirect('admin_pending_requests')
 
-    borrowing.book.is_available = False
-    borrowing.book.save()
 
-    # Reject other pending requests for this book
-    Borrowing.objects.filter(book=borrowing.book, status='PENDING').exclude(pk=borrowing.pk).update(status='REJECTED')
+@staff_member_required
+@require_POST
+def bulk_approve_requests(request):
+    """Approve the requests ticked on the pending-requests page."""
+    ids = [int(pk) for pk in request.POST.getlist('ids') if pk.isdigit()]
+    if not ids:
+        messages.warning(request, 'No requests were selected.')
+        return redirect('admin_pending_requests')
 
-    messages.success(request, f'Request for "{borrowing.book.title}" by {borrowing.student.username} approved.')
+    outcomes = services.bulk_approve(ids)
+    messages.success(request, f'Selected requests processed: {services.summarize(outcomes)}')
     return redirect('admin_pending_requests')
 
 
 @staff_member_required
 @require_POST
 def reject_request(request, pk):
-    borrowing = get_object_or_404(Borrowing, pk=pk)
-    if borrowing.status != 'PENDING':
+    borrowing = get_object_or_404(Borrowing.objects.select_related('book', 'student'), pk=pk)
+    if not services.reject([borrowing.pk]):
         messages.warning(request, 'This request is no longer pending.')
         return redirect('admin_pending_requests')
 
-    borrowing.status = 'REJECTED'
-    borrowing.save()
-
     messages.success(request, f'Request for "{borrowing.book.title}" by {borrowing.student.username} rejected.')
     return redirect('admin_pending_requests')
 
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,10 +43,15 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Replica routing and read-your-writes pinning; outside the session
+    # middleware so session saves count as writes
+    'library.routing.ReadYourWritesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # Per-view timings for /staff/metrics/ and ?profile=1 (needs request.user)
+    'library.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -54,7 +60,8 @@ ROOT_URLCONF = 'library_project.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # The stock backend, with render times reported to the profiler
+        'BACKEND': 'library.profiling.DjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -72,13 +79,119 @@ WSGI_APPLICATION = 'library_project.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
+# LIBRARY_DB selects the profile: 'sqlite' (default) or 'postgres'.
+
+LIBRARY_DB = os.environ.get('LIBRARY_DB', 'sqlite')
+
+if LIBRARY_DB == 'postgres':
+    # Needs psycopg 3 with its pool extra (pip install "psycopg[pool]")
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('LIBRARY_DB_NAME', 'library'),
+            'USER': os.environ.get('LIBRARY_DB_USER', ''),
+            'PASSWORD': os.environ.get('LIBRARY_DB_PASSWORD', ''),
+            'HOST': os.environ.get('LIBRARY_DB_HOST', ''),
+            'PORT': os.environ.get('LIBRARY_DB_PORT', ''),
+            # The pool keeps connections open between requests, so
+            # CONN_MAX_AGE stays 0 (Django requires it with a pool)
+            'OPTIONS': {
+                'pool': {
+                    'min_size': int(os.environ.get('LIBRARY_DB_POOL_MIN', 2)),
+                    'max_size': int(os.environ.get('LIBRARY_DB_POOL_MAX', 10)),
+                    'timeout': 10,
+                },
+            },
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('LIBRARY_DB_NAME', BASE_DIR / 'db.sqlite3'),
+            'OPTIONS': {
+                # Take the write lock when a transaction starts, so borrowing
+                # transitions that read before they write are serialized instead
+                # of failing with "database is locked" on lock upgrade
+                'transaction_mode': 'IMMEDIATE',
+                # busy_timeout: seconds a writer waits for the lock before giving up
+                'timeout': 20,
+                # Run on every new connection. WAL lets readers carry on while a
+                # write commits and makes commits an append; synchronous=NORMAL
+                # is durable against crashes of the app in WAL mode (a power
+                # loss may drop the last commits, never corrupt the file).
+                # 128 MB of the file is memory-mapped and each connection keeps
+                # a 64 MB page cache. LIBRARY_SQLITE_JOURNAL_MODE=DELETE restores
+                # the old rollback journal, e.g. to compare with benchmark_writes.
+                'init_command': (
+                    f"PRAGMA journal_mode={os.environ.get('LIBRARY_SQLITE_JOURNAL_MODE', 'WAL')};"
+                    'PRAGMA synchronous=NORMAL;'
+                    'PRAGMA mmap_size=134217728;'
+                    'PRAGMA cache_size=-65536;'
+                ),
+            },
+            'TEST': {
+                # File-backed so the concurrency tests exercise real SQLite locking
+                'NAME': BASE_DIR / 'test_db.sqlite3',
+            },
+        }
+    }
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Keep connections open across requests (re-opening pays the pragmas and,
+# on PostgreSQL, a network handshake) and check them before reuse
+DATABASES['default']['CONN_MAX_AGE'] = (
+    0 if LIBRARY_DB == 'postgres' else int(os.environ.get('LIBRARY_DB_CONN_MAX_AGE', 600))
+)
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# Read replicas: LIBRARY_DB_REPLICAS lists replica SQLite files (or PostgreSQL
+# hosts with LIBRARY_DB=postgres), comma-separated. They become the
+# 'replica1', 'replica2', ... aliases that library.routing sends the
+# read-only views to; writes always go to 'default'. Replicas are kept in
+# sync outside Django (streaming replication, Litestream, ...).
+LIBRARY_READ_REPLICAS = []
+for i, location in enumerate(filter(None, os.environ.get('LIBRARY_DB_REPLICAS', '').split(',')), 1):
+    replica = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+    replica['HOST' if LIBRARY_DB == 'postgres' else 'NAME'] = location.strip()
+    DATABASES[f'replica{i}'] = replica
+    LIBRARY_READ_REPLICAS.append(f'replica{i}')
+
+# Seconds a client's reads stay on the primary after it writes (read-your-writes);
+# should exceed the replicas' lag
+LIBRARY_READ_YOUR_WRITES_SECONDS = int(os.environ.get('LIBRARY_READ_YOUR_WRITES_SECONDS', 5))
+
+DATABASE_ROUTERS = ['library.routing.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# LIBRARY_CACHE selects the backend: 'locmem' (default, per process),
+# 'file' (shared by processes on one host) or 'redis' (LIBRARY_CACHE_URL).
+
+LIBRARY_CACHE = os.environ.get('LIBRARY_CACHE', 'locmem')
+
+if LIBRARY_CACHE == 'redis':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('LIBRARY_CACHE_URL', 'redis://127.0.0.1:6379/1'),
+            'KEY_PREFIX': 'library',
+        }
+    }
+elif LIBRARY_CACHE == 'file':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('LIBRARY_CACHE_URL', str(BASE_DIR / 'cache')),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'library',
+        }
     }
-}
 
 
 # Password validation
@@ -122,6 +235,30 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Sessions are read from the cache and written through to the database, and
+# the user of each request comes from the cache too (see library.auth)
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+AUTHENTICATION_BACKENDS = ['library.auth.CachedModelBackend']
+
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'book_list'
-LOGOUT_REDIRECT_URL = 'login'
\ No newline at end of file
+LOGOUT_REDIRECT_URL = 'login'
+
+# Loans
+# Days a book may be kept after approval; the overdue sweep
+# (manage.py sweep_overdue) marks loans past their due date.
+
+LIBRARY_LOAN_DAYS = 14
+
+# Live book pages
+# LIBRARY_LIVE_UPDATES=1 turns on the server-sent-events feed on book pages.
+# Only set it when serving through ASGI (library_project.asgi); the feed is
+# never opened for requests served over WSGI.
+
+LIBRARY_LIVE_UPDATES = os.environ.get('LIBRARY_LIVE_UPDATES') == '1'
+
+# Profiling
+# /staff/metrics/ serves the per-view timings to staff sessions, or to a
+# Prometheus scraper sending "Authorization: Bearer <LIBRARY_METRICS_TOKEN>".
+
+LIBRARY_METRICS_TOKEN = os.environ.get('LIBRARY_METRICS_TOKEN', '')